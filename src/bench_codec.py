@@ -0,0 +1,87 @@
+"""
+FuseLink 帧编码基准测试
+
+比较原先的 JSON（indent=4）帧、标准库紧凑 JSON 与各子协议编码（fuselink.json 在安装 orjson 时使用 orjson）
+在每条消息字节数和编码/解码 CPU 耗时上的差异。
+测试消息取自服务端与客户端实际收发的三类帧：验证结果、数据消息和处理结果。
+
+用法:
+    python bench_codec.py
+    python bench_codec.py --number 20000
+"""
+
+
+from fuselink import totp, wire_protocols
+from argparse import ArgumentParser
+from json import dumps, loads
+from timeit import timeit
+from time import time
+
+
+def messages():
+    """
+    构造具有代表性的测试消息。
+
+    Returns:
+        dict: 以消息类型为键、消息字典为值的字典。
+    """
+    network = {"send": ["192.168.1.20", 53124], "recv": ["192.168.1.21", 53188]}
+    verif = {
+        "utc": int(time()),
+        "verif": totp("b81ea4ce0dc4", type="client_0a1b2c3d4e5f", code="592156"),
+        "network": network,
+        "code": "Verification successful! You can now proceed with your operation."
+    }
+    data = {
+        "utc": int(time()),
+        "verif": verif["verif"],
+        "network": network,
+        "code": {"sensor": "thermo-01", "values": [21.5, 21.6, 21.4, 21.7], "unit": "C", "seq": 1024}
+    }
+    ack = {
+        "utc": data["utc"],
+        "network": network,
+        "code": {"status": True, "mongo": "665f1c2e8b3e4a0012345678", **network, "data": data["code"]}
+    }
+    return {"verif": verif, "data": data, "ack": ack}
+
+
+def codecs():
+    """
+    收集当前环境可用的编码。
+
+    Returns:
+        dict: 以编码名为键、(编码函数, 解码函数) 为值的字典。
+    """
+    codec_data = {
+        "json (indent=4, stdlib)": (lambda data: dumps(data, indent=4, ensure_ascii=False), loads),
+        "json (compact, stdlib)": (lambda data: dumps(data, ensure_ascii=False, separators=(",", ":")), loads)
+    }
+    codec_data.update({f1k: f1v for f1k, f1v in wire_protocols.items() if f1v})
+    return codec_data
+
+
+def bench(number=10000):
+    """
+    运行基准测试并打印结果表。
+
+    Args:
+        number: 每项测试的重复次数。
+    """
+    print("-" * 100)
+    print(F"{'codec':<28}{'message':<10}{'bytes':>10}{'encode us':>14}{'decode us':>14}")
+    print("-" * 100)
+    for name, (encode, decode) in codecs().items():
+        for kind, message in messages().items():
+            frame = encode(message)
+            size = len(frame.encode("UTF-8") if isinstance(frame, str) else frame)
+            encode_us = timeit(lambda: encode(message), number=number) / number * 1e6
+            decode_us = timeit(lambda: decode(frame), number=number) / number * 1e6
+            print(F"{name:<28}{kind:<10}{size:>10}{encode_us:>14.2f}{decode_us:>14.2f}")
+    print("-" * 100)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--number", type=int, default=10000, help="每项测试的重复次数")
+    bench(parser.parse_args().number)
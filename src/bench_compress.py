@@ -0,0 +1,170 @@
+"""
+FuseLink 压缩基准测试
+
+在具有代表性的消息组合上比较不压缩、permessage-deflate（compression="deflate"）与自适应 zstd 压缩
+（"+zstd" 子协议，分别不使用字典和使用由采样流量训练的字典）在每条消息字节数和压缩/解压 CPU 耗时上的差异。
+deflate 按 websockets 的默认参数（窗口 2**12、memLevel 5、保留上下文）逐条压缩同一连接上的消息。
+字典由独立生成的训练消息训练，与测试消息不重叠。
+
+需要安装 zstandard。
+
+用法:
+    python bench_compress.py
+    python bench_compress.py --number 5000 --subprotocol fuselink.msgpack
+"""
+
+
+from fuselink import totp, wire_protocols, compressor
+from argparse import ArgumentParser
+from time import time, perf_counter
+from uuid import uuid1
+import zstandard
+import random
+import zlib
+
+
+def messages(number, seed=0):
+    """
+    构造具有代表性的消息组合。
+
+    Args:
+        number: 每种组合的消息数。
+        seed: 随机数种子，不同的种子生成互不相同的消息。
+
+    Returns:
+        dict: 以组合名为键、消息列表为值的字典。
+    """
+    rand = random.Random(seed)
+    verif = totp("b81ea4ce0dc4", type="client_0a1b2c3d4e5f", code="592156")
+
+    def network():
+        return {
+            "send": [F"192.168.{rand.randint(0, 3)}.{rand.randint(2, 254)}", rand.randint(40000, 60000)],
+            "recv": [F"192.168.{rand.randint(0, 3)}.{rand.randint(2, 254)}", rand.randint(40000, 60000)]
+        }
+
+    def reading(seq):
+        return {
+            "sensor": F"thermo-{rand.randint(0, 63):02d}",
+            "values": [round(rand.uniform(18.0, 26.0), 1) for f1 in range(4)],
+            "unit": "C",
+            "seq": seq
+        }
+
+    def control(seq):
+        address = network()
+        return rand.choice([
+            {"utc": int(time()), "network": address, "code": {"status": True, **address, "data": {"seq": seq}}},
+            {"utc": int(time()), "network": address, "code": {"@queue": None}},
+            {"utc": int(time()), "network": address, "code": {"@presence": {"version": seq, "epoch": str(uuid1())}}}
+        ])
+
+    def telemetry(seq):
+        return {"utc": int(time()), "verif": verif, "network": network(), "code": reading(seq)}
+
+    def batch(seq):
+        address = network()
+        return {
+            "utc": int(time()),
+            "verif": verif,
+            "network": address,
+            "code": {"@batch": [{"recv": address["recv"], "code": reading(seq + f1)} for f1 in range(64)], "id": str(uuid1())}
+        }
+
+    mixed = [control] * 14 + [telemetry] * 5 + [batch]
+    return {
+        "control": [control(f1) for f1 in range(number)],
+        "telemetry": [telemetry(f1) for f1 in range(number)],
+        "batch": [batch(f1) for f1 in range(max(number // 20, 1))],
+        "mixed": [rand.choice(mixed)(f1) for f1 in range(number)]
+    }
+
+
+def deflate():
+    """
+    按 websockets 的默认 permessage-deflate 参数创建一对压缩/解压函数，压缩上下文在消息之间保留。
+
+    Returns:
+        tuple: (压缩函数, 解压函数)。
+    """
+    encoder = zlib.compressobj(wbits=-12, memLevel=5)
+    decoder = zlib.decompressobj(wbits=-12)
+
+    def compress(frame):
+        frame = frame.encode("UTF-8") if isinstance(frame, str) else frame
+        return (encoder.compress(frame) + encoder.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+    def decompress(frame):
+        return decoder.decompress(frame + b"\x00\x00\xff\xff")
+
+    return compress, decompress
+
+
+def adaptive(threshold, dictionary=None):
+    """
+    创建一对使用自适应 zstd 压缩的压缩/解压函数。
+
+    Args:
+        threshold: 压缩的最小帧长度。
+        dictionary: 训练好的字典数据。默认为 None（不使用字典）。
+
+    Returns:
+        tuple: (压缩函数, 解压函数)。
+    """
+    stage = compressor(threshold=threshold)
+    if dictionary:
+        stage.install(dictionary)
+    return stage.compress, lambda frame: frame if isinstance(frame, str) else stage.decompress(frame)
+
+
+def bench(number=2000, subprotocol="fuselink.json", threshold=256, size=16384):
+    """
+    运行基准测试并打印结果表。
+
+    Args:
+        number: 每种消息组合的消息数。
+        subprotocol: 压缩前使用的帧编码。
+        threshold: 自适应压缩的最小帧长度。
+        size: 训练字典的大小（字节）。
+    """
+    encode = wire_protocols[subprotocol][0]
+    # 字典由独立的训练消息训练，与测试消息不重叠
+    samples = [
+        f2.encode("UTF-8") if isinstance(f2, str) else f2
+        for f1 in messages(number, seed=1).values() for f2 in map(encode, f1) if len(f2) >= threshold
+    ]
+    dictionary = zstandard.train_dictionary(size, samples, level=compressor().level).as_bytes()
+    methods = {
+        "none": lambda: (lambda frame: frame, lambda frame: frame),
+        "deflate": deflate,
+        "zstd": lambda: adaptive(threshold),
+        "zstd + dictionary": lambda: adaptive(threshold, dictionary)
+    }
+    print("-" * 100)
+    print(F"{'method':<20}{'mix':<12}{'raw bytes':>12}{'sent bytes':>12}{'saved':>10}{'compress us':>16}{'decompress us':>16}")
+    print("-" * 100)
+    for kind, message_list in messages(number).items():
+        frames = [encode(f1) for f1 in message_list]
+        raw = sum(len(f1.encode("UTF-8") if isinstance(f1, str) else f1) for f1 in frames) / len(frames)
+        for name, method in methods.items():
+            compress, decompress = method()
+            begin = perf_counter()
+            packed = [compress(f1) for f1 in frames]
+            compress_us = (perf_counter() - begin) / len(frames) * 1e6
+            begin = perf_counter()
+            for f1 in packed:
+                decompress(f1)
+            decompress_us = (perf_counter() - begin) / len(frames) * 1e6
+            sent = sum(len(f1.encode("UTF-8") if isinstance(f1, str) else f1) for f1 in packed) / len(frames)
+            print(F"{name:<20}{kind:<12}{raw:>12.1f}{sent:>12.1f}{1 - sent / raw:>10.1%}{compress_us:>16.2f}{decompress_us:>16.2f}")
+    print("-" * 100)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000, help="每种消息组合的消息数")
+    parser.add_argument("--subprotocol", default="fuselink.json", help="压缩前使用的帧编码")
+    parser.add_argument("--threshold", type=int, default=256, help="自适应压缩的最小帧长度")
+    parser.add_argument("--size", type=int, default=16384, help="训练字典的大小（字节）")
+    args = parser.parse_args()
+    bench(args.number, args.subprotocol, args.threshold, args.size)
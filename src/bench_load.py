@@ -0,0 +1,393 @@
+"""
+FuseLink 负载生成与基准测试
+
+在独立进程中启动一个本地服务端，由多个负载进程模拟成千上万个客户端：每个模拟客户端建立连接后
+通过 clients.verif 完成 TOTP 验证，再与相邻的客户端配对，按配置的消息组合互相发送消息。
+统计每秒完成的握手数、每秒送达的消息数，以及握手耗时和端到端延迟的 p50/p99/p999。
+
+消息组合（--mix）中的消息类型：
+    single  发给配对客户端的单条数据消息，延迟为发送到对方收到的时间；
+    batch   发给配对客户端的批量消息（每批 --batch 条），每一条分别计算送达延迟；
+    queue   发送队列查询请求（@queue），延迟为发送到收到应答的时间。
+每个客户端同时最多有 --window 条消息未收到处理结果，使测得的延迟不被无限堆积的发送队列掩盖。
+
+存储后端（--backend）：
+    mongo   使用 --uri 指定的 MongoDB，集合位于独立的命名空间（--namespace），不影响默认命名空间的数据；
+    memory  服务端进程使用进程内存储（memory://），无需运行 MongoDB；
+    sqlite  服务端进程使用临时目录中 WAL 模式的 SQLite 文件，测试结束后删除。
+
+服务端进程和负载进程的事件循环分别由 --loop 和 --client-loop 选择（见 fuselink.loop_factory）。
+结果可以保存为 JSON（--save），之后的运行以 --baseline 指定该文件，逐项打印相对基线的变化。
+仅支持 Linux 等支持 fork 的类 Unix 系统。
+
+用法:
+    python bench_load.py
+    python bench_load.py --peers 4000 --messages 50 --mix single=8,batch=1,queue=1
+    python bench_load.py --backend memory --save baseline.json
+    python bench_load.py --backend memory --baseline baseline.json
+"""
+
+
+from fuselink import clients, pack, unpack, negotiate, servers, loop_factory, mongo_uri
+from websockets.asyncio.client import connect
+from multiprocessing import get_context
+from argparse import ArgumentParser
+from os import cpu_count, devnull
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time, perf_counter, sleep
+from uuid import uuid1
+import asyncio
+import random
+import socket
+import json
+import sys
+
+
+def serve(server_config, loop="auto"):
+    """
+    服务端进程入口点。
+
+    Args:
+        server_config: 服务端配置，传递给 servers.server，存储地址由其中的 storage.uri 指定。
+        loop: 事件循环，见 fuselink.loop_factory。默认为 "auto"。
+    """
+    # 每个连接的日志输出会拖慢服务端，测试期间丢弃服务端进程的标准输出
+    sys.stdout = open(devnull, "w")
+    asyncio.run(servers().server(**server_config), loop_factory=loop_factory(loop))
+
+
+def plan(mix, messages, seed):
+    """
+    按消息组合的权重生成一个客户端依次发送的消息类型。
+
+    Args:
+        mix: 以消息类型为键、权重为值的字典。
+        messages: 消息数。
+        seed: 随机数种子。
+
+    Returns:
+        list: 消息类型列表。
+    """
+    return random.Random(seed).choices(list(mix), weights=list(mix.values()), k=messages)
+
+
+async def session(uri, peers, messages, mix, batch, window, subprotocols, concurrency, seed):
+    """
+    在一个负载进程中建立连接、完成验证并成对收发消息。
+
+    Args:
+        uri: 服务端地址。
+        peers: 本进程模拟的客户端数，按相邻两个客户端配对。
+        messages: 每个客户端发送的消息数。
+        mix: 以消息类型为键、权重为值的字典。
+        batch: 批量消息每批的条数。
+        window: 每个客户端未收到处理结果的消息数上限。
+        subprotocols: 客户端支持的子协议。
+        concurrency: 同时进行的握手数上限。
+        seed: 随机数种子。
+
+    Returns:
+        dict: 包含 peers、handshakes（每次握手耗时）、handshake_seconds、delivered、latencies（每条消息的延迟）、
+              message_seconds 和 errors 的字典。
+    """
+    gate = asyncio.Semaphore(concurrency)
+    handshakes = list()
+    latencies = list()
+    errors = list()
+
+    async def open_one(index):
+        async with gate:
+            begin = perf_counter()
+            ws = await connect(uri, subprotocols=negotiate(subprotocols), proxy=None, ping_interval=None, max_queue=None)
+            client_data = await clients().verif(ws, typeio=F"bench_{index}", otp=str(uuid1())[-12:])
+            handshakes.append(perf_counter() - begin)
+            return ws, client_data
+
+    async def run(ws, client_data, partner, own, expected):
+        # 每个请求恰好对应一个处理结果，且按发送顺序返回
+        sent = list()
+        credit = asyncio.Semaphore(window)
+        done = asyncio.Event()
+        state = {"replies": 0, "delivered": 0}
+
+        async def reader():
+            while state["replies"] < len(own) or state["delivered"] < expected:
+                frame = unpack(await ws.recv(), ws.subprotocol)
+                code = frame.get("code")
+                # 压缩字典帧不含 code
+                if not isinstance(code, dict):
+                    continue
+                if frame["network"]["send"] == client_data["network"]["send"]:
+                    # 自己请求的处理结果，control 类请求以收到处理结果为送达
+                    kind, begin = sent[state["replies"]]
+                    state["replies"] += 1
+                    credit.release()
+                    if kind == "queue":
+                        latencies.append(perf_counter() - begin)
+                    if "error" in code:
+                        errors.append(code["error"])
+                elif "t" in code:
+                    latencies.append(perf_counter() - code["t"])
+                    state["delivered"] += 1
+            done.set()
+
+        reading = asyncio.create_task(reader())
+        for f1, kind in enumerate(own):
+            await credit.acquire()
+            message = {"utc": int(time()), "network": {"send": client_data["network"]["send"], "recv": partner}}
+            if kind == "batch":
+                message["code"] = {
+                    "@batch": [
+                        {"recv": partner, "code": {"seq": f1, "part": f2, "values": [21.5, 21.6, 21.4, 21.7], "t": perf_counter()}}
+                        for f2 in range(batch)
+                    ],
+                    "id": str(uuid1())
+                }
+            elif kind == "queue":
+                message["code"] = {"@queue": None}
+            else:
+                message["code"] = {"seq": f1, "values": [21.5, 21.6, 21.4, 21.7], "t": perf_counter()}
+            sent.append((kind, perf_counter()))
+            await ws.send(pack(message, ws.subprotocol))
+        await done.wait()
+        await reading
+
+    def delivered(kinds):
+        return sum(batch if f1 == "batch" else 1 for f1 in kinds if f1 != "queue")
+
+    begin = perf_counter()
+    sockets = await asyncio.gather(*[open_one(f1) for f1 in range(peers - peers % 2)])
+    opened = perf_counter()
+    plans = [plan(mix, messages, seed * 1000003 + f1) for f1 in range(len(sockets))]
+    await asyncio.gather(*[
+        run(
+            sockets[f1][0], sockets[f1][1], sockets[f1 ^ 1][1]["network"]["send"],
+            plans[f1], delivered(plans[f1 ^ 1])
+        )
+        for f1 in range(len(sockets))
+    ])
+    finished = perf_counter()
+    await asyncio.gather(*[f1[0].close() for f1 in sockets])
+    return {
+        "peers": len(sockets),
+        "handshakes": handshakes,
+        "handshake_seconds": opened - begin,
+        "delivered": len(latencies),
+        "latencies": latencies,
+        "message_seconds": finished - opened,
+        "errors": errors
+    }
+
+
+def load(args):
+    """
+    负载进程入口点。
+
+    Args:
+        args: 传递给 session 的参数元组，最后一项为事件循环（见 fuselink.loop_factory）。
+
+    Returns:
+        dict: 同 session。
+    """
+    *session_args, loop = args
+    return asyncio.run(session(*session_args), loop_factory=loop_factory(loop))
+
+
+def ready(host, port, timeout=30.0):
+    """
+    等待服务端开始监听。
+
+    Args:
+        host: 服务端主机地址。
+        port: 服务端端口号。
+        timeout: 超时时间（秒）。默认为 30.0。
+    """
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(F"服务端未在 {timeout} 秒内启动")
+
+
+def percentile(values, fraction):
+    """
+    计算已排序数值列表的分位数（最近秩法）。
+
+    Args:
+        values: 已升序排列的数值列表。
+        fraction: 分位，如 0.99。
+
+    Returns:
+        float: 分位数，列表为空时返回 0.0。
+    """
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(results):
+    """
+    汇总各负载进程的结果。
+
+    Args:
+        results: session 返回结果的列表。
+
+    Returns:
+        dict: 汇总后的指标，耗时以毫秒计。
+    """
+    handshakes = sorted(f2 for f1 in results for f2 in f1["handshakes"])
+    latencies = sorted(f2 for f1 in results for f2 in f1["latencies"])
+    peers = sum(f1["peers"] for f1 in results)
+    delivered = sum(f1["delivered"] for f1 in results)
+    return {
+        "peers": peers,
+        "handshake_rate": peers / max(max(f1["handshake_seconds"] for f1 in results), 1e-9),
+        "handshake_p50": percentile(handshakes, 0.5) * 1e3,
+        "handshake_p99": percentile(handshakes, 0.99) * 1e3,
+        "messages": delivered,
+        "message_rate": delivered / max(max(f1["message_seconds"] for f1 in results), 1e-9),
+        "latency_p50": percentile(latencies, 0.5) * 1e3,
+        "latency_p99": percentile(latencies, 0.99) * 1e3,
+        "latency_p999": percentile(latencies, 0.999) * 1e3,
+        "errors": sum(len(f1["errors"]) for f1 in results)
+    }
+
+
+def report(summary, baseline=None):
+    """
+    打印结果表，给出基线时同时打印相对基线的变化。
+
+    Args:
+        summary: summarize 返回的汇总指标。
+        baseline: 基线的汇总指标。默认为 None。
+    """
+    rows = [
+        ("peers", "", "{:.0f}"),
+        ("handshake_rate", "handshakes/s", "{:.1f}"),
+        ("handshake_p50", "ms", "{:.2f}"),
+        ("handshake_p99", "ms", "{:.2f}"),
+        ("messages", "", "{:.0f}"),
+        ("message_rate", "messages/s", "{:.1f}"),
+        ("latency_p50", "ms", "{:.2f}"),
+        ("latency_p99", "ms", "{:.2f}"),
+        ("latency_p999", "ms", "{:.2f}"),
+        ("errors", "", "{:.0f}")
+    ]
+    print("-" * 100)
+    print(F"{'metric':<20}{'unit':<16}{'value':>16}" + (F"{'baseline':>16}{'change':>12}" if baseline else ""))
+    print("-" * 100)
+    for name, unit, style in rows:
+        line = F"{name:<20}{unit:<16}{style.format(summary[name]):>16}"
+        if baseline and name in baseline:
+            change = (summary[name] / baseline[name] - 1) if baseline[name] else 0.0
+            line += F"{style.format(baseline[name]):>16}{change:>+12.1%}"
+        print(line)
+    print("-" * 100)
+
+
+def bench(
+    peers=1000, messages=100, mix=None, batch=16, window=8, clients_count=None, backend="mongo",
+    uri=mongo_uri, namespace="bench_load", subprotocols=None, concurrency=200,
+    host="127.0.0.1", port=10200, seed=0, loop="auto", client_loop="auto", shards=1
+):
+    """
+    运行基准测试，返回汇总指标。
+
+    Args:
+        peers: 模拟的客户端总数。
+        messages: 每个客户端发送的消息数。
+        mix: 以消息类型为键、权重为值的字典。默认为 {"single": 1}。
+        batch: 批量消息每批的条数。
+        window: 每个客户端未收到处理结果的消息数上限。
+        clients_count: 负载进程数。默认为 CPU 核数减一（至少为 1），留一个核给服务端。
+        backend: 存储后端，"mongo"、"memory" 或 "sqlite"。
+        uri: MongoDB 连接地址，仅用于 mongo 后端。
+        namespace: 服务端使用的命名空间，仅用于 mongo 后端。
+        subprotocols: 客户端支持的子协议。默认为 None（使用 JSON）。
+        concurrency: 每个负载进程同时进行的握手数上限。
+        host: 服务端主机地址。
+        port: 服务端端口号。
+        seed: 随机数种子。
+        loop: 服务端进程的事件循环。默认为 "auto"。
+        client_loop: 负载进程的事件循环。默认为 "auto"。
+        shards: 服务端 server_data 的分区数。默认为 1（不分区）。
+
+    Returns:
+        dict: summarize 返回的汇总指标。
+    """
+    context = get_context("fork")
+    directory = mkdtemp(prefix="fuselink_bench_") if backend == "sqlite" else None
+    clients_count = clients_count or max((cpu_count() or 2) - 1, 1)
+    server_config = {
+        "host": host,
+        "port": port,
+        "subprotocols": subprotocols,
+        "ping_interval": None,
+        "max_queue": None,
+        "storage": {
+            "uri": {"memory": "memory://", "sqlite": F"sqlite:///{join(directory or '', 'bench.db')}"}.get(backend, uri),
+            "namespace": namespace,
+            "shards": {"count": shards}
+        }
+    }
+    supervisor = context.Process(target=serve, args=(server_config, loop), daemon=True)
+    supervisor.start()
+    try:
+        ready(host, port)
+        share = max(peers // clients_count, 2)
+        with context.Pool(clients_count) as pool:
+            results = pool.map(load, [
+                (F"ws://{host}:{port}", share, messages, mix or {"single": 1}, batch, window, subprotocols, concurrency, seed + f1, client_loop)
+                for f1 in range(clients_count)
+            ])
+    finally:
+        supervisor.terminate()
+        supervisor.join()
+        if directory:
+            rmtree(directory, ignore_errors=True)
+    return summarize(results)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--peers", type=int, default=1000, help="模拟的客户端总数")
+    parser.add_argument("--messages", type=int, default=100, help="每个客户端发送的消息数")
+    parser.add_argument("--mix", default="single=1", help="消息组合，如 single=8,batch=1,queue=1")
+    parser.add_argument("--batch", type=int, default=16, help="批量消息每批的条数")
+    parser.add_argument("--window", type=int, default=8, help="每个客户端未收到处理结果的消息数上限")
+    parser.add_argument("--clients", type=int, default=None, help="负载进程数，默认为 CPU 核数减一")
+    parser.add_argument("--backend", choices=["mongo", "memory", "sqlite"], default="mongo", help="存储后端")
+    parser.add_argument("--uri", default=mongo_uri, help="MongoDB 连接地址")
+    parser.add_argument("--namespace", default="bench_load", help="服务端使用的命名空间")
+    parser.add_argument("--subprotocols", nargs="+", default=None, help="客户端支持的子协议")
+    parser.add_argument("--concurrency", type=int, default=200, help="每个负载进程同时进行的握手数上限")
+    parser.add_argument("--host", default="127.0.0.1", help="服务端主机地址")
+    parser.add_argument("--port", type=int, default=10200, help="服务端端口号")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--loop", default="auto", help="服务端进程的事件循环：auto、asyncio 或 uvloop")
+    parser.add_argument("--client-loop", default="auto", help="负载进程的事件循环：auto、asyncio 或 uvloop")
+    parser.add_argument("--shards", type=int, default=1, help="服务端 server_data 的分区数")
+    parser.add_argument("--save", default=None, help="将汇总指标保存为 JSON 文件")
+    parser.add_argument("--baseline", default=None, help="作为基线的 JSON 文件")
+    args = parser.parse_args()
+    mix_config = {f1.split("=")[0]: float(f1.split("=")[1]) for f1 in args.mix.split(",")}
+    if set(mix_config) - {"single", "batch", "queue"}:
+        parser.error(F"未知的消息类型：{', '.join(set(mix_config) - {'single', 'batch', 'queue'})}")
+    summary_data = bench(
+        args.peers, args.messages, mix_config, args.batch, args.window, args.clients, args.backend,
+        args.uri, args.namespace, args.subprotocols, args.concurrency, args.host, args.port, args.seed,
+        args.loop, args.client_loop, args.shards
+    )
+    baseline_data = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline_data = json.load(f)
+    report(summary_data, baseline_data)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary_data, f, indent=4)
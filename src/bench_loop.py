@@ -0,0 +1,68 @@
+"""
+FuseLink 事件循环基准测试
+
+在相同的握手和消息交换负载（bench_load）下，分别以 asyncio 默认事件循环和 uvloop 运行服务端进程与负载进程，
+比较每秒握手数、每秒送达消息数和端到端延迟。服务端和负载进程的事件循环两两组合，
+以区分服务端和客户端各自从 uvloop 得到的收益。未安装 uvloop 时只测试 asyncio。
+
+用法:
+    python bench_loop.py
+    python bench_loop.py --backend memory --peers 2000 --messages 50
+"""
+
+
+from fuselink import uvloop, mongo_uri
+from bench_load import bench as load_bench
+from argparse import ArgumentParser
+
+
+def bench(peers=1000, messages=50, mix=None, backend="mongo", uri=mongo_uri, clients_count=None, port=10300):
+    """
+    运行基准测试并打印结果表。
+
+    Args:
+        peers: 模拟的客户端总数。
+        messages: 每个客户端发送的消息数。
+        mix: 以消息类型为键、权重为值的字典。默认为 {"single": 8, "batch": 1, "queue": 1}。
+        backend: 存储后端，"mongo"、"memory" 或 "sqlite"。
+        uri: MongoDB 连接地址，仅用于 mongo 后端。
+        clients_count: 负载进程数。默认为 CPU 核数减一。
+        port: 服务端端口号，每一轮使用不同的端口，避免上一轮的连接影响下一轮。
+    """
+    loops = ["asyncio", "uvloop"] if uvloop else ["asyncio"]
+    print("-" * 100, flush=True)
+    print(
+        F"{'server':<10}{'clients':<10}{'handshakes/s':>14}{'messages/s':>14}"
+        F"{'p50 ms':>12}{'p99 ms':>12}{'p999 ms':>12}{'errors':>8}",
+        flush=True
+    )
+    print("-" * 100, flush=True)
+    for f1, (server_loop, client_loop) in enumerate((f2, f3) for f2 in loops for f3 in loops):
+        summary = load_bench(
+            peers, messages, mix or {"single": 8, "batch": 1, "queue": 1}, clients_count=clients_count, backend=backend,
+            uri=uri, port=port + f1, loop=server_loop, client_loop=client_loop
+        )
+        print(
+            F"{server_loop:<10}{client_loop:<10}{summary['handshake_rate']:>14.1f}{summary['message_rate']:>14.1f}"
+            F"{summary['latency_p50']:>12.2f}{summary['latency_p99']:>12.2f}{summary['latency_p999']:>12.2f}{summary['errors']:>8}",
+            flush=True
+        )
+    print("-" * 100, flush=True)
+    if not uvloop:
+        print("未安装 uvloop，仅测试了 asyncio 事件循环", flush=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--peers", type=int, default=1000, help="模拟的客户端总数")
+    parser.add_argument("--messages", type=int, default=50, help="每个客户端发送的消息数")
+    parser.add_argument("--mix", default="single=8,batch=1,queue=1", help="消息组合，如 single=8,batch=1,queue=1")
+    parser.add_argument("--backend", choices=["mongo", "memory", "sqlite"], default="mongo", help="存储后端")
+    parser.add_argument("--uri", default=mongo_uri, help="MongoDB 连接地址")
+    parser.add_argument("--clients", type=int, default=None, help="负载进程数，默认为 CPU 核数减一")
+    parser.add_argument("--port", type=int, default=10300, help="第一轮使用的服务端端口号")
+    args = parser.parse_args()
+    bench(
+        args.peers, args.messages, {f1.split("=")[0]: float(f1.split("=")[1]) for f1 in args.mix.split(",")},
+        args.backend, args.uri, args.clients, args.port
+    )
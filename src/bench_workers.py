@@ -0,0 +1,152 @@
+"""
+FuseLink 多进程服务端基准测试
+
+分别以不同的进程数（--workers）启动服务端，由多个负载进程并发建立连接并完成 TOTP 验证，
+再由成对的连接互相发送数据消息，统计每秒建立的连接数和每秒送达的消息数。
+连接由操作系统经 SO_REUSEPORT 分配到各服务端进程，成对的连接多数位于不同进程，
+因此消息吞吐同时反映了进程间路由通道的开销。
+
+需要本地运行 MongoDB（与 fuselink.py 相同的 mongo_uri），仅支持 Linux 等类 Unix 系统。
+
+用法:
+    python bench_workers.py
+    python bench_workers.py --workers 1 2 4 8 --connections 400 --messages 200
+"""
+
+
+from fuselink import totp, pack, unpack, workers
+from websockets.asyncio.client import connect
+from multiprocessing import get_context
+from argparse import ArgumentParser
+from os import cpu_count
+from time import time, perf_counter, sleep
+from uuid import uuid1
+import asyncio
+import socket
+
+
+async def session(uri, connections, messages):
+    """
+    在一个负载进程中建立连接并成对收发消息。
+
+    Args:
+        uri: 服务端地址。
+        connections: 本进程建立的连接数，按相邻两个连接配对。
+        messages: 每对连接发送的消息数。
+
+    Returns:
+        tuple: (连接数, 建立连接耗时, 送达消息数, 收发消息耗时)。
+    """
+    async def open_one():
+        ws = await connect(uri, proxy=None)
+        otp = totp(str(uuid1())[-12:])
+        await ws.send(pack({"type": "bench", "secret": otp["exec"]["secret"], "code": otp["res"]["code"]}))
+        unpack(await ws.recv())
+        return ws
+
+    async def sender(ws, recv):
+        for f1 in range(messages):
+            await ws.send(pack({
+                "utc": int(time()),
+                "network": {"send": list(ws.local_address), "recv": list(recv.local_address)},
+                "code": {"seq": f1, "values": [21.5, 21.6, 21.4, 21.7]}
+            }))
+        for f1 in range(messages):
+            await ws.recv()
+
+    async def receiver(ws):
+        for f1 in range(messages):
+            await ws.recv()
+
+    begin = perf_counter()
+    sockets = await asyncio.gather(*[open_one() for f1 in range(connections - connections % 2)])
+    opened = perf_counter()
+    await asyncio.gather(*[
+        f1 for f2 in range(0, len(sockets), 2)
+        for f1 in (sender(sockets[f2], sockets[f2 + 1]), receiver(sockets[f2 + 1]))
+    ])
+    finished = perf_counter()
+    await asyncio.gather(*[f1.close() for f1 in sockets])
+    return len(sockets), opened - begin, len(sockets) // 2 * messages, finished - opened
+
+
+def load(args):
+    """
+    负载进程入口点。
+
+    Args:
+        args: (服务端地址, 连接数, 每对连接的消息数)。
+
+    Returns:
+        tuple: 同 session。
+    """
+    return asyncio.run(session(*args))
+
+
+def ready(host, port, timeout=30.0):
+    """
+    等待服务端开始监听。
+
+    Args:
+        host: 服务端主机地址。
+        port: 服务端端口号。
+        timeout: 超时时间（秒）。默认为 30.0。
+    """
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(F"服务端未在 {timeout} 秒内启动")
+
+
+def bench(counts=(1, 2, 4), connections=200, messages=100, clients=None, host="127.0.0.1", port=10100):
+    """
+    运行基准测试并打印结果表。
+
+    Args:
+        counts: 依次测试的服务端进程数。
+        connections: 每轮建立的连接总数。
+        messages: 每对连接发送的消息数。
+        clients: 负载进程数。默认为 CPU 核数。
+        host: 服务端主机地址。
+        port: 服务端端口号。
+    """
+    context = get_context("fork")
+    clients = clients or cpu_count() or 1
+    server_config = {"host": host, "port": port, "ping_interval": None}
+    print("-" * 100, flush=True)
+    print(F"{'workers':<10}{'connections':>14}{'conn/s':>14}{'messages':>14}{'msg/s':>14}", flush=True)
+    print("-" * 100, flush=True)
+    for count in counts:
+        supervisor = context.Process(target=workers, args=(count, server_config))
+        supervisor.start()
+        try:
+            ready(host, port)
+            uri = F"ws://{host}:{port}"
+            share = max(connections // clients, 2)
+            with context.Pool(clients) as pool:
+                results = pool.map(load, [(uri, share, messages)] * clients)
+        finally:
+            supervisor.terminate()
+            supervisor.join()
+        total_connections = sum(f1[0] for f1 in results)
+        total_messages = sum(f1[2] for f1 in results)
+        connect_rate = total_connections / max(f1[1] for f1 in results)
+        message_rate = total_messages / max(f1[3] for f1 in results)
+        print(F"{count:<10}{total_connections:>14}{connect_rate:>14.1f}{total_messages:>14}{message_rate:>14.1f}", flush=True)
+    print("-" * 100, flush=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="依次测试的服务端进程数")
+    parser.add_argument("--connections", type=int, default=200, help="每轮建立的连接总数")
+    parser.add_argument("--messages", type=int, default=100, help="每对连接发送的消息数")
+    parser.add_argument("--clients", type=int, default=None, help="负载进程数，默认为 CPU 核数")
+    parser.add_argument("--host", default="127.0.0.1", help="服务端主机地址")
+    parser.add_argument("--port", type=int, default=10100, help="服务端端口号")
+    args = parser.parse_args()
+    bench(args.workers, args.connections, args.messages, args.clients, args.host, args.port)
@@ -36,7 +36,8 @@ FuseLink 架构包含以下几个核心组件，它们协同工作以实现数
 4.2 数据库（临时交换）
 功能：临时存储和交换数据。
 
-数据库选择：使用 MongoDB 作为数据库，提供高效的数据存储和查询功能。
+数据库选择：默认使用 MongoDB 作为数据库，提供高效的数据存储和查询功能；单机部署可改用进程内存储（memory://）
+或 WAL 模式的 SQLite 文件（sqlite:///文件路径），以持久性换取更低的延迟，测试时也无需运行数据库服务。
 
 数据可靠性：确保数据在不同组件之间的可靠传递。
 
@@ -111,39 +112,327 @@ FuseLink 架构通过模拟公网环境，为高效、安全的数据交换和
 """
 
 
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo.errors import OperationFailure
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.results import InsertManyResult, DeleteResult
+from bson import ObjectId
+from collections import deque
+from weakref import WeakKeyDictionary
+from http import HTTPStatus
 from websockets.asyncio.client import connect
 from websockets.asyncio.server import serve
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta, timezone
 from json import loads, dumps
 from uuid import uuid1
-from time import time
+from time import time, perf_counter
+from bisect import bisect_left
+from zlib import crc32
+from heapq import heappush, heappop
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from random import random, getrandbits
+from functools import partial, wraps
 import asyncio
 
 
 from urllib.parse import urlparse, parse_qs, urlunparse, quote, urlencode
-from base64 import b32encode, b32decode
+from base64 import b32encode, b32decode, urlsafe_b64encode, urlsafe_b64decode
 from typing import Dict, Any, Optional
 from pyotp import TOTP
 import hashlib
-
-from os.path import abspath, dirname, exists, join
+import hmac
+
+from os.path import abspath, dirname, exists, join, getsize, basename
+from os import urandom, getpid, makedirs, replace, remove, scandir
+from struct import Struct
+from socket import gethostname
+from multiprocessing import get_context
+from signal import signal, SIGTERM, Signals
+from cProfile import Profile
+from tempfile import mkdtemp
+from shutil import rmtree
 from argparse import ArgumentParser
 from json import dump, load
 from asyncio import run
 from sys import exit
+from storage_embedded import embedded
+
+# 可选的 JSON 加速库，未安装时使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# 可选的二进制编码，未安装时仅使用 JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+# 可选的 zstd 压缩，未安装时不提供 "+zstd" 子协议
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# 可选的协程感知性能分析器，未安装时仅支持 cProfile
+try:
+    import yappi
+except ImportError:
+    yappi = None
+# 可选的 libuv 事件循环，未安装时使用 asyncio 的默认事件循环
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 # 获取当前脚本所在目录
 script_dir = dirname(abspath(__file__))
-mongo = AsyncIOMotorClient("mongodb://localhost:27017/")
-server_log = mongo["FuseLink_Cache"][F"server_log_{str(uuid1())[-12:]}"]
-server_data = mongo["FuseLink_Cache"][F"server_data_{str(uuid1())[-12:]}"]
-server_verif = mongo["FuseLink_Cache"][F"server_verif_{str(uuid1())[-12:]}"]
-client_log = mongo["FuseLink_Cache"][F"clients_log_{str(uuid1())[-12:]}"]
-client_read = mongo["FuseLink_Cache"][F"clients_read_{str(uuid1())[-12:]}"]
-client_write = mongo["FuseLink_Cache"][F"clients_write_{str(uuid1())[-12:]}"]
-client_device = mongo["FuseLink_Cache"][F"clients_device_{str(uuid1())[-12:]}"]
+mongo_uri = "mongodb://localhost:27017/"
+# 当前使用的存储地址，由 reconnect 更新，可以是 MongoDB 地址、"memory://" 或 "sqlite:///文件路径"
+storage_uri = mongo_uri
+mongo_database = "FuseLink_Cache"
+# 集合名称为 "前缀_命名空间"，同一命名空间的进程（如服务端的多个进程、客户端与 Sanic 网关）共用一组集合
+mongo_namespace = "default"
+mongo_collections = {
+    "server_log": "server_log",
+    "server_data": "server_data",
+    "server_verif": "server_verif",
+    "client_log": "clients_log",
+    "client_read": "clients_read",
+    "client_write": "clients_write",
+    "client_device": "clients_device",
+    "server_stream": "server_stream",
+    "gateway_log": "admin_log"
+}
+mongo = AsyncIOMotorClient(mongo_uri)
+# server_data 的分区数、各分区所在的存储地址及其客户端，由 partition 更新；未设置存储地址时各分区都在当前存储中
+shard_count = 1
+shard_uris = list()
+shard_clients = list()
+server_log = mongo[mongo_database][F"server_log_{mongo_namespace}"]
+server_verif = mongo[mongo_database][F"server_verif_{mongo_namespace}"]
+client_log = mongo[mongo_database][F"clients_log_{mongo_namespace}"]
+client_read = mongo[mongo_database][F"clients_read_{mongo_namespace}"]
+client_write = mongo[mongo_database][F"clients_write_{mongo_namespace}"]
+client_device = mongo[mongo_database][F"clients_device_{mongo_namespace}"]
+# 存活实例登记表，不属于任何命名空间
+instance_registry = mongo[mongo_database]["instances"]
+# servers.server 和 clients.client 的 storage 参数默认值
+storage_defaults = {
+    "uri": None,
+    "namespace": None,
+    "expire": 7 * 24 * 3600,
+    "undelivered": 7 * 24 * 3600,
+    "heartbeat": 30.0,
+    "sweep": 3600.0,
+    "grace": 7 * 24 * 3600,
+    "shards": None
+}
+
+
+def names(namespace=None):
+    """
+    生成命名空间中各集合的名称。
+
+    Args:
+        namespace: 命名空间。默认为 None（当前命名空间 mongo_namespace）。
+
+    Returns:
+        dict: 以模块中的集合变量名为键、集合名称为值的字典。
+
+    Example:
+        >>> names("plant_a")["client_read"]
+        "clients_read_plant_a"
+    """
+    return {f1: F"{f2}_{namespace or mongo_namespace}" for f1, f2 in mongo_collections.items()}
+
+
+def bind(namespace=None):
+    """
+    按命名空间重新绑定各集合，在服务端或客户端访问集合之前调用。
+
+    Args:
+        namespace: 命名空间。默认为 None（当前命名空间 mongo_namespace）。
+    """
+    global mongo_namespace, instance_registry, server_data
+    mongo_namespace = namespace or mongo_namespace
+    for f1, f2 in names().items():
+        if f1 in globals():
+            globals()[f1] = mongo[mongo_database][f2]
+    server_data = shards(names()["server_data"], shard_count, shard_clients)
+    instance_registry = mongo[mongo_database]["instances"]
+
+
+def partition(count=1, uris=None):
+    """
+    设置 server_data 的分区，并重新绑定 server_data。
+
+    Args:
+        count: 分区数。默认为 1（不分区）。
+        uris: 各分区所在的存储地址，第 i 个分区位于 uris[i % len(uris)]，可以是同一台机器上的多个 mongod 实例。
+            默认为 None（各分区都在当前存储中）。
+
+    Example:
+        >>> partition(8, ["mongodb://localhost:27017/", "mongodb://localhost:27018/"])
+    """
+    global shard_count, shard_uris, shard_clients
+    shard_count = max(int(count or 1), 1)
+    shard_uris = list(uris or list())
+    shard_clients = [backend(f1) for f1 in shard_uris]
+    bind()
+
+
+def reconnect(uri=None, namespace=None):
+    """
+    重新创建存储客户端，并重新绑定各集合。
+
+    MongoClient 和 SQLite 连接都不能跨 fork 使用，多进程模式下每个子进程启动后调用本函数，
+    使各进程使用各自的连接访问同一组集合。
+
+    Args:
+        uri: 存储地址，见 backend。默认为 None（沿用当前地址 storage_uri）。
+        namespace: 命名空间。默认为 None（沿用当前命名空间）。
+    """
+    global mongo, storage_uri, shard_clients
+    storage_uri = uri or storage_uri
+    mongo = backend(storage_uri)
+    shard_clients = [backend(f1) for f1 in shard_uris]
+    bind(namespace)
+
+
+def backend(uri):
+    """
+    按存储地址创建存储客户端。
+
+    "mongodb://" 和 "mongodb+srv://" 地址使用 Motor 客户端；"memory://" 使用进程内的内存存储，
+    延迟最低但不持久化，且只能由单个进程使用；"sqlite:///文件路径" 使用 WAL 模式的 SQLite 文件，
+    可由同一台机器上的多个进程（如客户端与 Sanic 网关）共享，相对路径相对于脚本所在目录。
+    内存和 SQLite 存储实现 FuseLink 用到的 Motor 集合接口子集，服务端和客户端的代码无需区分存储。
+
+    Args:
+        uri: 存储地址。
+
+    Returns:
+        AsyncIOMotorClient | embedded: 可以按 client[数据库][集合] 访问集合的客户端。
+
+    Raises:
+        ValueError: 如果地址的协议不受支持。
+
+    Example:
+        >>> backend("memory://")["FuseLink_Cache"]["server_data_default"]
+        >>> backend("sqlite:///fuselink.db")
+    """
+    match urlparse(uri).scheme:
+        case "mongodb" | "mongodb+srv":
+            return AsyncIOMotorClient(uri)
+        case "memory" | "sqlite":
+            return embedded(uri)
+    raise ValueError(F"不支持的存储地址：{uri}")
+
+
+class shards:
+    """
+    按接收方分区的 server_data。
+
+    未送达的消息按 network.recv 的 CRC32 哈希分布在 count 个集合中，各集合依次位于 clients 的各个存储，
+    查找发往某个接收方的消息只访问其所在的分区，推送后按 _id 在该分区中删除。按发送方等无法确定分区的条件删除时，
+    在各分区上并发执行。分区数为 1 时只有一个集合，名称与不分区时相同；否则第 i 个分区的集合名为 "名称.i"。
+
+    Attributes:
+        name (str): 集合名称。
+        collections (list): 各分区的集合。
+
+    Example:
+        >>> server_data = shards("server_data_default", 4)
+        >>> server_data.locate(["127.0.0.1", 50000]).name
+        "server_data_default.2"
+    """
+
+    def __init__(self, name, count=1, clients=None):
+        clients = clients or [mongo]
+        self.name = name
+        if count > 1:
+            self.collections = [clients[f1 % len(clients)][mongo_database][F"{name}.{f1}"] for f1 in range(count)]
+        else:
+            self.collections = [clients[0][mongo_database][name]]
+
+    def index(self, address):
+        """
+        计算地址所在的分区编号，同一地址在所有进程中得到相同的编号。
+
+        Args:
+            address: 接收方地址。
+
+        Returns:
+            int: 分区编号。
+        """
+        if len(self.collections) == 1:
+            return 0
+        return crc32(F"{address[0]}:{address[1]}".encode("UTF-8")) % len(self.collections)
+
+    def locate(self, address):
+        """
+        获取地址所在分区的集合。
+
+        Args:
+            address: 接收方地址。
+
+        Returns:
+            集合。
+        """
+        return self.collections[self.index(address)]
+
+    def route(self, addresses):
+        """
+        按分区对地址分组。
+
+        Args:
+            addresses: 接收方地址的列表。
+
+        Returns:
+            list: (集合, 该分区中的地址列表) 元组的列表。
+        """
+        routed = dict()
+        for f1 in addresses:
+            routed.setdefault(self.index(f1), list()).append(f1)
+        return [(self.collections[f1], f2) for f1, f2 in routed.items()]
+
+    async def insert_one(self, document):
+        """
+        将消息写入其接收方所在的分区。
+        """
+        return await self.locate(document["network"]["recv"]).insert_one(document)
+
+    async def insert_many(self, documents, ordered=True):
+        """
+        按接收方分区批量写入消息，各分区并发写入，inserted_ids 的顺序与 documents 一致。
+        """
+        documents = list(documents)
+        routed = dict()
+        for f1, f2 in enumerate(documents):
+            routed.setdefault(self.index(f2["network"]["recv"]), list()).append(f1)
+        results = await asyncio.gather(*(
+            self.collections[f1].insert_many([documents[f3] for f3 in f2], ordered=ordered) for f1, f2 in routed.items()
+        ))
+        inserted_ids = [None] * len(documents)
+        for f1, f2 in zip(routed.values(), results):
+            for f3, f4 in zip(f1, f2.inserted_ids):
+                inserted_ids[f3] = f4
+        return InsertManyResult(inserted_ids, True)
+
+    async def delete_many(self, filter):
+        """
+        在各分区上并发删除符合条件的消息。
+        """
+        results = await asyncio.gather(*(f1.delete_many(filter) for f1 in self.collections))
+        return DeleteResult({"n": sum(f1.deleted_count for f1 in results)}, True)
+
+
+server_data = shards(F"server_data_{mongo_namespace}")
 
 
 def totp(
@@ -379,128 +668,2981 @@ def totp(
     return otp_data
 
 
-class servers:
+class metrics:
     """
-    WebSocket 服务器类，负责处理客户端连接、验证、数据接收和发送。
+    进程内的性能指标，以 Prometheus 文本格式导出。
 
-    该类实现了 WebSocket 服务器的核心功能，包括客户端连接管理、验证流程、
-    消息接收与发送，以及与数据库的交互。设计用于需要实时数据交换和客户端管理的场景。
+    直方图按名称和标签分别累计耗时（秒），仪表在导出时调用回调函数取值，需要查询数据库的仪表可以缓存取值。
+    同一进程中的服务端、客户端和 Sanic 网关共用模块级的 telemetry 实例。
 
     Attributes:
-        无显式定义的属性，所有操作通过方法参数和局部变量完成。
+        buckets (tuple): 直方图的桶上限（秒）。
+        labels (dict): 附加在所有指标上的标签，如多进程模式下的 worker 编号。
+        descriptions (dict): 以指标名为键的说明文字。
+        histograms (dict): 以 (指标名, 标签) 为键、[各桶计数, 总和, 总数] 为值的字典。
+        gauges (dict): 以指标名为键的回调函数，返回数值或以标签字典元组为键的数值字典，可以是协程函数。
+        intervals (dict): 以指标名为键的缓存时间（秒），只包含缓存取值的仪表。
+        cache (dict): 以指标名为键、(取值时间, 取值任务) 为值的缓存。
+
+    Example:
+        >>> with telemetry.time("fuselink_decode_seconds", codec="fuselink.json"):
+        ...     decode(frame)
+        >>> await telemetry.render()
+        '# HELP fuselink_decode_seconds ...'
     """
 
-    async def connect(self, ws):
+    def __init__(self, buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)):
+        self.buckets = buckets
+        self.labels = dict()
+        self.descriptions = {
+            "fuselink_handshake_seconds": "Time spent verifying a connection, by stage (upgrade or verif).",
+            "fuselink_totp_seconds": "Time spent in TOTP verification.",
+            "fuselink_decode_seconds": "Time spent decoding a received frame, by codec.",
+            "fuselink_mongo_seconds": "Time spent in MongoDB operations, by collection and operation.",
+            "fuselink_delivery_seconds": "Time from queueing a message for a peer until it was sent.",
+            "fuselink_connections": "Open WebSocket connections.",
+            "fuselink_sessions": "Verified sessions bound to a connection.",
+            "fuselink_queue_depth": "Messages waiting in the outbound queue of each peer.",
+            "fuselink_pending_messages": "Undelivered messages stored in server_data for each peer (largest 100).",
+            "fuselink_pending_cleanups": "Disconnected sessions waiting for their grace period before cleanup."
+        }
+        self.histograms = dict()
+        self.gauges = dict()
+        self.intervals = dict()
+        self.cache = dict()
+
+    def observe(self, name, value, **labels):
         """
-        处理客户端连接，记录连接信息。
+        记录一次耗时。
 
-        创建包含连接时间戳和网络地址的字典，并将其插入日志集合。
+        Args:
+            name: 直方图名称。
+            value: 耗时（秒）。
+            **labels: 标签。
+        """
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram = self.histograms[key]
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    @contextmanager
+    def time(self, name, **labels):
+        """
+        记录代码块的耗时，代码块抛出异常时同样记录。启用追踪时代码块同时作为一个子跨度。
 
         Args:
-            ws: WebSocket 连接对象。
+            name: 直方图名称。
+            **labels: 标签。
+        """
+        begin = perf_counter()
+        try:
+            with tracing.span(name, **labels):
+                yield
+        finally:
+            self.observe(name, perf_counter() - begin, **labels)
+
+    async def timed(self, awaitable, name, **labels):
+        """
+        等待一个协程并记录其耗时，用于数据库操作等需要传给其他函数的协程。
+
+        Args:
+            awaitable: 协程。
+            name: 直方图名称。
+            **labels: 标签。
 
         Returns:
-            包含连接信息的字典，包括 UTC 时间戳、验证状态、网络地址和代码。
+            协程的返回值。
+        """
+        with self.time(name, **labels):
+            return await awaitable
 
-        Example:
-            >>> connect_data = await server.connect(ws)
-            >>> print(connect_data)
-            {
-                "utc": 1621548726,
-                "verif": None,
-                "network": {
-                    "send": ["127.0.0.1", 12345],
-                    "recv": ["127.0.0.1", 10000]
-                },
-                "code": None
-            }
+    def gauge(self, name, callback, interval=None):
         """
-        # 创建连接信息字典，包含当前时间戳和网络地址
-        connect_data = {
-            "utc": int(time()),
-            "verif": None,
-            "network": {
-                "send": list(ws.remote_address),
-                "recv": list(ws.local_address)
-            },
-            "code": None
-        }
-        # 将连接信息插入日志集合
-        await server_log.insert_one(connect_data.copy())
-        return connect_data
+        登记一个仪表，导出时调用 callback 取值。
 
-    async def verif(self, ws, timeout=10.0):
+        Args:
+            name: 仪表名称。
+            callback: 返回数值，或返回以标签字典元组（如 (("peer", "127.0.0.1:5555"),)）为键的数值字典，可以是协程函数。
+            interval: 取值的缓存时间（秒），在此期间的导出和并发的导出共用同一次取值。默认为 None（每次导出都取值）。
         """
-        处理客户端验证请求。
+        self.gauges[name] = callback
+        self.cache.pop(name, None)
+        if interval:
+            self.intervals[name] = interval
+        else:
+            self.intervals.pop(name, None)
 
-        等待客户端发送验证信息，使用 TOTP 进行验证，并将结果发送回客户端。
-        如果验证成功，将验证信息插入验证集合。
+    async def read(self, name):
+        """
+        取出一个仪表的值，缓存取值的仪表在缓存时间内返回上次的取值。
 
         Args:
-            ws: WebSocket 连接对象。
-            timeout: 等待验证信息的超时时间（秒）。默认为 10.0。
+            name: 仪表名称。
 
         Returns:
-            包含验证结果的字典，包括 UTC 时间戳、验证状态、网络地址和代码。
+            数值或以标签字典元组为键的数值字典。
+        """
+        if name not in self.intervals:
+            value = self.gauges[name]()
+            return await value if asyncio.iscoroutine(value) else value
+        cached = self.cache.get(name)
+        if cached is None or perf_counter() - cached[0] >= self.intervals[name]:
 
-        Raises:
-            asyncio.TimeoutError: 如果等待验证信息超时。
-            json.JSONDecodeError: 如果验证信息无法解析为 JSON。
-            Exception: 捕获其他验证过程中的异常。
+            async def fetch():
+                value = self.gauges[name]()
+                return await value if asyncio.iscoroutine(value) else value
 
-        Example:
-            >>> verif_data = await server.verif(ws)
-            >>> print(verif_data)
-            {
-                "utc": 1621548726,
-                "verif": {"exec": {"secret": "..."}, "res": {"verif": true}},
-                "network": {
-                    "send": ["127.0.0.1", 12345],
-                    "recv": ["127.0.0.1", 10000]
-                },
-                "code": "Verification successful! You can now proceed with your operation."
-            }
+            cached = self.cache[name] = (perf_counter(), asyncio.ensure_future(fetch()))
+        return await asyncio.shield(cached[1])
+
+    def format(self, labels):
         """
-        # 创建验证信息字典
-        verif_data = {
-            "utc": int(time()),
-            "verif": None,
-            "network": {
-                "send": list(ws.remote_address),
-                "recv": list(ws.local_address)
-            },
-            "code": None
-        }
-        try:
-            # 等待客户端发送验证信息，设置超时时间
-            verif_data["verif"] = await asyncio.wait_for(ws.recv(), timeout=timeout)
-            # 将接收到的验证信息解析为字典
-            verif_data["verif"] = loads(verif_data["verif"])
-            if verif_data["verif"] and isinstance(verif_data["verif"], dict):
-                # 使用 mfa.totp 进行验证
-                verif_result = totp(**verif_data["verif"])
-                # 根据验证结果设置返回信息
-                verif_data["code"] = "Verification successful! You can now proceed with your operation." if verif_result[
-                    "res"]["verif"] else "Verification failed! The OTP is invalid or has expired."
-                verif_data["verif"] = verif_result
+        生成 Prometheus 标签文本。
 
-                # 如果验证成功，将验证信息插入验证集合
-                if verif_result["res"]["verif"]:
-                    await server_verif.insert_one(verif_data.copy())
-        except Exception as e:
-            # 捕获验证过程中的异常
-            verif_data["code"] = f"Verification timed out. {str(e)}"
-        # 更新或插入日志信息
-        server_log.update_one(
-            {"network.send": verif_data["network"]["send"]},
-            {"$set": verif_data.copy()},
-            upsert=True
-        )
-        # 向客户端发送验证结果
-        await ws.send(dumps(verif_data, indent=4, ensure_ascii=False))
-        if (not verif_data["verif"]):
-            await ws.close()
-        return verif_data
+        Args:
+            labels: 标签键值对的可迭代对象。
+
+        Returns:
+            str: 形如 {a="1",b="2"} 的文本，没有标签时为空字符串。
+        """
+        labels = [*self.labels.items(), *labels]
+        if not labels:
+            return str()
+        escape = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+        return "{" + ",".join(F'{f1}="{str(f2).translate(escape)}"' for f1, f2 in labels) + "}"
+
+    async def render(self):
+        """
+        以 Prometheus 文本格式导出所有指标。
+
+        Returns:
+            str: 指标文本。
+        """
+        lines = list()
+        for name in sorted({f1[0] for f1 in self.histograms}):
+            lines.append(F"# HELP {name} {self.descriptions.get(name, name)}")
+            lines.append(F"# TYPE {name} histogram")
+            for (f1, labels), (counts, total, count) in sorted(self.histograms.items()):
+                if f1 != name:
+                    continue
+                cumulative = 0
+                for f2, f3 in zip([*self.buckets, "+Inf"], counts):
+                    cumulative += f3
+                    lines.append(F"{name}_bucket{self.format([*labels, ("le", f2)])} {cumulative}")
+                lines.append(F"{name}_sum{self.format(labels)} {total}")
+                lines.append(F"{name}_count{self.format(labels)} {count}")
+        for name in sorted(self.gauges):
+            try:
+                value = await self.read(name)
+            except Exception:
+                continue
+            lines.append(F"# HELP {name} {self.descriptions.get(name, name)}")
+            lines.append(F"# TYPE {name} gauge")
+            for f1, f2 in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(F"{name}{self.format(f1)} {f2}")
+        return "\n".join(lines) + "\n"
+
+    async def listen(self, host="127.0.0.1", port=9464, path="/metrics"):
+        """
+        在单独的 HTTP 端点上导出性能指标，默认只监听本机回环地址，不与对外提供服务的端口共用。
+
+        Args:
+            host: 监听地址。默认为 "127.0.0.1"。
+            port: 监听端口。默认为 9464。
+            path: 导出指标的路径，其余路径返回 404。默认为 "/metrics"。
+
+        Returns:
+            asyncio.Server: 监听的服务器，由调用方关闭。
+        """
+        async def respond(reader, writer):
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+                method, target = request.decode("latin-1").split(" ", 2)[:2]
+                if method == "GET" and urlparse(target).path == path:
+                    status, body = "200 OK", (await self.render()).encode("UTF-8")
+                else:
+                    status, body = "404 Not Found", b"Not Found\n"
+                writer.write(
+                    F"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    F"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(respond, host, port)
+
+
+# 本进程的性能指标
+telemetry = metrics()
+
+
+class span:
+    """
+    追踪中的一个跨度，由 tracer.span 创建，作为上下文管理器使用。
+
+    进入时成为当前上下文（contextvars）中的活动跨度，其中创建的跨度和任务都以它为父跨度；
+    退出时将记录交给 tracer 的所有钩子。未被采样的跨度只负责向子跨度传递不采样的决定。
+
+    Attributes:
+        tracer (tracer): 创建该跨度的 tracer。
+        name (str): 跨度名称，如 "servers.recv"。
+        attributes (dict): 附加属性。
+        parent (span | None): 父跨度。
+        sampled (bool): 是否被采样。
+        trace (str): 追踪编号，同一根跨度下的所有跨度相同。
+        id (str): 跨度编号。
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "parent", "sampled", "trace", "id", "start", "begin", "token")
+
+    def __init__(self, tracer, name, attributes, parent, sampled):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.sampled = sampled
+        self.trace = parent.trace if parent else F"{getrandbits(64):016x}"
+        self.id = F"{getrandbits(32):08x}" if sampled else None
+
+    def __enter__(self):
+        self.token = self.tracer.current.set(self if self.sampled else False)
+        self.start = time()
+        self.begin = perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        duration = perf_counter() - self.begin
+        self.tracer.current.reset(self.token)
+        if self.sampled:
+            self.tracer.emit({
+                "name": self.name,
+                "trace": self.trace,
+                "span": self.id,
+                "parent": self.parent.id if self.parent else None,
+                "start": self.start,
+                "duration": duration,
+                "attributes": self.attributes,
+                "error": repr(error) if error is not None else None
+            })
+        return False
+
+
+class tracer:
+    """
+    可插拔的追踪钩子。
+
+    钩子是接收跨度记录字典的可调用对象，通过 hook 注册。没有注册钩子时 span 直接返回空的上下文管理器，
+    被 traced 装饰的方法只多一次属性判断。根跨度按 rate 采样，子跨度沿用根跨度的决定；
+    跨度通过 contextvars 传递，因此 create_task 创建的任务继承创建时的活动跨度。
+
+    Attributes:
+        rate (float): 根跨度的采样比例。
+        hooks (list): 已注册的钩子。
+        current (ContextVar): 当前上下文中的活动跨度，未被采样时为 False。
+
+    Example:
+        >>> tracing.hook(lambda record: print(record["name"], record["duration"]))
+        >>> with tracing.span("custom.stage", peer="127.0.0.1:5555"):
+        ...     pass
+    """
+
+    def __init__(self, rate=1.0):
+        self.rate = rate
+        self.hooks = list()
+        self.current = ContextVar("fuselink_span", default=None)
+
+    def hook(self, callback):
+        """
+        注册一个钩子。
+
+        Args:
+            callback: 接收跨度记录字典的可调用对象，记录包含 name、trace、span、parent、start、duration、attributes 和 error。
+
+        Returns:
+            callback，便于作为装饰器使用。
+        """
+        self.hooks.append(callback)
+        return callback
+
+    def unhook(self, callback):
+        """
+        注销一个钩子。
+
+        Args:
+            callback: 已注册的钩子。
+        """
+        if callback in self.hooks:
+            self.hooks.remove(callback)
+
+    def span(self, name, **attributes):
+        """
+        创建一个跨度。
+
+        Args:
+            name: 跨度名称。
+            **attributes: 附加属性。
+
+        Returns:
+            span | nullcontext: 没有注册钩子或父跨度未被采样时返回空的上下文管理器。
+        """
+        if not self.hooks:
+            return untraced
+        parent = self.current.get()
+        if parent is False:
+            return untraced
+        return span(self, name, attributes, parent, parent is not None or random() < self.rate)
+
+    def emit(self, record):
+        """
+        将跨度记录交给所有钩子，钩子抛出的异常不影响调用方。
+
+        Args:
+            record: 跨度记录字典。
+        """
+        for f1 in self.hooks:
+            try:
+                f1(record)
+            except Exception:
+                pass
+
+
+# 本进程的追踪钩子
+tracing = tracer()
+untraced = nullcontext()
+
+
+def traced(name):
+    """
+    将协程方法的每次调用作为一个跨度，用于服务端和客户端热路径上的各阶段。
+
+    Args:
+        name: 跨度名称。
+
+    Returns:
+        装饰器。
+
+    Example:
+        >>> @traced("servers.verif")
+        ... async def verif(self, ws, timeout=10.0): ...
+    """
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(*args, **kwargs):
+            if not tracing.hooks:
+                return await method(*args, **kwargs)
+            with tracing.span(name):
+                return await method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class profiler:
+    """
+    按需采集 N 秒的性能分析数据。
+
+    由控制消息（{"@profile": {"seconds": 10, "engine": "yappi"}}）或信号（SIGUSR1）触发，
+    同一时间只进行一次采集，结果以 pstats 格式写入 directory，可用 python -m pstats 或 snakeviz 查看。
+    cProfile 分析事件循环所在线程的 CPU 耗时；yappi 按挂钟时间分析，能反映协程的等待时间，需要安装 yappi。
+
+    Attributes:
+        directory (str): 结果文件所在目录。
+        task (asyncio.Task | None): 正在进行的采集。
+        path (str | None): 最近一次采集的结果文件。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or script_dir
+        self.task = None
+        self.path = None
+
+    def start(self, seconds=10.0, engine="cprofile"):
+        """
+        在后台开始一次采集。
+
+        Args:
+            seconds: 采集时长（秒）。默认为 10.0。
+            engine: "cprofile" 或 "yappi"。默认为 "cprofile"。
+
+        Returns:
+            dict: 采集状态，包含 engine、seconds、path 和 running；已有采集在进行时返回该采集的状态。
+
+        Raises:
+            ValueError: 如果 engine 未知或未安装 yappi。
+        """
+        if self.task is not None and not self.task.done():
+            return {"running": True, "path": self.path}
+        if engine not in ("cprofile", "yappi") or (engine == "yappi" and yappi is None):
+            raise ValueError(F"不支持的性能分析器：{engine}")
+        self.path = join(self.directory, F"profile_{getpid()}_{int(time() * 1000)}_{engine}.prof")
+        self.task = asyncio.create_task(self.capture(float(seconds), engine, self.path))
+        return {"running": True, "engine": engine, "seconds": float(seconds), "path": self.path}
+
+    async def capture(self, seconds, engine, path):
+        """
+        采集 seconds 秒并写入结果文件。
+
+        Args:
+            seconds: 采集时长（秒）。
+            engine: "cprofile" 或 "yappi"。
+            path: 结果文件路径。
+        """
+        if engine == "yappi":
+            yappi.set_clock_type("wall")
+            yappi.clear_stats()
+            yappi.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                yappi.stop()
+                yappi.get_func_stats().save(path, type="pstat")
+        else:
+            profile = Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+                profile.dump_stats(path)
+        print(F"[{str(dt.now())[:-7]}] Profile written to {path}")
+
+
+# 本进程的按需性能分析
+profiling = profiler()
+
+
+def encode(data, indent=None):
+    """
+    将数据编码为 JSON 文本，服务端、客户端和 Sanic 网关共用的 JSON 编码入口。
+
+    安装了 orjson 时使用 orjson，否则使用标准库 json。默认输出不含多余空白的紧凑格式，
+    无法直接序列化的对象（如 ObjectId）会转换为字符串。
+
+    Args:
+        data: 待编码的数据。
+        indent: 缩进空格数，用于调试时输出易读格式。默认为 None（紧凑格式）。
+            使用 orjson 时任何缩进均按 2 个空格输出。
+
+    Returns:
+        str: JSON 文本。
+
+    Example:
+        >>> encode({"code": {"status": True}})
+        '{"code":{"status":true}}'
+    """
+    if orjson:
+        try:
+            return orjson.dumps(
+                data,
+                default=str,
+                option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+            ).decode("UTF-8")
+        except TypeError:
+            # 超出 orjson 支持范围的数据（如超过 64 位的整数）回退到标准库
+            pass
+    if indent:
+        return dumps(data, indent=indent, ensure_ascii=False, default=str)
+    return dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def decode(frame):
+    """
+    解码 JSON 文本，服务端、客户端和 Sanic 网关共用的 JSON 解码入口。
+
+    Args:
+        frame: JSON 文本，可以是 str 或 bytes。
+
+    Returns:
+        解码后的数据。
+
+    Raises:
+        ValueError: 如果文本不是合法的 JSON。
+    """
+    if orjson:
+        return orjson.loads(frame)
+    return loads(frame)
+
+
+# WebSocket 子协议与帧编码的对应关系，二进制编码按优先级排列，JSON 作为兜底
+wire_protocols = {
+    "fuselink.msgpack": (
+        lambda data: msgpack.packb(data, use_bin_type=True),
+        lambda frame: msgpack.unpackb(frame, raw=False)
+    ) if msgpack else None,
+    "fuselink.cbor": (cbor2.dumps, cbor2.loads) if cbor2 else None,
+    "fuselink.json": (encode, decode)
+}
+# 各编码的 "+zstd" 变体在帧编码之后再经过自适应压缩（compressor），需要安装 zstandard
+wire_protocols.update({F"{f1}+zstd": f2 if zstandard else None for f1, f2 in list(wire_protocols.items())})
+
+
+class compressor:
+    """
+    自适应压缩，用于协商了 "+zstd" 子协议的连接。
+
+    小于 threshold 的帧不压缩：JSON 帧仍以文本帧发送，二进制帧加上 0x00 标记后发送；
+    其余帧以 zstd 压缩并加上 0x01 标记，压缩后没有变小时同样原样发送。
+    服务端从较大的帧中按 rate 采样，定期用样本训练共享字典，
+    新字典以 0x02 标记的字典帧发送给每个 "+zstd" 连接后才用于压缩；
+    接收方在 unpack 中安装字典，此后发送的帧也使用该字典压缩。
+    压缩帧头中记录了字典编号，解压时据此选择字典，因此最近 keep 个字典都可以解压。
+
+    Attributes:
+        threshold (int): 压缩的最小帧长度。
+        level (int): zstd 压缩级别。
+        size (int): 训练字典的大小（字节）。
+        samples (deque): 训练字典用的帧样本，装满后才会训练。
+        rate (float): 较大帧的采样比例。
+        interval (float): 服务端训练字典的间隔（秒）。
+        keep (int): 保留的字典数量。
+        limit (int): 解压后帧长度的上限，防止解压炸弹。
+        training (bool): 是否采样，由服务端开启。
+        dictionaries (dict): 以字典编号为键的已安装字典，按安装顺序排列。
+        current (int): 压缩使用的字典编号，0 表示不使用字典。
+    """
+
+    def __init__(self, threshold=256, level=3, size=16384, samples=1024, rate=0.1, interval=300.0, keep=4, limit=2 ** 24):
+        self.threshold = threshold
+        self.level = level
+        self.size = size
+        self.samples = deque(maxlen=samples)
+        self.rate = rate
+        self.interval = interval
+        self.keep = keep
+        self.limit = limit
+        self.training = False
+        self.dictionaries = dict()
+        self.current = 0
+        self.compressors = dict()
+        self.decompressors = dict()
+
+    def configure(self, samples=None, **options):
+        """
+        修改压缩参数，已安装的字典保持不变。
+
+        Args:
+            samples: 样本数量。默认为 None（不修改）。
+            **options: 同名属性的新值，如 threshold、level、size、rate、interval。
+        """
+        for f1, f2 in options.items():
+            setattr(self, f1, f2)
+        if samples:
+            self.samples = deque(self.samples, maxlen=samples)
+        self.compressors.clear()
+
+    def compress(self, frame):
+        """
+        压缩一帧编码后的数据。
+
+        Args:
+            frame: 编码后的帧，str 或 bytes。
+
+        Returns:
+            str | bytes: 不压缩的 JSON 帧原样返回，其余返回带标记的二进制帧。
+        """
+        if len(frame) < self.threshold:
+            return frame if isinstance(frame, str) else b"\x00" + frame
+        frame = frame.encode("UTF-8") if isinstance(frame, str) else frame
+        if self.training and random() < self.rate:
+            self.samples.append(frame)
+        if self.current not in self.compressors:
+            self.compressors[self.current] = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self.dictionaries.get(self.current)
+            )
+        packed = self.compressors[self.current].compress(frame)
+        return b"\x01" + packed if len(packed) < len(frame) else b"\x00" + frame
+
+    def decompress(self, frame):
+        """
+        解压一帧带标记的二进制帧。
+
+        Args:
+            frame: 0x00 或 0x01 标记的二进制帧。
+
+        Returns:
+            bytes: 编码后的帧。
+
+        Raises:
+            ValueError: 如果标记未知、字典未安装或解压后的长度超过 limit。
+        """
+        if frame[:1] == b"\x00":
+            return frame[1:]
+        if frame[:1] != b"\x01":
+            raise ValueError(F"未知的压缩帧标记：{frame[:1]!r}")
+        parameters = zstandard.get_frame_parameters(frame[1:])
+        if not 0 <= parameters.content_size <= self.limit:
+            raise ValueError(F"压缩帧解压后的长度超过上限：{parameters.content_size}")
+        if parameters.dict_id not in self.decompressors:
+            if parameters.dict_id and parameters.dict_id not in self.dictionaries:
+                raise ValueError(F"未安装压缩字典：{parameters.dict_id}")
+            self.decompressors[parameters.dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self.dictionaries.get(parameters.dict_id)
+            )
+        return self.decompressors[parameters.dict_id].decompress(frame[1:])
+
+    def install(self, data, activate=True):
+        """
+        安装一个字典，超出 keep 个时移除最早安装且未使用的字典。
+
+        Args:
+            data: zstd 格式的字典数据。
+            activate: 是否立即用于压缩。默认为 True；服务端在字典发送给所有连接后才启用。
+
+        Returns:
+            int: 字典编号。
+
+        Raises:
+            ValueError: 如果数据不是带编号的 zstd 字典。
+        """
+        dictionary = zstandard.ZstdCompressionDict(bytes(data))
+        dictionary_id = dictionary.dict_id()
+        if not dictionary_id:
+            raise ValueError("压缩字典缺少编号")
+        self.dictionaries[dictionary_id] = dictionary
+        for f1 in list(self.dictionaries)[:-self.keep]:
+            if f1 != self.current:
+                self.dictionaries.pop(f1)
+                self.compressors.pop(f1, None)
+                self.decompressors.pop(f1, None)
+        if activate:
+            self.current = dictionary_id
+        return dictionary_id
+
+    def offer(self):
+        """
+        生成最新字典的字典帧，发送给刚建立或仍未收到该字典的连接。
+
+        Returns:
+            bytes | None: 0x02 标记的字典帧；尚未安装字典时返回 None。
+        """
+        if not self.dictionaries:
+            return None
+        return b"\x02" + self.dictionaries[list(self.dictionaries)[-1]].as_bytes()
+
+    async def train(self):
+        """
+        样本装满后在线程池中训练新字典并安装，但不启用。
+
+        Returns:
+            int | None: 新字典的编号；样本不足或训练失败时返回 None。
+        """
+        if len(self.samples) < self.samples.maxlen:
+            return None
+        samples = list(self.samples)
+        self.samples.clear()
+        try:
+            dictionary = await asyncio.get_running_loop().run_in_executor(
+                None, partial(zstandard.train_dictionary, self.size, samples, level=self.level)
+            )
+        except zstandard.ZstdError:
+            return None
+        return self.install(dictionary.as_bytes(), activate=False)
+
+
+# 本进程所有 "+zstd" 连接共用的自适应压缩
+adaptive = compressor()
+
+
+def compressed(subprotocol):
+    """
+    判断子协议是否启用了自适应压缩。
+
+    Args:
+        subprotocol: 连接协商的子协议，即 ws.subprotocol。
+
+    Returns:
+        bool: 协商了可用的 "+zstd" 子协议时返回 True。
+    """
+    return bool(subprotocol and subprotocol.endswith("+zstd") and wire_protocols.get(subprotocol))
+
+
+def negotiate(subprotocols=None):
+    """
+    过滤出当前环境可用的子协议。
+
+    Args:
+        subprotocols: 配置的子协议列表。为 None 时不协商子协议，收发均使用 JSON。
+
+    Returns:
+        list[str] | None: 可用的子协议列表，保持配置中的优先顺序；未配置时返回 None。
+
+    Example:
+        >>> negotiate(["fuselink.msgpack", "fuselink.json"])
+        ["fuselink.msgpack", "fuselink.json"]
+    """
+    if subprotocols is None:
+        return None
+    return [f1 for f1 in subprotocols if wire_protocols.get(f1) or f1 not in wire_protocols]
+
+
+def pack(data, subprotocol=None):
+    """
+    按连接协商的子协议编码一帧数据。
+
+    Args:
+        data: 待发送的数据。
+        subprotocol: 连接协商的子协议，即 ws.subprotocol。未协商时使用 JSON。
+
+    Returns:
+        str | bytes: JSON 编码时返回文本帧，二进制编码时返回二进制帧；
+            "+zstd" 子协议下较大的帧经自适应压缩后返回二进制帧。
+    """
+    frame = (wire_protocols.get(subprotocol) or wire_protocols["fuselink.json"])[0](data)
+    if compressed(subprotocol):
+        return adaptive.compress(frame)
+    return frame
+
+
+def unpack(frame, subprotocol=None):
+    """
+    按连接协商的子协议解码一帧数据。
+
+    文本帧始终按 JSON 解码，二进制帧按协商的二进制编码解码，
+    因此对端未切换编码时也能正确解析。"+zstd" 子协议下二进制帧先按标记解压；
+    字典帧在此安装，返回不含 code 的 {"@zstd": 字典编号}，与 code 中带有 "@zstd" 的普通消息区分。
+
+    Args:
+        frame: 接收到的帧。
+        subprotocol: 连接协商的子协议，即 ws.subprotocol。
+
+    Returns:
+        解码后的数据。
+    """
+    if isinstance(frame, str):
+        with telemetry.time("fuselink_decode_seconds", codec="fuselink.json"):
+            return wire_protocols["fuselink.json"][1](frame)
+    with telemetry.time("fuselink_decode_seconds", codec=subprotocol or "fuselink.json"):
+        if compressed(subprotocol):
+            # 字典只由服务端下发，训练字典的服务端不接受对端的字典帧
+            if frame[:1] == b"\x02" and not adaptive.training:
+                return {"@zstd": adaptive.install(frame[1:])}
+            frame = adaptive.decompress(frame)
+        return (wire_protocols.get(subprotocol) or wire_protocols["fuselink.json"])[1](frame)
+
+
+# 分块传输的数据帧：3 字节魔数、16 字节传输编号、4 字节序号和 1 字节标志（1 为最后一块），之后是块内容
+chunk_magic = b"FLC"
+chunk_header = Struct(">3s16sIB")
+
+
+def chunked(frame):
+    """
+    判断一帧是否为分块传输的数据帧。数据帧是二进制帧，不经过子协议编码和自适应压缩。
+
+    Args:
+        frame: 接收到的帧。
+
+    Returns:
+        bool: 以 chunk_magic 开头的二进制帧返回 True。
+    """
+    return isinstance(frame, bytes) and frame[:len(chunk_magic)] == chunk_magic
+
+
+# 握手阶段验证使用的请求头，也可以用同名的查询参数（type、secret、code）代替
+handshake_headers = {
+    "type": "X-FuseLink-Type",
+    "secret": "X-FuseLink-Secret",
+    "code": "X-FuseLink-Code",
+    "resume": "X-FuseLink-Resume"
+}
+
+
+async def loop(ws, *methods):
+    """
+    并发地反复调用多个 WebSocket 处理方法，直到其中任意一个抛出异常。
+
+    每个方法都以 ws 为唯一参数，在独立任务中循环执行。任一任务抛出异常时，
+    取消其余任务并将该异常向上抛出，避免接收与发送互相阻塞。
+
+    Args:
+        ws: WebSocket 连接对象。
+        *methods: 需要循环调用的协程方法。
+
+    Raises:
+        Exception: 任一方法抛出的异常。
+
+    Example:
+        >>> await loop(ws, server.recv, server.send)
+    """
+    async def repeat(method):
+        while True:
+            await method(ws)
+
+    tasks = [asyncio.create_task(repeat(f1)) for f1 in methods]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for f1 in tasks:
+            f1.cancel()
+
+
+# 消息的优先级通道及其默认权重，按优先级从高到低排列。control 通道只用于服务端生成的消息（如在线设备推送），
+# 由服务端在消息上设置 "@lane": "control" 标记；消息的 priority 字段只能在 priority_lanes 中选择，
+# 未指定时分块传输属于 bulk，其余属于 data
+lane_weights = {"control": 8, "data": 4, "bulk": 1}
+priority_lanes = ("data", "bulk")
+
+
+def lane(document):
+    """
+    判断消息所属的优先级通道。
+
+    control 通道的消息不计入发送队列的水位，只有带服务端标记 "@lane": "control" 的消息属于该通道；
+    客户端消息的 "@" 字段在 inbound 中去掉，priority 也不能指定 control，因此对端不能借此绕过流量控制。
+
+    Args:
+        document: 消息字典，或 clients.forward 中形如 {"recv": ..., "code": ..., "priority": ...} 的待发送消息。
+
+    Returns:
+        str: lane_weights 中的通道名称。
+
+    Example:
+        >>> lane({"code": {"@presence": {"version": 3}}, "@lane": "control"})
+        "control"
+        >>> lane({"code": {"x": 1}, "priority": "bulk"})
+        "bulk"
+        >>> lane({"code": {"x": 1}, "priority": "control"})
+        "data"
+    """
+    if document.get("@lane") == "control":
+        return "control"
+    if document.get("priority") in priority_lanes:
+        return document["priority"]
+    code = document.get("code")
+    if isinstance(code, dict) and "@stream" in code:
+        return "bulk"
+    return "data"
+
+
+def inbound(message_data):
+    """
+    去掉客户端消息中由服务端使用的顶层字段：_id、date 和以 @ 开头的字段（如 @spill、@queued、@lane），
+    使客户端不能伪造持久化编号、暂存位置或通道标记，让服务端删除他人的消息、读取任意暂存文件或绕过流量控制；
+    不在 priority_lanes 中的 priority 同样去掉。
+
+    Args:
+        message_data: 已解码的客户端消息。
+
+    Returns:
+        dict: 去掉内部字段后的消息。
+
+    Example:
+        >>> inbound({"network": {...}, "code": {"x": 1}, "@spill": {"disk": "/etc/passwd"}, "_id": "..."})
+        {"network": {...}, "code": {"x": 1}}
+    """
+    return {
+        f1: f2 for f1, f2 in message_data.items()
+        if f1 not in ("_id", "date") and not str(f1).startswith("@") and (f1 != "priority" or f2 in priority_lanes)
+    }
+
+
+class outbox:
+    """
+    单个连接的有界发送队列，为慢速的接收方提供流量控制。
+
+    消息按优先级通道（见 lane）分别排队，推送时按 weights 以平滑加权轮询在非空的通道之间调度，
+    因此大量积压的数据消息和分块传输不会拖慢控制消息，同时低优先级的通道也不会被完全饿死。
+    control 通道只有服务端生成的少量消息，不计入水位，也不会溢出或丢弃；客户端发来的消息都计入水位。
+
+    data 和 bulk 通道的消息总数达到高水位 high 时按 policy 处理新消息，降到低水位 low 以下时恢复：
+        - "spill": 新消息写入 server_data，队列降到低水位后按 _id 顺序分批取回；
+        - "block": 发送方在 servers.recv 中等待至多 timeout 秒，超时后按 spill 处理；
+        - "drop_old": 丢弃优先级最低的非空通道中最早的消息，为新消息腾出位置；
+        - "disconnect": 断开接收方的连接，新消息交由调用方持久化，待其重连后取回。
+    server_data 中还有尚未取回的消息（spilled）时，无论采用哪种策略，新消息都写入 server_data，
+    排在这些消息之后，保证按发送顺序送达。因此单个停止读取的客户端最多占用 high 条消息的内存，不会拖慢其他连接。
+
+    Attributes:
+        address (list): 接收方网络地址。
+        aliases (list): 同样投递到该队列的其他地址，如恢复会话时的原会话地址。
+        high (int): 高水位，即内存中最多保留的消息数。
+        low (int): 低水位。
+        policy (str): 超过高水位时的策略。
+        timeout (float): block 策略下发送方的最长等待时间（秒）。
+        weights (dict): 各通道的调度权重。
+        lanes (dict): 以通道名称为键、待发送消息的 deque 为值。
+        credits (dict): 平滑加权轮询中各通道的当前权重。
+        writable (asyncio.Event): 队列低于高水位时置位，block 策略下发送方据此等待。
+        spilled (bool): server_data 中是否还有尚未取回的溢出消息。
+        overflow (bool): disconnect 策略下是否已超过高水位。
+        spills (int): 累计溢出到 server_data 的消息数。
+        dropped (int): 累计丢弃的消息数。
+
+    Example:
+        >>> queue = outbox(["127.0.0.1", 12345], high=2, low=1, policy="drop_old")
+        >>> queue.put({"code": 1}), queue.put({"code": 2}), queue.put({"code": 3})
+        (True, True, True)
+        >>> await queue.get()
+        {"code": 2}
+    """
+
+    def __init__(self, address, high=1024, low=256, policy="spill", timeout=5.0, weights=None):
+        if policy not in ("spill", "block", "drop_old", "disconnect"):
+            raise ValueError(f"未知的发送队列策略：{policy}")
+        if set(weights or lane_weights) != set(lane_weights) or min((weights or lane_weights).values()) <= 0:
+            raise ValueError(f"发送队列的通道权重须为 {", ".join(lane_weights)} 的正数：{weights}")
+        self.address = list(address)
+        self.aliases = list()
+        self.high = max(high, 1)
+        self.low = min(low, self.high - 1)
+        self.policy = policy
+        self.timeout = timeout
+        self.weights = {f1: (weights or lane_weights)[f1] for f1 in lane_weights}
+        self.lanes = {f1: deque() for f1 in lane_weights}
+        self.credits = dict.fromkeys(lane_weights, 0)
+        self.ready = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.spilled = False
+        self.overflow = False
+        self.spills = 0
+        self.dropped = 0
+        self.cursor = None
+        self.tasks = set()
+
+    def __len__(self):
+        return sum(len(f1) for f1 in self.lanes.values())
+
+    def backlog(self):
+        """
+        获取计入水位的消息数，即 control 以外各通道的消息总数。
+        """
+        return len(self) - len(self.lanes["control"])
+
+    def track(self, coroutine):
+        """
+        在后台执行数据库操作，并记录尚未完成的操作。
+
+        Args:
+            coroutine: 数据库操作协程。
+        """
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def put(self, document):
+        """
+        将消息放入队列，超过高水位时按策略处理。
+
+        Args:
+            document: 待推送的消息字典。
+
+        Returns:
+            bool: 消息已入队或已溢出到 server_data 时返回 True；disconnect 策略下超过高水位时返回 False。
+        """
+        # 记录入队时间，推送后据此统计送达耗时
+        document.setdefault("@queued", time())
+        document_lane = lane(document)
+        if document_lane == "control":
+            self.lanes["control"].append(document)
+            self.ready.set()
+            return True
+        if self.backlog() >= self.high and self.policy == "disconnect" and not self.spilled:
+            self.overflow = True
+            self.ready.set()
+            return False
+        if self.backlog() >= self.high and self.policy == "drop_old" and not self.spilled:
+            dropped = next(f1 for f1 in reversed(self.lanes.values()) if f1).popleft()
+            self.dropped += 1
+            if "_id" in dropped:
+                self.track(telemetry.timed(
+                    server_data.locate(dropped["network"]["recv"]).delete_one({"_id": dropped["_id"]}),
+                    "fuselink_mongo_seconds", collection="server_data", operation="delete"
+                ))
+        elif self.spilled or self.backlog() >= self.high:
+            # 溢出的消息按写入顺序追加在内存队列之后，取回前不再进入内存
+            self.spilled = True
+            self.spills += 1
+            self.track(telemetry.timed(
+                server_data.insert_one({**document, "date": dt.now(timezone.utc)}),
+                "fuselink_mongo_seconds", collection="server_data", operation="insert"
+            ))
+            return True
+        self.lanes[document_lane].append(document)
+        self.ready.set()
+        if self.backlog() >= self.high:
+            self.writable.clear()
+        return True
+
+    def pick(self, busy=None):
+        """
+        以平滑加权轮询选出下一条消息所在的通道：每个非空通道的当前权重加上其权重，选出当前权重最大的通道，
+        再从其当前权重中减去所有非空通道的权重之和。空通道的当前权重归零。
+
+        Args:
+            busy: 视为非空的通道，用于在推送分块传输的间隙让该通道参与调度。默认为 None。
+
+        Returns:
+            str | None: 通道名称；没有非空的通道时返回 None。
+        """
+        active = [f1 for f1, f2 in self.lanes.items() if f2 or f1 == busy]
+        if not active:
+            return None
+        for f1 in self.credits:
+            self.credits[f1] = self.credits[f1] + self.weights[f1] if f1 in active else 0
+        chosen = max(active, key=self.credits.get)
+        self.credits[chosen] -= sum(self.weights[f1] for f1 in active)
+        return chosen
+
+    def take(self, name):
+        """
+        从指定通道取出最早的消息，降到低水位时恢复写入。
+
+        Args:
+            name: 通道名称。
+
+        Returns:
+            dict: 待发送的消息。
+        """
+        document = self.lanes[name].popleft()
+        if self.backlog() <= self.low:
+            self.writable.set()
+        return document
+
+    def interleave(self, busy):
+        """
+        在推送一条分块传输的间隙按权重调度一次，取出应先于下一块发送的其他通道的消息。
+
+        Args:
+            busy: 正在推送的分块传输所在的通道。
+
+        Returns:
+            dict | None: 其他通道的消息；轮到正在推送的通道或其他通道均为空时返回 None。
+        """
+        if not any(f2 for f1, f2 in self.lanes.items() if f1 != busy):
+            return None
+        chosen = self.pick(busy)
+        if chosen == busy:
+            return None
+        return self.take(chosen)
+
+    async def get(self):
+        """
+        按权重取出下一条待发送的消息，队列为空时等待。队列降到低水位且有溢出消息时先从 server_data 取回。
+
+        Returns:
+            dict: 待发送的消息。
+
+        Raises:
+            OverflowError: disconnect 策略下队列超过高水位。
+        """
+        if self.spilled and self.backlog() <= self.low:
+            await self.reload()
+        while not len(self) and not self.overflow:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.overflow:
+            raise OverflowError(f"发送队列超过高水位：{self.address} 积压超过 {self.high} 条消息")
+        return self.take(self.pick())
+
+    async def reload(self):
+        """
+        按 _id 顺序从 server_data 取回发往该地址的消息，直到队列达到高水位。
+
+        连接建立时用于取回离线期间积压的消息，之后用于取回溢出的消息。
+        取回前等待尚未完成的溢出写入，避免遗漏刚写入的消息。
+        该地址及其别名位于不同分区时，分别从各分区取回后按 _id 合并。取回的消息按优先级通道分别排队。
+        """
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        spills = self.spills
+        count = self.high - self.backlog()
+        queries = list()
+        for collection, addresses in server_data.route([self.address, *self.aliases]):
+            query = {"$or": [{"network.recv": f1} for f1 in addresses]}
+            if self.cursor is not None:
+                query["_id"] = {"$gt": self.cursor}
+            queries.append(telemetry.timed(
+                collection.find(query).sort("_id", 1).limit(count).to_list(length=count),
+                "fuselink_mongo_seconds", collection="server_data", operation="find"
+            ))
+        results = await asyncio.gather(*queries)
+        documents = results[0] if len(results) == 1 else sorted(
+            (f2 for f1 in results for f2 in f1), key=lambda f1: f1["_id"]
+        )[:count]
+        if documents:
+            self.cursor = documents[-1]["_id"]
+            for f1 in documents:
+                self.lanes[lane(f1)].append(f1)
+            self.ready.set()
+        self.spilled = len(documents) >= count or spills != self.spills
+        if self.backlog() >= self.high:
+            self.writable.clear()
+
+    def drain(self):
+        """
+        清空队列，取出尚未持久化的消息，在连接断开时调用。
+        带 _id 的消息仍在 server_data 中，control 通道的消息只对当前连接有效，二者都不再取出。
+
+        Returns:
+            list: 按通道优先级和入队顺序排列的消息。
+        """
+        documents = [f2 for f1, f3 in self.lanes.items() if f1 != "control" for f2 in f3 if "_id" not in f2]
+        for f1 in self.lanes.values():
+            f1.clear()
+        return documents
+
+    def stats(self):
+        """
+        获取队列状态。
+
+        Returns:
+            dict: 包含地址、队列长度、各通道的消息数、水位、策略和累计溢出、丢弃数量的字典。
+        """
+        return {
+            "address": self.address,
+            "depth": len(self),
+            "lanes": {f1: len(f2) for f1, f2 in self.lanes.items()},
+            "high": self.high,
+            "low": self.low,
+            "policy": self.policy,
+            "spilled": self.spilled,
+            "spills": self.spills,
+            "dropped": self.dropped
+        }
+
+
+class routes:
+    """
+    进程内路由表，将接收方网络地址映射到该连接的发送队列。
+
+    服务端在客户端验证通过后为其登记一个发送队列，servers.recv 收到消息时直接
+    将消息放入接收方的队列，由 servers.send 立即推送给接收方。多进程模式下，
+    接收方连接在其他进程时经 relay 转发。只有接收方不在线时，消息才会写入
+    server_data 作为持久化的兜底存储。每个连接的发送队列都是有界的 outbox。
+
+    Attributes:
+        table (dict): 以地址元组为键、outbox 为值的路由表。
+        relay (relay | None): 进程间路由通道，单进程模式下为 None。
+        options (dict): 创建 outbox 时使用的水位和策略参数。
+
+    Example:
+        >>> table = routes()
+        >>> queue = table.open(["127.0.0.1", 12345])
+        >>> table.push(["127.0.0.1", 12345], {"code": {}})
+        True
+    """
+
+    def __init__(self, relay=None, **options):
+        self.table = dict()
+        self.relay = relay
+        self.options = options
+
+    def open(self, address):
+        """
+        为指定地址登记新的发送队列。
+
+        Args:
+            address: 客户端网络地址，如 ["127.0.0.1", 12345]。
+
+        Returns:
+            outbox: 该地址的发送队列。
+        """
+        queue = outbox(address, **self.options)
+        self.table[tuple(address)] = queue
+        if self.relay:
+            self.relay.announce({"own": [list(address)]})
+        return queue
+
+    async def close(self, address, queue=None):
+        """
+        注销指定地址的发送队列，并转交队列中尚未推送的消息。
+
+        队列中没有 _id 的消息只在内存中，接收方已由其他连接接管（如恢复会话）时放入其新队列，
+        否则以一次 insert_many 写回 server_data，接收方重连后由 servers.pending 取回。
+
+        Args:
+            address: 客户端网络地址。
+            queue: 仅当当前登记的队列为该对象时才注销，已被其他队列取代时只转交其中的消息。默认为 None（无条件注销）。
+        """
+        current = self.table.get(tuple(address))
+        queue = current if queue is None else queue
+        if queue is None:
+            return
+        if current is queue:
+            self.table.pop(tuple(address))
+            # 一并注销仍指向该队列的别名
+            dropped = [list(address)] + [f1 for f1 in queue.aliases if self.table.get(tuple(f1)) is queue]
+            for f1 in dropped[1:]:
+                self.table.pop(tuple(f1))
+            if self.relay:
+                self.relay.announce({"drop": dropped})
+        documents = [f1 for f1 in queue.drain() if not self.handover(f1)]
+        if documents:
+            await telemetry.timed(
+                server_data.insert_many([{**f1, "date": dt.now(timezone.utc)} for f1 in documents], ordered=False),
+                "fuselink_mongo_seconds", collection="server_data", operation="insert_many"
+            )
+
+    def handover(self, document):
+        """
+        将已注销队列中的消息放入接收方在本进程的当前队列。
+
+        Returns:
+            bool: 消息已入队（或已按策略溢出）时返回 True。
+        """
+        queue = self.get(document["network"]["recv"])
+        return bool(queue is not None and queue.put(document))
+
+    def alias(self, address, queue):
+        """
+        将另一个地址指向已登记的发送队列，发往该地址的消息同样投递到该队列。
+
+        Args:
+            address: 别名地址，如恢复会话时的原会话地址。
+            queue: 已登记的发送队列。
+        """
+        queue.aliases.append(list(address))
+        self.table[tuple(address)] = queue
+        if self.relay:
+            self.relay.announce({"own": [list(address)]})
+
+    def get(self, address):
+        """
+        获取指定地址的发送队列。
+
+        Args:
+            address: 客户端网络地址。
+
+        Returns:
+            outbox | None: 发送队列，地址不在本进程时返回 None。
+        """
+        return self.table.get(tuple(address))
+
+    async def wait(self, address):
+        """
+        block 策略下，等待接收方的发送队列降到低水位，最长等待其 timeout 秒。
+
+        Args:
+            address: 接收方网络地址。
+        """
+        queue = self.get(address)
+        if queue is None or queue.policy != "block" or queue.writable.is_set():
+            return
+        try:
+            await asyncio.wait_for(queue.writable.wait(), timeout=queue.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self):
+        """
+        获取本进程所有连接的发送队列状态。
+
+        Returns:
+            list: 各连接 outbox.stats 的结果，按队列长度降序排列。
+        """
+        return sorted((f1.stats() for f1 in self.table.values()), key=lambda f1: -f1["depth"])
+
+    def push(self, address, document):
+        """
+        将消息放入接收方的发送队列。
+
+        Args:
+            address: 接收方网络地址。
+            document: 待推送的消息字典。
+
+        Returns:
+            bool: 接收方在本进程且消息已入队（或已按策略溢出），或已转发给接收方所在的进程时返回 True，
+                  接收方不在线或其队列拒绝接收时返回 False。
+        """
+        queue = self.get(address)
+        if queue is None:
+            return bool(self.relay and self.relay.push(address, document))
+        return queue.put(document)
+
+
+class relay:
+    """
+    进程间路由通道，使消息能够送达连接在其他服务端进程或其他节点上的接收方。
+
+    通道上的每个端点对应一个服务端进程，端点可以是 Unix 套接字路径（同一节点的多进程模式），
+    也可以是 "host:port" 形式的 TCP 地址（跨节点的集群模式）。每个进程监听自己的端点，
+    并与其他所有端点保持持久连接，断开后自动重连，通道上逐行传输 JSON 消息。
+    进程在 routes 中登记或注销发送队列时向其他进程广播地址归属，据此维护 owners 表；
+    routes.push 在本进程未找到接收方时，将消息转发给 owners 中记录的进程，客户端无需知道对端连接在哪个节点。
+    地址归属以外的消息（转发的消息、在线设备变更）交由 start 传入的 handler 处理。
+
+    接受连接的一方先发送随机挑战 {"challenge": 十六进制}，发起连接的一方在第一行中回复自己的编号和
+    以共享密钥对挑战与编号计算的 HMAC-SHA256（proof）。未在 timeout 秒内通过验证的连接直接关闭，
+    对端的编号只取自验证通过的第一行，之后各行中的 worker 字段被忽略。
+
+    Attributes:
+        index (int): 本进程在 paths 中的编号。
+        paths (list): 各进程的端点，按编号排列。
+        secret (bytes): 由共享密钥派生的验证密钥，各进程须使用相同的共享密钥。
+        owners (dict): 以地址元组为键、所在进程编号为值的归属表，只包含其他进程的地址。
+        peers (dict): 以进程编号为键、发往该进程的 StreamWriter 为值，只包含当前已连接的进程。
+        limit (int): 单行消息的最大长度（字节）。
+        buffer (int): 转发消息时发往单个进程的写缓冲上限（字节），超过时不再转发，由调用方写入 server_data。
+        timeout (float): 等待对端完成验证的时间（秒）。
+
+    Example:
+        >>> channel = relay(0, ["127.0.0.1:11000", "127.0.0.1:11001"], "共享密钥")
+        >>> await channel.start(table, handler)
+        >>> channel.push(["127.0.0.1", 12345], {"code": {}})
+        True
+    """
+
+    def __init__(self, index, paths, secret, limit=2 ** 24, buffer=2 ** 22, timeout=10.0):
+        secret = secret.encode("UTF-8") if isinstance(secret, str) else secret
+        self.index = index
+        self.paths = paths
+        # 与会话恢复令牌共用同一共享密钥时，派生出单独的密钥，使两者的签名不能互相替代
+        self.secret = hmac.new(secret, b"fuselink.relay", hashlib.sha256).digest()
+        self.owners = dict()
+        self.peers = dict()
+        self.limit = limit
+        self.buffer = buffer
+        self.timeout = timeout
+        self.routes = None
+        self.handler = None
+        self.greeting = None
+        self.server = None
+        self.tasks = list()
+
+    @staticmethod
+    def endpoint(path):
+        """
+        解析端点。
+
+        Args:
+            path: Unix 套接字路径或 "host:port" 形式的 TCP 地址。
+
+        Returns:
+            tuple | None: TCP 地址返回 (host, port)，Unix 套接字返回 None。
+        """
+        if path.startswith("/") or ":" not in path:
+            return None
+        host, port = path.rsplit(":", 1)
+        return host.strip("[]"), int(port)
+
+    def proof(self, challenge, index):
+        """
+        计算进程对挑战的应答。
+
+        Args:
+            challenge (bytes): 接受连接的一方发送的随机挑战。
+            index (int): 发起连接的进程编号。
+
+        Returns:
+            str: 十六进制的 HMAC-SHA256。
+        """
+        return hmac.new(self.secret, challenge + index.to_bytes(4, "big"), hashlib.sha256).hexdigest()
+
+    async def start(self, routes, handler, greeting=None, timeout=10.0):
+        """
+        监听本进程的端点，并开始连接其他所有进程。
+
+        每条连接建立后应答对端的挑战，并随应答发送本进程编号、已登记的地址和 greeting 返回的内容。
+        启动时最多等待 timeout 秒使其他进程连接就绪，之后未就绪的进程在后台继续重连。
+
+        Args:
+            routes: 本进程的路由表。
+            handler: 处理其他进程发来的消息的协程函数，以消息字典为唯一参数。
+            greeting: 返回随连接建立一并发送的字典的函数。默认为 None。
+            timeout: 启动时等待其他进程就绪的时间（秒）。默认为 10.0。
+        """
+        self.routes = routes
+        self.handler = handler
+        self.greeting = greeting
+        address = self.endpoint(self.paths[self.index])
+        if address:
+            self.server = await asyncio.start_server(self.accept, *address, limit=self.limit)
+        else:
+            self.server = await asyncio.start_unix_server(self.accept, path=self.paths[self.index], limit=self.limit)
+        linked = {f1: asyncio.Event() for f1 in range(len(self.paths)) if f1 != self.index}
+        self.tasks = [asyncio.create_task(self.link(f1, f2)) for f1, f2 in linked.items()]
+        if linked:
+            await asyncio.wait([asyncio.create_task(f1.wait()) for f1 in linked.values()], timeout=timeout)
+
+    async def dial(self, path):
+        """
+        连接指定端点。
+
+        Args:
+            path: Unix 套接字路径或 "host:port" 形式的 TCP 地址。
+
+        Returns:
+            tuple: (StreamReader, StreamWriter)。
+        """
+        address = self.endpoint(path)
+        if address:
+            return await asyncio.open_connection(*address, limit=self.limit)
+        return await asyncio.open_unix_connection(path, limit=self.limit)
+
+    async def link(self, index, linked, interval=0.05, backoff=2.0):
+        """
+        与指定进程保持持久连接，连接断开或对端尚未就绪时按指数退避重连。
+
+        Args:
+            index: 目标进程编号。
+            linked: 首次连接成功时置位的事件。
+            interval: 初始重试间隔（秒）。默认为 0.05。
+            backoff: 最大重试间隔（秒）。默认为 2.0。
+        """
+        delay = interval
+        while True:
+            try:
+                reader, writer = await self.dial(self.paths[index])
+                challenge = bytes.fromhex(decode(await asyncio.wait_for(reader.readline(), self.timeout))["challenge"])
+            except (OSError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, backoff)
+                continue
+            delay = interval
+            self.peers[index] = writer
+            self.send(index, {
+                "worker": self.index,
+                "proof": self.proof(challenge, self.index),
+                "own": [list(f1) for f1 in self.routes.table],
+                **(self.greeting() if self.greeting else dict())
+            })
+            linked.set()
+            try:
+                # 对端在挑战之后不再回写，读到 EOF 即表示连接断开
+                await reader.read()
+            finally:
+                if self.peers.get(index) is writer:
+                    self.peers.pop(index)
+                writer.close()
+
+    async def accept(self, reader, writer):
+        """
+        处理其他进程建立的连接，先发送挑战并验证对端的应答，验证通过后逐行读取并分发消息。
+
+        连接断开时遗忘该进程登记的地址，并以 {"lost": [地址, ...]} 通知 handler。
+
+        Args:
+            reader: 连接的读取端。
+            writer: 连接的写入端。
+        """
+        peer = None
+        challenge = urandom(16)
+        try:
+            writer.write(encode({"challenge": challenge.hex()}).encode("UTF-8") + b"\n")
+            message = decode(await asyncio.wait_for(reader.readline(), self.timeout))
+            worker_index = message.get("worker")
+            if not (isinstance(worker_index, int) and worker_index != self.index and 0 <= worker_index < len(self.paths) and
+                    isinstance(message.get("proof"), str) and
+                    hmac.compare_digest(message["proof"], self.proof(challenge, worker_index))):
+                print("进程间连接未通过验证，已断开")
+                writer.close()
+                return
+            peer = worker_index
+        except (ConnectionError, ValueError, AttributeError, asyncio.TimeoutError) as e:
+            print(f"进程间连接未通过验证，已断开：{e}")
+            writer.close()
+            return
+        try:
+            while message is not None:
+                if "own" in message:
+                    self.owners.update({tuple(f1): peer for f1 in message["own"]})
+                if "drop" in message:
+                    for f1 in message["drop"]:
+                        if self.owners.get(tuple(f1)) == peer:
+                            self.owners.pop(tuple(f1))
+                # 地址归属和验证以外的内容交由 handler 处理
+                if message.keys() - {"worker", "proof", "own", "drop"}:
+                    try:
+                        await self.handler({f1: f2 for f1, f2 in message.items() if f1 not in ("worker", "proof")})
+                    except Exception as e:
+                        print(f"进程间消息处理失败：{e}")
+                line = await reader.readline()
+                message = decode(line) if line else None
+        except (ConnectionError, ValueError) as e:
+            print(f"进程间连接异常：{e}")
+        finally:
+            # 对端进程退出时，遗忘其登记的地址
+            lost = [f1 for f1, f2 in self.owners.items() if f2 == peer]
+            for f1 in lost:
+                self.owners.pop(f1)
+            writer.close()
+            if lost:
+                try:
+                    await self.handler({"lost": [list(f1) for f1 in lost]})
+                except Exception as e:
+                    print(f"进程间消息处理失败：{e}")
+
+    def send(self, index, message, bounded=False):
+        """
+        向指定进程发送一条消息。
+
+        Args:
+            index: 目标进程编号。
+            message: 消息字典。
+            bounded: 是否受写缓冲上限约束。地址归属等控制消息不受约束，以免各进程的 owners 表不一致。默认为 False。
+
+        Returns:
+            bool: 消息已写入发往目标进程的连接时返回 True；连接不可用、写入失败，
+                  或受约束且写缓冲超过 buffer（对端读取过慢）时返回 False。
+        """
+        writer = self.peers.get(index)
+        if writer is None or writer.is_closing():
+            return False
+        if bounded and writer.transport.get_write_buffer_size() > self.buffer:
+            return False
+        try:
+            writer.write(encode(message).encode("UTF-8") + b"\n")
+        except (ConnectionError, RuntimeError):
+            return False
+        return True
+
+    def announce(self, message):
+        """
+        向其他所有进程广播一条消息。
+
+        Args:
+            message: 消息字典，如 {"own": [地址]}、{"drop": [地址]}。
+        """
+        for f1 in list(self.peers):
+            self.send(f1, message)
+
+    def push(self, address, document):
+        """
+        将消息转发给接收方所在的进程。
+
+        Args:
+            address: 接收方网络地址。
+            document: 待推送的消息字典。
+
+        Returns:
+            bool: 接收方连接在其他进程且消息已写入发往该进程的连接时返回 True；
+                  接收方不在其他进程、连接不可用或写缓冲已满时返回 False，由调用方写入 server_data。
+        """
+        index = self.owners.get(tuple(address))
+        if index is None:
+            return False
+        return self.send(index, {"push": list(address), "document": document}, bounded=True)
+
+    async def close(self):
+        """
+        停止重连，关闭监听的端点和发往其他进程的连接。
+        """
+        for f1 in self.tasks:
+            f1.cancel()
+        if self.server:
+            self.server.close()
+        for f1 in self.peers.values():
+            f1.close()
+        self.peers.clear()
+
+
+class registry:
+    """
+    已验证会话登记表，将客户端网络地址映射到其验证信息。
+
+    servers.verif 验证成功后登记会话，servers.ws 在连接关闭时注销会话，
+    servers.recv 据此以 O(1) 的字典查找判断通信双方是否已验证。
+    只有在服务端重启（load）或多进程共享会话（shared）时才查询 server_verif。
+
+    Attributes:
+        table (dict): 以地址元组为键、验证信息为值的登记表。
+        shared (bool): 本地未命中时是否回退查询 server_verif，用于多进程部署。
+
+    Example:
+        >>> sessions = registry()
+        >>> sessions.add(["127.0.0.1", 12345], verif_data)
+        >>> await sessions.verified(["127.0.0.1", 12345])
+        True
+    """
+
+    def __init__(self, shared=False):
+        self.table = dict()
+        self.shared = shared
+
+    def add(self, address, document):
+        """
+        登记已验证的会话。
+
+        Args:
+            address: 客户端网络地址。
+            document: 验证信息字典。
+        """
+        self.table[tuple(address)] = document
+
+    def remove(self, address):
+        """
+        注销会话。
+
+        Args:
+            address: 客户端网络地址。
+        """
+        self.table.pop(tuple(address), None)
+
+    async def verified(self, address):
+        """
+        判断指定地址是否已通过验证。
+
+        Args:
+            address: 客户端网络地址。
+
+        Returns:
+            bool: 已验证返回 True，否则返回 False。
+        """
+        if tuple(address) in self.table:
+            return True
+        if self.shared:
+            return bool(await server_verif.count_documents({"network.send": list(address)}, limit=1))
+        return False
+
+    async def load(self):
+        """
+        从 server_verif 恢复已验证的会话，用于服务端重启后的预热。
+
+        Returns:
+            int: 恢复的会话数量。
+        """
+        async for document in server_verif.find(dict(), {"_id": 0}):
+            self.add(document["network"]["send"], document)
+        return len(self.table)
+
+
+class presence:
+    """
+    在线设备表，在内存中维护在线客户端并记录带版本号的变更。
+
+    servers.verif 验证成功时登记上线，servers.ws 断开连接时登记下线，每次变更使版本号加一
+    并追加到有限长度的变更历史中。客户端携带已知版本号订阅后，只需接收该版本之后的增量变更，
+    版本号过旧或来自服务端重启前（epoch 不同）时改为返回完整快照。
+
+    Attributes:
+        table (dict): 以地址元组为键、设备摘要为值的在线设备表。
+        version (int): 当前版本号。
+        epoch (str): 本次启动的标识，服务端重启后版本号从 0 开始，需以此区分。
+        history (deque): 最近的变更，每项形如 {"version": n, "join": 设备} 或 {"version": n, "leave": 地址}。
+        watchers (set): 已订阅变更的客户端地址元组。
+
+    Example:
+        >>> devices = presence()
+        >>> devices.join(["127.0.0.1", 12345], verif_data)
+        {"version": 1, "join": {...}}
+        >>> devices.since(0)
+        {"version": 1, "epoch": "...", "snapshot": [{...}]}
+        >>> devices.since(1, devices.epoch)
+        {"version": 1, "epoch": "...", "delta": []}
+    """
+
+    def __init__(self, history=1024):
+        self.table = dict()
+        self.version = 0
+        self.epoch = str(uuid1())
+        self.history = deque(maxlen=history)
+        self.watchers = set()
+
+    def join(self, address, document):
+        """
+        登记设备上线。
+
+        Args:
+            address: 客户端网络地址。
+            document: 验证信息字典。
+
+        Returns:
+            dict: 本次变更。
+        """
+        self.version += 1
+        self.table[tuple(address)] = {
+            "utc": document["utc"],
+            "network": document["network"],
+            "code": document["code"],
+            "verif": {
+                "exec": {"parameters": {"type": document["verif"]["exec"]["parameters"].get("type")}},
+                "res": {"verif": document["verif"]["res"]["verif"]}
+            }
+        }
+        self.history.append({"version": self.version, "join": self.table[tuple(address)]})
+        return self.history[-1]
+
+    def leave(self, address):
+        """
+        登记设备下线。
+
+        Args:
+            address: 客户端网络地址。
+
+        Returns:
+            dict | None: 本次变更，设备不在表中时返回 None。
+        """
+        self.watchers.discard(tuple(address))
+        if self.table.pop(tuple(address), None) is None:
+            return None
+        self.version += 1
+        self.history.append({"version": self.version, "leave": list(address)})
+        return self.history[-1]
+
+    def merge(self, delta):
+        """
+        应用其他服务端进程的在线设备变更，使每个进程都维护完整的在线设备表。
+
+        Args:
+            delta: 其他进程 join 或 leave 返回的变更。
+
+        Returns:
+            dict | None: 本进程的变更，版本号按本进程重新编号；变更无效时返回 None。
+        """
+        if "leave" in delta:
+            return self.leave(delta["leave"])
+        self.version += 1
+        self.table[tuple(delta["join"]["network"]["send"])] = delta["join"]
+        self.history.append({"version": self.version, "join": delta["join"]})
+        return self.history[-1]
+
+    def since(self, version=0, epoch=None):
+        """
+        获取指定版本之后的变更。
+
+        Args:
+            version: 客户端已知的版本号。
+            epoch: 客户端已知版本号所属的启动标识。
+
+        Returns:
+            dict: {"version": 当前版本, "epoch": 启动标识, "delta": [变更, ...]}；
+                  无法提供连续增量时返回 {"version": 当前版本, "epoch": 启动标识, "snapshot": [设备, ...]}。
+        """
+        if epoch == self.epoch and version and version <= self.version and (
+            version == self.version or (self.history and self.history[0]["version"] <= version + 1)
+        ):
+            return {
+                "version": self.version,
+                "epoch": self.epoch,
+                "delta": [f1 for f1 in self.history if f1["version"] > version]
+            }
+        return {"version": self.version, "epoch": self.epoch, "snapshot": list(self.table.values())}
+
+
+class tokens:
+    """
+    会话恢复令牌，由服务端签发，客户端重连时出示以跳过 TOTP 验证并恢复原会话。
+
+    令牌形如 "载荷.签名"，载荷为 base64url 编码的 JSON（会话地址、客户端类型、过期时间和随机编号 nonce），
+    签名为以 secret 计算的 HMAC-SHA256。多进程或集群部署时各进程须使用相同的 secret，
+    否则只有签发令牌的进程能够验证令牌。令牌只能使用一次：服务端将最新签发的 nonce 记录在该会话的 server_verif 中，
+    恢复会话时原子地消耗它（见 servers.restore），已使用或已被更新的令牌取代的令牌不再有效。
+
+    Attributes:
+        secret (bytes): 签名密钥，未指定时在启动时随机生成。
+        ttl (int): 令牌有效期（秒），同时也是会话断开后保留的时长；为 0 时不签发令牌。
+
+    Example:
+        >>> signer = tokens(ttl=120)
+        >>> token, nonce = signer.issue(["127.0.0.1", 12345], "client_0a1b2c3d4e5f")
+        >>> signer.verify(token)
+        {"address": ["127.0.0.1", 12345], "type": "client_0a1b2c3d4e5f", "exp": 1621548846, "nonce": "9f0c..."}
+    """
+
+    def __init__(self, secret=None, ttl=120):
+        self.secret = secret.encode("UTF-8") if isinstance(secret, str) else (secret or urandom(32))
+        self.ttl = ttl
+
+    def sign(self, payload):
+        """
+        计算载荷的签名。
+
+        Args:
+            payload (str): base64url 编码的载荷。
+
+        Returns:
+            str: base64url 编码的 HMAC-SHA256 签名。
+        """
+        return urlsafe_b64encode(hmac.new(self.secret, payload.encode("UTF-8"), hashlib.sha256).digest()).decode("UTF-8")
+
+    def issue(self, address, typeio=None):
+        """
+        签发会话恢复令牌。
+
+        Args:
+            address: 会话地址，即客户端首次验证时的网络地址。
+            typeio: 客户端类型标识符。
+
+        Returns:
+            tuple: (令牌, 令牌的 nonce)；ttl 为 0 时返回 (None, None)。
+        """
+        if not self.ttl:
+            return None, None
+        nonce = urandom(16).hex()
+        payload = urlsafe_b64encode(
+            encode({"address": list(address), "type": typeio, "exp": int(time()) + self.ttl, "nonce": nonce}).encode("UTF-8")
+        ).decode("UTF-8")
+        return F"{payload}.{self.sign(payload)}", nonce
+
+    def verify(self, token):
+        """
+        校验会话恢复令牌。
+
+        Args:
+            token: 客户端出示的令牌。
+
+        Returns:
+            dict | None: 令牌有效时返回载荷，签名不符、格式错误或已过期时返回 None。
+        """
+        if not self.ttl or not isinstance(token, str) or token.count(".") != 1:
+            return None
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, self.sign(payload)):
+            return None
+        try:
+            payload = decode(urlsafe_b64decode(payload))
+        except ValueError:
+            return None
+        return payload if payload.get("exp", 0) >= time() else None
+
+
+class indexes:
+    """
+    FuseLink 集合索引管理类，声明并创建各集合所需的复合索引与 TTL 索引。
+
+    热点路径按 network.send、network.recv 以及 clients.recv 中 network/code 的组合进行过滤，
+    日志集合、未送达的消息（server_data）和未读取的消息（client_read）按 date 字段过期，
+    存活实例登记表按 heartbeat 字段过期。索引在 servers.server 或 clients.client 启动时幂等创建，
+    已存在的相同索引不会重复创建，TTL 时长变化时通过 collMod 更新。
+
+    Attributes:
+        expire (int): 日志文档的保留时间（秒）。默认为 7 天。
+        undelivered (int): 未送达、未读取消息的保留时间（秒）。默认为 7 天。
+        heartbeat (int): 实例停止心跳后其登记保留的时间（秒）。默认为 300。
+
+    Example:
+        >>> await indexes().create("server")
+        5
+        >>> await indexes().usage("server")
+        {"server_data_xxx": {"_id_": 0, "network_recv": 12, ...}, ...}
+    """
+
+    def __init__(self, expire=7 * 24 * 3600, undelivered=7 * 24 * 3600, heartbeat=300):
+        self.expire = expire
+        self.undelivered = undelivered
+        self.heartbeat = heartbeat
+
+    def declare(self, role):
+        """
+        声明指定角色所需的索引。
+
+        Args:
+            role: "server" 或 "client"。
+
+        Returns:
+            list: (集合, 索引键, 索引选项) 元组的列表。
+        """
+        match role:
+            case "server":
+                return [
+                    f2 for f1 in server_data.collections for f2 in [
+                        (f1, [("network.recv", 1), ("_id", 1)], {"name": "network_recv"}),
+                        (f1, [("network.send", 1)], {"name": "network_send"}),
+                        (f1, [("date", 1)], {"name": "date_ttl", "expireAfterSeconds": self.undelivered}),
+                    ]
+                ] + [
+                    (server_verif, [("network.send", 1)], {"name": "network_send"}),
+                    (server_log, [("network.send", 1)], {"name": "network_send"}),
+                    (server_log, [("date", 1)], {"name": "date_ttl", "expireAfterSeconds": self.expire}),
+                    (instance_registry, [("heartbeat", 1)], {"name": "heartbeat_ttl", "expireAfterSeconds": self.heartbeat}),
+                ]
+            case "client":
+                return [
+                    (client_read, [("network", 1), ("code", 1)], {"name": "network_code"}),
+                    (client_read, [("date", 1)], {"name": "date_ttl", "expireAfterSeconds": self.undelivered}),
+                    (client_device, [("network.send", 1)], {"name": "network_send"}),
+                    (client_log, [("date", 1)], {"name": "date_ttl", "expireAfterSeconds": self.expire}),
+                    (instance_registry, [("heartbeat", 1)], {"name": "heartbeat_ttl", "expireAfterSeconds": self.heartbeat}),
+                ]
+        return list()
+
+    async def create(self, role):
+        """
+        幂等地创建指定角色所需的索引。
+
+        Args:
+            role: "server" 或 "client"。
+
+        Returns:
+            int: 已确认存在的索引数量。
+        """
+        for collection, keys, options in self.declare(role):
+            try:
+                await collection.create_index(keys, **options)
+            except OperationFailure:
+                # TTL 时长变化时同名索引冲突，改为更新过期时间
+                if "expireAfterSeconds" not in options:
+                    raise
+                await collection.database.command(
+                    "collMod",
+                    collection.name,
+                    index={"name": options["name"], "expireAfterSeconds": options["expireAfterSeconds"]}
+                )
+        return len(self.declare(role))
+
+    async def usage(self, role):
+        """
+        统计指定角色各集合索引的使用次数。
+
+        Args:
+            role: "server" 或 "client"。
+
+        Returns:
+            dict: 以集合名为键、{索引名: 使用次数} 为值的字典。
+        """
+        usage_data = dict()
+        for collection, keys, options in self.declare(role):
+            if collection.name in usage_data:
+                continue
+            usage_data[collection.name] = {
+                f1["name"]: f1["accesses"]["ops"]
+                async for f1 in collection.aggregate([{"$indexStats": {}}])
+            }
+        return usage_data
+
+
+class instances:
+    """
+    存活实例登记表与孤立集合清理。
+
+    每个服务端、客户端或网关进程启动后在 instance_registry 中登记一个实例，并每隔 heartbeat 秒刷新心跳；
+    正常退出时注销，异常退出时由 heartbeat 字段上的 TTL 索引删除。每个命名空间另有一条 seen 记录，
+    保存最后一次有实例存活的时间。清理时删除 grace 秒内没有存活实例的命名空间的全部集合。
+    旧版本以随机后缀命名、从未登记过的命名空间在首次被发现时补记 seen，同样在 grace 秒之后才被删除，
+    因此升级部分进程时不会删除仍在运行的旧版本进程的集合。
+
+    Attributes:
+        id (str): 本实例编号。
+        role (str): "server"、"client" 或 "gateway"。
+        heartbeat (float): 心跳间隔（秒）。
+        sweep (float | None): 清理间隔（秒），为 None 或 0 时本实例不清理。
+        grace (float): 命名空间没有存活实例多久之后视为孤立（秒）。
+        namespace (str | None): 本实例使用的命名空间，为 None 时使用 mongo_namespace。
+        task (asyncio.Task | None): 后台心跳任务。
+
+    Example:
+        >>> instance = instances("server", sweep=3600.0)
+        >>> instance.start()
+        >>> await instance.orphans()
+        ["server_log_1a2b3c4d5e6f", ...]
+    """
+
+    def __init__(self, role, heartbeat=30.0, sweep=None, grace=7 * 24 * 3600, namespace=None):
+        self.id = str(uuid1())
+        self.role = role
+        self.heartbeat = heartbeat
+        self.sweep = sweep
+        self.grace = grace
+        self.namespace = namespace
+        self.task = None
+
+    async def register(self):
+        """
+        登记本实例并刷新心跳，同时刷新本命名空间的 seen 记录。
+        """
+        now = dt.now(timezone.utc)
+        namespace = self.namespace or mongo_namespace
+        await instance_registry.update_one(
+            {"_id": self.id},
+            {"$set": {"namespace": namespace, "role": self.role, "pid": getpid(), "host": gethostname(), "heartbeat": now},
+             "$setOnInsert": {"started": now}},
+            upsert=True
+        )
+        await instance_registry.update_one({"_id": F"namespace:{namespace}"}, {"$set": {"seen": now}}, upsert=True)
+
+    async def live(self):
+        """
+        查询仍有实例存活或在 grace 秒内有实例存活过的命名空间。
+
+        Returns:
+            set: 命名空间名称的集合。
+        """
+        now = dt.now(timezone.utc)
+        alive = await instance_registry.distinct(
+            "namespace", {"heartbeat": {"$gte": now - timedelta(seconds=self.heartbeat * 3)}}
+        )
+        seen = await instance_registry.find(
+            {"seen": {"$gte": now - timedelta(seconds=self.grace)}}, {"_id": 1}
+        ).to_list(length=None)
+        return {self.namespace or mongo_namespace, *alive, *(f1["_id"].removeprefix("namespace:") for f1 in seen)}
+
+    async def orphans(self):
+        """
+        查找孤立的集合：名称符合 mongo_collections 的前缀，但命名空间没有存活实例。
+        集合名称中 "." 之后的后缀（server_data 的分区编号、server_stream 的 GridFS 集合）不属于命名空间。
+        没有 seen 记录的命名空间以当前时间补记首次发现的时间，本次不视为孤立。
+
+        Returns:
+            list: 孤立集合的名称。
+        """
+        live = await self.live()
+        prefixes = sorted(mongo_collections.values(), key=len, reverse=True)
+        candidates = dict()
+        for f1 in await mongo[mongo_database].list_collection_names():
+            prefix = next((f2 for f2 in prefixes if f1.startswith(F"{f2}_")), None)
+            if prefix and f1[len(prefix) + 1:].split(".")[0] not in live:
+                candidates.setdefault(f1[len(prefix) + 1:].split(".")[0], list()).append(f1)
+        orphan_list = list()
+        for f1, f2 in candidates.items():
+            first_seen = await instance_registry.update_one(
+                {"_id": F"namespace:{f1}"}, {"$setOnInsert": {"seen": dt.now(timezone.utc)}}, upsert=True
+            )
+            if first_seen.upserted_id is None:
+                orphan_list.extend(f2)
+        return orphan_list
+
+    async def clean(self):
+        """
+        删除孤立的集合和过期的命名空间 seen 记录。
+
+        Returns:
+            list: 已删除的集合名称。
+        """
+        orphan_list = await self.orphans()
+        for f1 in orphan_list:
+            await mongo[mongo_database].drop_collection(f1)
+        await instance_registry.delete_many(
+            {"seen": {"$lt": dt.now(timezone.utc) - timedelta(seconds=self.grace)}}
+        )
+        return orphan_list
+
+    async def run(self):
+        """
+        后台循环：每隔 heartbeat 秒刷新心跳，每隔 sweep 秒清理一次孤立集合。
+        """
+        swept = 0.0
+        while True:
+            try:
+                await self.register()
+                if self.sweep and asyncio.get_running_loop().time() - swept >= self.sweep:
+                    swept = asyncio.get_running_loop().time()
+                    dropped = await self.clean()
+                    if dropped:
+                        print(F"[{str(dt.now())[:-7]}] Dropped orphaned collections: {", ".join(dropped)}")
+            except Exception as e:
+                print(F"[{str(dt.now())[:-7]}] Instance registry error: {str(e)}")
+            await asyncio.sleep(self.heartbeat)
+
+    def start(self):
+        """
+        启动后台心跳任务。
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """
+        停止后台心跳任务并注销本实例。
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await instance_registry.delete_one({"_id": self.id})
+
+
+class logs:
+    """
+    日志批量写入器，将连接、验证和错误日志合并后批量写入数据库。
+
+    日志先进入有界的内存队列，后台任务在队列达到 size 条或距上次写入超过 interval 秒时，
+    按集合分组并通过一次 bulk_write 写入。同一集合中相同过滤条件的 update 会合并为一次 UpdateOne，
+    因此重连风暴中的日志不再是每个事件一次数据库往返。
+
+    Attributes:
+        size (int): 触发立即写入的队列长度。默认为 256。
+        interval (float): 定时写入的间隔（秒）。默认为 1.0。
+        limit (int): 队列容量上限。默认为 10000。
+        policy (str): 队列已满时的丢弃策略，"drop_new" 丢弃新日志，"drop_old" 丢弃最旧的日志。
+        dropped (int): 已丢弃的日志数量。
+        failed (int): 写入失败的日志操作数量。
+
+    Example:
+        >>> writer = logs(size=128, interval=0.5, policy="drop_old")
+        >>> writer.start()
+        >>> writer.insert(server_log, {"utc": 1621548726})
+        >>> await writer.close()
+    """
+
+    def __init__(self, size=256, interval=1.0, limit=10000, policy="drop_new"):
+        self.size = size
+        self.interval = interval
+        self.limit = limit
+        self.policy = policy
+        self.queue = deque()
+        self.dropped = 0
+        self.failed = 0
+        self.event = None
+        self.task = None
+        self.flushing = None
+        self.closing = False
+
+    def put(self, collection, operation):
+        """
+        将日志操作放入队列，队列已满时按 policy 丢弃。
+
+        Args:
+            collection: 目标集合。
+            operation: ("insert", 文档) 或 ("update", 过滤条件, 文档) 元组。
+        """
+        if len(self.queue) >= self.limit:
+            self.dropped += 1
+            if self.policy != "drop_old":
+                return
+            self.queue.popleft()
+        self.queue.append((collection, operation))
+        if self.event is not None and len(self.queue) >= self.size:
+            self.event.set()
+
+    def insert(self, collection, document):
+        """
+        追加一条插入日志，并附加用于 TTL 过期的 date 字段。
+
+        Args:
+            collection: 目标集合。
+            document: 日志文档。
+        """
+        self.put(collection, ("insert", {**document, "date": dt.now(timezone.utc)}))
+
+    def update(self, collection, filter, document):
+        """
+        追加一条更新或插入（upsert）日志，并附加用于 TTL 过期的 date 字段。
+
+        Args:
+            collection: 目标集合。
+            filter: 过滤条件。
+            document: 通过 $set 写入的字段。
+        """
+        self.put(collection, ("update", filter, {**document, "date": dt.now(timezone.utc)}))
+
+    async def flush(self):
+        """
+        将队列中的日志按集合分组并批量写入。
+
+        Returns:
+            int: 本次写入的日志操作数量。
+        """
+        batch = list(self.queue)
+        self.queue.clear()
+        groups = dict()
+        for collection, operation in batch:
+            group = groups.setdefault(collection.full_name, (collection, list(), dict()))
+            match operation:
+                case ("insert", document):
+                    group[1].append(InsertOne(document))
+                case ("update", filter, document):
+                    # 合并同一过滤条件的更新，保留第一次出现的位置
+                    key = dumps(filter, sort_keys=True, default=str)
+                    if key in group[2]:
+                        group[2][key].update(document)
+                    else:
+                        group[2][key] = dict(document)
+                        group[1].append((filter, group[2][key]))
+        for collection, operations, _ in groups.values():
+            operations = [
+                UpdateOne(f1[0], {"$set": f1[1]}, upsert=True) if isinstance(f1, tuple) else f1
+                for f1 in operations
+            ]
+            try:
+                await collection.bulk_write(operations, ordered=True)
+            except Exception as e:
+                self.failed += len(operations)
+                print(F"[{str(dt.now())[:-7]}] Log write error: {str(e)}")
+        return len(batch)
+
+    async def run(self):
+        """
+        后台写入循环，在队列达到 size 条或每隔 interval 秒时写入日志，close 置位 closing 后写入剩余的日志并退出。
+
+        flush 在写入前已清空队列，因此以 asyncio.shield 保护，任务被取消时正在写入的一批日志仍会写完。
+        """
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.event.clear()
+            if self.queue:
+                await self.shielded()
+        while self.queue:
+            await self.shielded()
+
+    async def shielded(self):
+        """
+        在不受取消影响的任务中写入队列中的日志，并记录于 flushing 以便 close 等待其完成。
+        """
+        self.flushing = asyncio.ensure_future(self.flush())
+        await asyncio.shield(self.flushing)
+
+    def start(self):
+        """
+        启动后台写入任务，需在事件循环中调用。
+        """
+        if self.task is None:
+            self.closing = False
+            self.event = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """
+        停止后台写入任务，等待其写完正在写入的一批和队列中剩余的日志。
+        """
+        if self.task is not None:
+            self.closing = True
+            self.event.set()
+            await asyncio.gather(asyncio.shield(self.task), return_exceptions=True)
+            self.task = None
+            self.event = None
+        # 后台任务曾被取消时，其最后一批日志仍在写入
+        if self.flushing is not None:
+            await asyncio.gather(asyncio.shield(self.flushing), return_exceptions=True)
+            self.flushing = None
+        while self.queue:
+            await self.flush()
+
+
+class sweeper:
+    """
+    断开会话的延迟批量清理器。
+
+    连接断开时只登记会话地址和清理时间，不访问数据库。后台任务每隔 interval 秒取出已到清理时间的会话，
+    每批至多 size 个，交给 callback 合并为一次按 $in 条件的删除。会话在清理时间之前重新连接或被恢复时取消登记，
+    其积压的消息和验证信息得以保留，因此大量设备同时掉线再重连时不会变成成批的删除操作。
+
+    Attributes:
+        callback (Callable): 接收一批会话地址的清理协程函数。
+        grace (float): 断开后保留会话数据的最短时间（秒）。默认为 30.0。
+        interval (float): 检查到期会话的间隔（秒）。默认为 1.0。
+        size (int): 单次清理的最大会话数。默认为 1000。
+        pending (dict): 以会话地址元组为键、清理时间为值的待清理会话。
+        heap (list): 按清理时间排列的 (清理时间, 会话地址) 堆，已取消或已推迟的项在取出时跳过。
+        swept (int): 已清理的会话数量。
+        failed (int): 清理失败的会话数量。
+
+    Example:
+        >>> cleanup = sweeper(server.expire, grace=30.0)
+        >>> cleanup.start()
+        >>> cleanup.defer(("127.0.0.1", 50000))
+        >>> cleanup.cancel(("127.0.0.1", 50000))
+        True
+    """
+
+    def __init__(self, callback, grace=30.0, interval=1.0, size=1000):
+        self.callback = callback
+        self.grace = grace
+        self.interval = interval
+        self.size = size
+        self.pending = dict()
+        self.heap = list()
+        self.swept = 0
+        self.failed = 0
+        self.task = None
+
+    def defer(self, address, grace=None):
+        """
+        登记断开的会话，在 grace 秒后清理；已登记的会话改为按新的时间清理。
+
+        Args:
+            address: 会话地址。
+            grace: 保留时间（秒）。默认为 None（使用 self.grace）。
+        """
+        deadline = time() + (self.grace if grace is None else grace)
+        self.pending[tuple(address)] = deadline
+        heappush(self.heap, (deadline, tuple(address)))
+
+    def cancel(self, address):
+        """
+        取消会话的清理，用于会话在清理之前重新连接或被恢复。
+
+        Args:
+            address: 会话地址。
+
+        Returns:
+            bool: 会话在等待清理时返回 True。
+        """
+        return self.pending.pop(tuple(address), None) is not None
+
+    def due(self, now=None):
+        """
+        取出已到清理时间的会话，至多 size 个。
+
+        Args:
+            now: 当前时间的时间戳。默认为 None（使用 time()）。
+
+        Returns:
+            list: 会话地址元组的列表。
+        """
+        now = time() if now is None else now
+        batch = list()
+        while self.heap and self.heap[0][0] <= now and len(batch) < self.size:
+            deadline, address = heappop(self.heap)
+            if self.pending.get(address) == deadline:
+                del self.pending[address]
+                batch.append(address)
+        return batch
+
+    async def sweep(self, now=None):
+        """
+        分批清理所有已到清理时间的会话。
+
+        Args:
+            now: 当前时间的时间戳。默认为 None（使用 time()）。
+
+        Returns:
+            int: 本次取出的会话数量。
+        """
+        count = 0
+        while batch := self.due(now):
+            count += len(batch)
+            try:
+                await self.callback(batch)
+                self.swept += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(F"[{str(dt.now())[:-7]}] Session cleanup error: {str(e)}")
+        return count
+
+    async def run(self):
+        """
+        后台清理循环，每隔 interval 秒清理一次已到清理时间的会话。
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+    def start(self):
+        """
+        启动后台清理任务，需在事件循环中调用。
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """
+        停止后台清理任务。尚未到期的会话不再清理，其数据由 server_data 和 server_verif 的保留策略处理。
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+class spools:
+    """
+    服务端分块传输的暂存区。
+
+    发送方以 {"@stream": {...}} 控制消息开始一次传输，之后以二进制数据帧（见 chunk_header）逐块发送内容。
+    每一块收到后立即追加写入暂存区并更新 SHA-256 摘要，MongoDB 存储使用 GridFS，内存和 SQLite 存储使用磁盘文件，
+    因此内存占用只与块大小有关，与传输内容的大小无关。传输完成后由 servers 以一条引用暂存内容的消息送达接收方，
+    推送时再从暂存区按块读出。超过 timeout 秒未收到新块的传输视为中断并删除，超过 retain 秒未送达的暂存内容也会删除。
+
+    Attributes:
+        chunk (int): 向接收方推送时每块的大小（字节），也是 GridFS 的块大小。默认为 2**18。
+        limit (int | None): 单次传输的最大字节数，为 None 时不限制。默认为 None。
+        store (str): 暂存方式，"auto"（MongoDB 存储使用 GridFS，否则使用磁盘）、"gridfs" 或 "disk"。默认为 "auto"。
+        directory (str): 磁盘暂存的目录，相对路径相对于脚本所在目录。默认为 "streams"。
+        timeout (float): 传输中断的判定时间（秒）。默认为 300.0。
+        retain (float): 未送达的暂存内容的保留时间（秒）。默认为 7 天。
+        interval (float): 清理中断的传输和过期暂存内容的间隔（秒）。默认为 60.0。
+        uploads (dict): 以传输编号（16 字节）为键的进行中的传输。
+
+    Example:
+        >>> spool = spools(chunk=2**18, store="disk")
+        >>> upload = await spool.open(ws.remote_address, message_data)
+        >>> spill = await spool.write(upload, frame)
+    """
+
+    def __init__(
+        self, chunk=2**18, limit=None, store="auto", directory="streams", timeout=300.0, retain=7 * 24 * 3600, interval=60.0
+    ):
+        self.chunk = chunk
+        self.limit = limit
+        self.store = store
+        self.directory = join(script_dir, directory)
+        self.timeout = timeout
+        self.retain = retain
+        self.interval = interval
+        self.uploads = dict()
+        self.task = None
+
+    @property
+    def gridfs(self):
+        """
+        是否使用 GridFS 暂存。
+        """
+        return self.store == "gridfs" or (self.store == "auto" and isinstance(mongo, AsyncIOMotorClient))
+
+    def bucket(self):
+        """
+        获取当前命名空间的 GridFS 存储桶，其集合为 "server_stream_命名空间.files" 和 "server_stream_命名空间.chunks"。
+        """
+        return AsyncIOMotorGridFSBucket(mongo[mongo_database], bucket_name=names()["server_stream"], chunk_size_bytes=self.chunk)
+
+    async def open(self, owner, message_data):
+        """
+        开始接收一次传输。
+
+        Args:
+            owner: 发送方连接的地址，只接受该连接发来的数据帧。
+            message_data: 开始传输的控制消息，code 形如 {"@stream": {"id": 32 位十六进制编号, "name": 名称, "size": 字节数, "meta": ...}}。
+
+        Returns:
+            dict: 进行中的传输。
+
+        Raises:
+            ValueError: 如果传输编号无效，或声明的大小超过 limit。
+            PermissionError: 如果同一编号的传输正由其他连接进行。
+        """
+        stream = message_data["code"]["@stream"]
+        stream_id = bytes.fromhex(stream["id"])
+        if len(stream_id) != 16:
+            raise ValueError(F"无效的传输编号：{stream['id']}")
+        if self.limit and (stream.get("size") or 0) > self.limit:
+            raise ValueError(F"传输内容超过 {self.limit} 字节")
+        if stream_id in self.uploads:
+            # 只有发起传输的连接可以重新开始同一编号的传输
+            if self.uploads[stream_id]["owner"] != tuple(owner):
+                raise PermissionError(F"传输编号已被其他连接占用：{stream['id']}")
+            await self.abort(self.uploads[stream_id])
+        upload = {
+            "id": stream_id,
+            "owner": tuple(owner),
+            "document": message_data,
+            "seq": 0,
+            "size": 0,
+            "digest": hashlib.sha256(),
+            "updated": time()
+        }
+        if self.gridfs:
+            upload["writer"] = self.bucket().open_upload_stream(stream["id"], metadata={"name": stream.get("name")})
+        else:
+            # 文件名附加 ObjectId，不同传输即使编号相同也不会覆盖彼此已完成的暂存内容
+            upload["path"] = join(self.directory, F"{stream['id']}_{ObjectId()}.part")
+            upload["writer"] = await asyncio.to_thread(self.create, upload["path"])
+        self.uploads[stream_id] = upload
+        return upload
+
+    def create(self, path):
+        """
+        创建磁盘暂存文件，在线程中调用，不阻塞事件循环。
+
+        Returns:
+            io.BufferedWriter: 以二进制写入方式打开的文件。
+        """
+        makedirs(self.directory, exist_ok=True)
+        return open(path, "wb")
+
+    async def write(self, upload, frame):
+        """
+        写入一个数据帧，最后一块写入后结束传输。磁盘暂存的读写在线程中执行。
+
+        Args:
+            upload: open 返回的进行中的传输。
+            frame: 数据帧。
+
+        Returns:
+            dict | None: 传输完成时返回暂存位置，形如 {"gridfs": 文件编号} 或 {"disk": 文件路径}；否则返回 None。
+
+        Raises:
+            ValueError: 如果块序号不连续，或已接收的内容超过 limit。
+        """
+        magic, stream_id, seq, flags = chunk_header.unpack_from(frame)
+        data = memoryview(frame)[chunk_header.size:]
+        if seq != upload["seq"]:
+            raise ValueError(F"块序号不连续：期望 {upload['seq']}，收到 {seq}")
+        if self.limit and upload["size"] + len(data) > self.limit:
+            raise ValueError(F"传输内容超过 {self.limit} 字节")
+        upload["digest"].update(data)
+        if "path" not in upload:
+            await upload["writer"].write(bytes(data))
+        else:
+            await asyncio.to_thread(upload["writer"].write, data)
+        upload["seq"] += 1
+        upload["size"] += len(data)
+        upload["updated"] = time()
+        if not flags & 1:
+            return None
+        self.uploads.pop(upload["id"], None)
+        if "path" not in upload:
+            await upload["writer"].close()
+            return {"gridfs": str(upload["writer"]._id)}
+        path = upload["path"].removesuffix(".part")
+        await asyncio.to_thread(self.finish, upload["writer"], upload["path"], path)
+        return {"disk": path}
+
+    @staticmethod
+    def finish(writer, source, path):
+        """
+        关闭磁盘暂存文件并去掉 .part 后缀，在线程中调用。
+        """
+        writer.close()
+        replace(source, path)
+
+    @staticmethod
+    def discard(writer, path):
+        """
+        关闭并删除未完成的磁盘暂存文件，在线程中调用。
+        """
+        writer.close()
+        remove(path)
+
+    async def abort(self, upload):
+        """
+        中止一次传输，删除已写入的内容。
+
+        Args:
+            upload: 进行中的传输。
+        """
+        self.uploads.pop(upload["id"], None)
+        try:
+            if "path" not in upload:
+                await upload["writer"].abort()
+            else:
+                await asyncio.to_thread(self.discard, upload["writer"], upload["path"])
+        except Exception as e:
+            print(F"[{str(dt.now())[:-7]}] Stream abort error: {str(e)}")
+
+    async def release(self, owner):
+        """
+        中止某个连接上所有进行中的传输，在连接断开时调用。
+
+        Args:
+            owner: 发送方连接的地址。
+        """
+        for f1 in [f2 for f2 in self.uploads.values() if f2["owner"] == tuple(owner)]:
+            await self.abort(f1)
+
+    async def send(self, ws, stream, spill, between=None):
+        """
+        从暂存区按块读出传输内容，以数据帧推送给接收方。块缓冲区在各块之间复用，磁盘暂存的读取在线程中执行。
+
+        Args:
+            ws: 接收方的 WebSocket 连接。
+            stream: 送达消息中的 {"id": ..., "size": ...}。
+            spill: 暂存位置。
+            between: 每推送一块后调用的协程函数，用于在块之间插入其他消息。默认为 None。
+        """
+        stream_id = bytes.fromhex(stream["id"])
+        buffer = bytearray(chunk_header.size + self.chunk)
+        view = memoryview(buffer)
+        if "gridfs" in spill:
+            reader = await self.bucket().open_download_stream(ObjectId(spill["gridfs"]))
+        else:
+            reader = await asyncio.to_thread(open, spill["disk"], "rb")
+        try:
+            seq = 0
+            sent = 0
+            while True:
+                if "gridfs" in spill:
+                    data = await reader.read(self.chunk)
+                    count = len(data)
+                    view[chunk_header.size:chunk_header.size + count] = data
+                else:
+                    count = await asyncio.to_thread(reader.readinto, view[chunk_header.size:])
+                sent += count
+                last = not count or sent >= stream["size"]
+                chunk_header.pack_into(buffer, 0, chunk_magic, stream_id, seq, int(last))
+                await ws.send(view[:chunk_header.size + count])
+                seq += 1
+                if last:
+                    break
+                if between:
+                    await between()
+        finally:
+            if "gridfs" not in spill:
+                await asyncio.to_thread(reader.close)
+
+    async def remove(self, spill):
+        """
+        删除已送达的暂存内容。
+
+        Args:
+            spill: 暂存位置。
+        """
+        try:
+            if "gridfs" in spill:
+                await self.bucket().delete(ObjectId(spill["gridfs"]))
+            else:
+                await asyncio.to_thread(remove, spill["disk"])
+        except Exception as e:
+            print(F"[{str(dt.now())[:-7]}] Stream removal error: {str(e)}")
+
+    async def clean(self):
+        """
+        中止超过 timeout 秒未收到新块的传输，删除超过 retain 秒的暂存内容。
+
+        Returns:
+            int: 删除的暂存内容数量。
+        """
+        now = time()
+        for f1 in [f2 for f2 in self.uploads.values() if now - f2["updated"] > self.timeout]:
+            await self.abort(f1)
+        removed = 0
+        if self.gridfs:
+            expired_cursor = self.bucket().find({"uploadDate": {"$lt": dt.now(timezone.utc) - timedelta(seconds=self.retain)}})
+            async for f1 in expired_cursor:
+                await self.bucket().delete(f1._id)
+                removed += 1
+        else:
+            removed = await asyncio.to_thread(self.purge, {f1.get("path") for f1 in self.uploads.values()}, now)
+        return removed
+
+    def purge(self, active, now):
+        """
+        删除磁盘上超过 retain 秒的暂存内容，在线程中调用。
+
+        Args:
+            active: 进行中的传输的文件路径。
+            now: 当前时间的时间戳。
+
+        Returns:
+            int: 删除的文件数量。
+        """
+        removed = 0
+        if exists(self.directory):
+            for f1 in scandir(self.directory):
+                if f1.is_file() and f1.path not in active and now - f1.stat().st_mtime > self.retain:
+                    remove(f1.path)
+                    removed += 1
+        return removed
+
+    async def run(self):
+        """
+        后台清理循环，每隔 interval 秒清理一次。
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.clean()
+            except Exception as e:
+                print(F"[{str(dt.now())[:-7]}] Stream cleanup error: {str(e)}")
+
+    def start(self):
+        """
+        启动后台清理任务，需在事件循环中调用。
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """
+        停止后台清理任务，并中止所有进行中的传输。
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for f1 in list(self.uploads.values()):
+            await self.abort(f1)
+
+
+class servers:
+    """
+    WebSocket 服务器类，负责处理客户端连接、验证、数据接收和发送。
+
+    该类实现了 WebSocket 服务器的核心功能，包括客户端连接管理、验证流程、
+    消息接收与发送，以及与数据库的交互。设计用于需要实时数据交换和客户端管理的场景。
+
+    Attributes:
+        routes (routes): 进程内路由表，用于将消息直接推送给在线的接收方。
+        registry (registry): 已验证会话登记表，用于快速判断通信双方的验证状态。
+        presence (presence): 在线设备表，向订阅的客户端推送上下线变更。
+        logs (logs): 日志批量写入器，用于写入 server_log。
+        handshake (str): 握手阶段验证模式，"optional"、"required" 或 "off"。
+        handshakes (WeakKeyDictionary): 握手阶段已通过验证的连接及其验证结果。
+        tokens (tokens): 会话恢复令牌的签发和校验。
+        sessions (dict): 以会话地址元组为键、当前承载该会话的连接为值。
+        cleanup (sweeper): 断开会话的延迟批量清理器。
+        spools (spools): 分块传输的暂存区。
+        instances (instances | None): 本实例在存活实例登记表中的登记，启动后创建。
+        metrics (dict | None): 导出性能指标的 HTTP 端点参数，为 None 时不导出。
+        trace (dict): 追踪和性能分析的参数。
+    """
+
+    def __init__(self, shared=False, relay=None):
+        """
+        初始化服务器实例。
+
+        Args:
+            shared: 会话是否由多个服务端进程共享。为 True 时，本地未登记的地址会回退查询 server_verif。
+            relay: 进程间路由通道，多进程模式下由 worker 传入。默认为 None（单进程）。
+        """
+        self.routes = routes(relay)
+        self.registry = registry(shared)
+        self.presence = presence()
+        self.logs = logs()
+        self.handshake = "optional"
+        self.handshakes = WeakKeyDictionary()
+        self.tokens = tokens()
+        self.sessions = dict()
+        self.cleanup = sweeper(self.expire)
+        self.spools = spools()
+        self.instances = None
+        self.metrics = None
+        self.trace = {"rate": 1.0, "control": False, "signal": "SIGUSR1", "seconds": 10.0, "engine": "cprofile"}
+
+    @traced("servers.connect")
+    async def connect(self, ws):
+        """
+        处理客户端连接，记录连接信息。
+
+        创建包含连接时间戳和网络地址的字典，并将其插入日志集合。
+
+        Args:
+            ws: WebSocket 连接对象。
+
+        Returns:
+            包含连接信息的字典，包括 UTC 时间戳、验证状态、网络地址和代码。
+
+        Example:
+            >>> connect_data = await server.connect(ws)
+            >>> print(connect_data)
+            {
+                "utc": 1621548726,
+                "verif": None,
+                "network": {
+                    "send": ["127.0.0.1", 12345],
+                    "recv": ["127.0.0.1", 10000]
+                },
+                "code": None
+            }
+        """
+        # 创建连接信息字典，包含当前时间戳和网络地址
+        connect_data = {
+            "utc": int(time()),
+            "verif": None,
+            "network": {
+                "send": list(ws.remote_address),
+                "recv": list(ws.local_address)
+            },
+            "code": None
+        }
+        # 将连接信息写入日志队列
+        self.logs.insert(server_log, connect_data.copy())
+        return connect_data
+
+    @traced("servers.verif")
+    async def verif(self, ws, timeout=10.0):
+        """
+        处理客户端验证请求。
+
+        等待客户端发送验证信息，使用 TOTP 进行验证，并将结果发送回客户端。
+        如果验证成功，将验证信息插入验证集合，并在验证结果中附带会话恢复令牌（resume）。
+        已在握手阶段（upgrade）通过验证的连接直接使用握手时的验证结果，省去一次往返。
+        验证信息中携带有效的 resume 令牌时跳过 TOTP 验证，恢复令牌中的原会话。
+
+        Args:
+            ws: WebSocket 连接对象。
+            timeout: 等待验证信息的超时时间（秒）。默认为 10.0。
+
+        Returns:
+            包含验证结果的字典，包括 UTC 时间戳、验证状态、网络地址和代码。
+
+        Raises:
+            asyncio.TimeoutError: 如果等待验证信息超时。
+            json.JSONDecodeError: 如果验证信息无法解析为 JSON。
+            Exception: 捕获其他验证过程中的异常。
+
+        Example:
+            >>> verif_data = await server.verif(ws)
+            >>> print(verif_data)
+            {
+                "utc": 1621548726,
+                "verif": {"exec": {"secret": "..."}, "res": {"verif": true}},
+                "network": {
+                    "send": ["127.0.0.1", 12345],
+                    "recv": ["127.0.0.1", 10000]
+                },
+                "code": "Verification successful! You can now proceed with your operation."
+            }
+        """
+        # 创建验证信息字典
+        verif_data = {
+            "utc": int(time()),
+            "verif": None,
+            "network": {
+                "send": list(ws.remote_address),
+                "recv": list(ws.local_address)
+            },
+            "code": None
+        }
+        # 握手阶段已通过验证时直接使用其结果，不再等待验证帧，也不再返回验证结果帧
+        verif_result = self.handshakes.pop(ws, None)
+        handshake = verif_result is not None
+        resume = None
+        try:
+            if not handshake:
+                # 等待客户端发送验证信息，设置超时时间
+                verif_data["verif"] = await asyncio.wait_for(ws.recv(), timeout=timeout)
+                # 将接收到的验证信息解析为字典
+                verif_data["verif"] = unpack(verif_data["verif"], ws.subprotocol)
+                if verif_data["verif"] and isinstance(verif_data["verif"], dict):
+                    # 优先校验会话恢复令牌，令牌无效时使用 mfa.totp 进行验证
+                    verif_result = await self.restore(verif_data["verif"].pop("resume", None))
+                    if verif_result is None:
+                        with telemetry.time("fuselink_totp_seconds"):
+                            verif_result = totp(**verif_data["verif"])
+            if verif_result:
+                # 根据验证结果设置返回信息
+                verif_data["code"] = "Verification successful! You can now proceed with your operation." if verif_result[
+                    "res"]["verif"] else "Verification failed! The OTP is invalid or has expired."
+                verif_data["verif"] = verif_result
+
+                # 如果验证成功，登记会话和在线状态，签发会话恢复令牌，并将验证信息和令牌的 nonce 写入验证集合；
+                # 恢复会话时沿用原会话地址，握手阶段验证的连接沿用 upgraded 签发的令牌
+                nonce = verif_result.pop("nonce", None)
+                if verif_result["res"]["verif"]:
+                    if verif_result.get("resume"):
+                        verif_data["network"]["send"] = verif_result["resume"]
+                    self.session(ws, verif_data["network"]["send"])
+                    self.registry.add(verif_data["network"]["send"], verif_data.copy())
+                    self.notify(self.presence.join(verif_data["network"]["send"], verif_data))
+                    if not handshake:
+                        resume, nonce = self.tokens.issue(
+                            verif_data["network"]["send"], verif_result["exec"]["parameters"].get("type")
+                        )
+                    await telemetry.timed(
+                        server_verif.replace_one(
+                            {"network.send": verif_data["network"]["send"]}, {**verif_data, "nonce": nonce}, upsert=True
+                        ),
+                        "fuselink_mongo_seconds", collection="server_verif", operation="replace"
+                    )
+        except Exception as e:
+            # 捕获验证过程中的异常
+            verif_data["code"] = f"Verification timed out. {str(e)}"
+        # 更新或插入日志信息
+        self.logs.update(server_log, {"network.send": verif_data["network"]["send"]}, verif_data.copy())
+        # 向客户端发送验证结果
+        if not handshake:
+            await ws.send(pack({**verif_data, "resume": resume} if resume else verif_data, ws.subprotocol))
+        if (not verif_data["verif"]):
+            await ws.close()
+        return verif_data
+
+    async def upgrade(self, connection, request):
+        """
+        在 HTTP 升级请求阶段验证 TOTP，作为 serve 的 process_request 钩子。
+
+        验证信息取自 handshake_headers 中的请求头或同名的查询参数，有效的会话恢复令牌可代替 TOTP。验证失败时直接以 403 拒绝，
+        不会建立 WebSocket 连接，也不会写入数据库；验证成功时记录结果，verif 方法不再等待验证帧。
+        未携带验证信息时，handshake 为 "required" 则以 401 拒绝，否则按原流程在连接建立后验证。
+
+        Args:
+            connection: 正在握手的 ServerConnection。
+            request: HTTP 升级请求。
+
+        Returns:
+            websockets.http11.Response | None: 拒绝时返回 HTTP 响应，否则返回 None 继续握手。
+        """
+        if self.handshake == "off":
+            return None
+        with telemetry.time("fuselink_handshake_seconds", stage="upgrade"):
+            query = parse_qs(urlparse(request.path).query)
+            credentials = {
+                f1: request.headers.get(f2) or (query.get(f1) or [None])[0]
+                for f1, f2 in handshake_headers.items()
+            }
+            # 优先校验会话恢复令牌
+            verif_result = await self.restore(credentials.pop("resume"))
+            if verif_result is None:
+                if not credentials["secret"] or not credentials["code"]:
+                    if self.handshake == "required":
+                        return connection.respond(HTTPStatus.UNAUTHORIZED, "TOTP credentials required.\n")
+                    return None
+                try:
+                    with telemetry.time("fuselink_totp_seconds"):
+                        verif_result = totp(**{f1: f2 for f1, f2 in credentials.items() if f2})
+                except Exception:
+                    verif_result = None
+                if not verif_result or not verif_result["res"]["verif"]:
+                    return connection.respond(HTTPStatus.FORBIDDEN, "Verification failed! The OTP is invalid or has expired.\n")
+            self.handshakes[connection] = verif_result
+            return None
+
+    def upgraded(self, connection, request, response):
+        """
+        在握手响应中返回客户端的网络地址，作为 serve 的 process_response 钩子。
+
+        握手阶段通过验证的客户端不再接收验证结果帧，改由 X-FuseLink-Address 响应头获取自身地址（恢复会话时为原会话地址），
+        由 X-FuseLink-Resume 响应头获取新的会话恢复令牌，令牌的 nonce 随验证结果交由 verif 写入 server_verif。
+
+        Args:
+            connection: 正在握手的 ServerConnection。
+            request: HTTP 升级请求。
+            response: HTTP 升级响应。
+        """
+        verif_result = self.handshakes.get(connection)
+        if verif_result:
+            address = verif_result.get("resume") or list(connection.remote_address)
+            response.headers["X-FuseLink-Address"] = encode(address)
+            resume, verif_result["nonce"] = self.tokens.issue(address, verif_result["exec"]["parameters"].get("type"))
+            if resume:
+                response.headers["X-FuseLink-Resume"] = resume
+
+    async def restore(self, token):
+        """
+        校验并消耗会话恢复令牌，生成与 totp 返回格式兼容的验证结果。
+
+        令牌的 nonce 须与该会话在 server_verif 中记录的最新 nonce 相同，校验通过时以一次条件更新原子地清除该 nonce，
+        因此每个令牌只能使用一次，重放的令牌和已被更新的令牌取代的令牌均无效；会话已被清理时令牌同样无效。
+
+        Args:
+            token: 客户端出示的令牌。
+
+        Returns:
+            dict | None: 令牌有效时返回验证结果，其中 resume 为原会话地址；否则返回 None。
+        """
+        payload = self.tokens.verify(token)
+        if not payload or not payload.get("nonce"):
+            return None
+        consumed = await telemetry.timed(
+            server_verif.update_one(
+                {"network.send": payload["address"], "nonce": payload["nonce"]}, {"$unset": {"nonce": ""}}
+            ),
+            "fuselink_mongo_seconds", collection="server_verif", operation="update"
+        )
+        if not consumed.modified_count:
+            return None
+        return {
+            "exec": {"parameters": {"type": payload.get("type")}},
+            "res": {"verif": True},
+            "resume": payload["address"]
+        }
+
+    def session(self, ws, address):
+        """
+        登记会话所在的连接。
+
+        恢复会话或在保留时间内重新连接时取消该会话的清理，恢复会话时将原会话地址指向新连接的发送队列，
+        并关闭仍占用该会话的旧连接。
+
+        Args:
+            ws: 新的 WebSocket 连接对象。
+            address: 会话地址。
+        """
+        superseded = self.sessions.get(tuple(address))
+        self.sessions[tuple(address)] = ws
+        self.cleanup.cancel(address)
+        if tuple(address) != tuple(ws.remote_address):
+            self.routes.alias(address, self.routes.get(ws.remote_address))
+        if superseded is not None and superseded is not ws:
+            asyncio.create_task(superseded.close(reason="Session resumed by another connection"))
+
+    async def expire(self, addresses):
+        """
+        结束一批会话：注销已验证状态，以一次 $in 删除清理这些会话发出的未送达消息和验证信息。
+        由 cleanup 在会话保留时间到期后调用，已重新上线的会话跳过。
+
+        Args:
+            addresses: 会话地址的列表。
+        """
+        addresses = [tuple(f1) for f1 in addresses if tuple(f1) not in self.sessions]
+        if not addresses:
+            return
+        for f1 in addresses:
+            self.registry.remove(f1)
+        expire_query = {"network.send": {"$in": [list(f1) for f1 in addresses]}}
+        await telemetry.timed(
+            server_data.delete_many(expire_query), "fuselink_mongo_seconds", collection="server_data", operation="delete_many"
+        )
+        await telemetry.timed(
+            server_verif.delete_many(expire_query), "fuselink_mongo_seconds", collection="server_verif", operation="delete_many"
+        )
 
     async def recv(self, ws):
         """
@@ -520,61 +3662,416 @@ class servers:
             该方法设计为在 ws 方法中反复调用，以持续处理客户端消息。
         """
         message_data = await ws.recv()
-        try:
-            # 将接收到的消息解析为字典
-            message_data = loads(message_data)
-            # 如果消息包含列表操作请求
-            if "@decive" in message_data.get("code", {}):
-                # 统计符合条件的文档数量
-                count = await server_verif.count_documents(message_data["code"]["@decive"])
-                # 向客户端发送数量信息
-                await ws.send(str(count))
-                # 向客户端发送符合条件的文档
-                async for document in server_verif.find(message_data["code"]["@decive"], {"_id": 0}):
-                    await ws.send(dumps(document, indent=4, ensure_ascii=False))
+        # 分块传输的数据帧直接写入暂存区
+        if chunked(message_data):
+            await self.chunk(ws, message_data)
+            return
+        with tracing.span("servers.recv"):
+            try:
+                # 将接收到的消息解析为字典，并去掉只能由服务端设置的字段
+                message_data = inbound(unpack(message_data, ws.subprotocol))
+                # 如果消息包含列表操作请求，返回一页设备列表
+                if "@decive" in message_data.get("code", {}):
+                    await ws.send(pack(await self.device(message_data), ws.subprotocol))
+                # 如果消息是在线设备订阅请求，经发送队列返回增量变更或快照，保证其先于后续变更送达
+                elif "@presence" in message_data.get("code", {}):
+                    presence_query = message_data["code"]["@presence"] or dict()
+                    self.presence.watchers.add(tuple(ws.remote_address))
+                    self.routes.push(ws.remote_address, {
+                        "utc": int(time()),
+                        "network": message_data["network"],
+                        "code": {"@presence": self.presence.since(presence_query.get("version", 0), presence_query.get("epoch"))},
+                        "@lane": "control"
+                    })
+                # 如果消息是性能分析请求，在允许时开始采集并返回采集状态
+                elif "@profile" in message_data.get("code", {}):
+                    if not self.trace["control"]:
+                        raise PermissionError("Profiling by control message is disabled")
+                    profile_query = message_data["code"]["@profile"] or dict()
+                    message_data["code"] = {"@profile": profiling.start(
+                        profile_query.get("seconds", self.trace["seconds"]), profile_query.get("engine", self.trace["engine"])
+                    )}
+                    await ws.send(pack(message_data, ws.subprotocol))
+                # 如果消息是发送队列查询请求，返回该客户端发送队列的状态
+                elif "@queue" in message_data.get("code", {}):
+                    message_data["code"] = {"@queue": self.routes.get(ws.remote_address).stats()}
+                    await ws.send(pack(message_data, ws.subprotocol))
+                # 如果消息是批量消息
+                elif "@batch" in message_data.get("code", {}):
+                    await ws.send(pack(await self.batch(message_data), ws.subprotocol))
+                # 如果消息是分块传输的开始，之后的数据帧写入暂存区，无法开始时返回失败结果
+                elif "@stream" in message_data.get("code", {}):
+                    stream_result = await self.upload(ws, message_data)
+                    if stream_result:
+                        await ws.send(pack(stream_result, ws.subprotocol))
+                else:
+                    # 检查通信双方的验证状态
+                    message_swap = {
+                        "status": bool(await self.registry.verified(message_data["network"]["send"]) and
+                                       await self.registry.verified(message_data["network"]["recv"]))
+                    }
+                    # 如果验证通过，优先推送给在线的接收方，否则将消息插入数据集合；
+                    # 接收方的发送队列采用 block 策略且已满时，暂停读取发送方的消息
+                    if message_swap["status"]:
+                        await self.routes.wait(message_data["network"]["recv"])
+                    if message_swap["status"] and not self.routes.push(message_data["network"]["recv"], message_data.copy()):
+                        insert_result = await telemetry.timed(
+                            server_data.insert_one({**message_data, "date": dt.now(timezone.utc)}),
+                            "fuselink_mongo_seconds", collection="server_data", operation="insert"
+                        )
+                        message_swap["mongo"] = str(insert_result.inserted_id)
+                    # 向客户端发送消息处理结果
+                    message_data["code"] = {
+                        **message_swap,
+                        **message_data["network"],
+                        "data": message_data["code"]
+                    }
+                    await ws.send(pack(message_data, ws.subprotocol))
+            except Exception as e:
+                # 捕获消息接收和处理过程中的异常
+                if "code" not in message_data:
+                    message_data["code"] = {}
+                message_data["code"]["error"] = str(e)
+                await ws.send(pack(message_data, ws.subprotocol))
+
+    async def device(self, message_data, limit=100, fields=(
+        "utc", "network", "code", "verif.exec.parameters.type", "verif.res.verif"
+    )):
+        """
+        按游标分页查询设备列表，只返回指定的字段。
+
+        设备列表请求的 code 形如 {"@decive": 过滤条件, "limit": 每页数量, "after": 游标, "fields": [字段, ...]}，
+        除 "@decive" 外均可省略。结果按 _id 升序排列，每页打包为一帧返回，
+        默认字段不包含 TOTP 密钥和 otpauth URI。
+
+        Args:
+            message_data: 已解码的设备列表请求字典。
+            limit: 默认每页数量，请求中的 limit 不能超过其 10 倍。默认为 100。
+            fields: 默认返回的字段。
+
+        Returns:
+            dict: 设备列表页，code 形如 {"@decive": [设备, ...], "next": 下一页游标或 None, "query": 原请求参数}。
+
+        Example:
+            >>> await server.device({"network": {...}, "code": {"@decive": {}, "limit": 2}})
+            {"utc": 1621548726, "network": {...}, "code": {"@decive": [{...}, {...}], "next": "665f...", "query": {...}}}
+        """
+        device_query = {
+            "@decive": message_data["code"]["@decive"] or dict(),
+            "limit": min(int(message_data["code"].get("limit") or limit), limit * 10),
+            "fields": list(message_data["code"].get("fields") or fields)
+        }
+        device_filter = device_query["@decive"]
+        if message_data["code"].get("after"):
+            device_filter = {"$and": [device_filter, {"_id": {"$gt": ObjectId(message_data["code"]["after"])}}]}
+        # 多取一条用于判断是否还有下一页
+        device_list = await telemetry.timed(
+            server_verif.find(
+                device_filter,
+                {f1: 1 for f1 in device_query["fields"]}
+            ).sort("_id", 1).limit(device_query["limit"] + 1).to_list(length=device_query["limit"] + 1),
+            "fuselink_mongo_seconds", collection="server_verif", operation="find"
+        )
+        device_next = None
+        if len(device_list) > device_query["limit"]:
+            device_list = device_list[:device_query["limit"]]
+            device_next = str(device_list[-1]["_id"])
+        for f1 in device_list:
+            f1.pop("_id", None)
+        return {
+            "utc": int(time()),
+            "network": message_data["network"],
+            "code": {"@decive": device_list, "next": device_next, "query": device_query}
+        }
+
+    async def backlog(self, limit=100):
+        """
+        统计 server_data 中发往各接收方的未送达消息数，用于 fuselink_pending_messages 仪表。
+        同一接收方的消息只在一个分区中，各分区分别统计后合并。
+
+        Args:
+            limit: 最多返回的接收方数量，按消息数从多到少。默认为 100。
+
+        Returns:
+            dict: 以 (("peer", "host:port"),) 为键、消息数为值的字典。
+        """
+        backlog_list = await asyncio.gather(*(
+            telemetry.timed(
+                f1.aggregate([
+                    {"$group": {"_id": "$network.recv", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$limit": limit}
+                ]).to_list(length=limit),
+                "fuselink_mongo_seconds", collection="server_data", operation="aggregate"
+            ) for f1 in server_data.collections
+        ))
+        backlog_list = sorted((f2 for f1 in backlog_list for f2 in f1), key=lambda f1: f1["count"], reverse=True)[:limit]
+        return {(("peer", ":".join(map(str, f1["_id"] or list()))),): f1["count"] for f1 in backlog_list}
+
+    def notify(self, delta, relay=True):
+        """
+        将在线设备变更推送给所有订阅者。
+
+        Args:
+            delta: presence.join 或 presence.leave 返回的变更。
+            relay: 是否同时广播给其他服务端进程。默认为 True。
+        """
+        if relay and self.routes.relay:
+            self.routes.relay.announce({"presence": delta})
+        for f1 in self.presence.watchers:
+            self.routes.push(f1, {
+                "utc": int(time()),
+                "network": {"send": list(f1), "recv": list(f1)},
+                "code": {"@presence": {"version": delta["version"], "epoch": self.presence.epoch, "delta": [delta]}},
+                "@lane": "control"
+            })
+
+    async def relayed(self, message):
+        """
+        处理其他服务端进程经 relay 发来的消息。
+
+        转发的消息放入接收方的发送队列，接收方已断开时写入 server_data；
+        在线设备变更应用到本进程的在线设备表和会话登记表，并推送给本进程的订阅者。
+        其他进程连接建立时携带其在线设备（joins），连接断开时其设备全部登记下线（lost）。
+
+        Args:
+            message: 形如 {"push": 地址, "document": 消息}、{"presence": 变更}、
+                {"joins": [设备, ...]} 或 {"lost": [地址, ...]} 的字典。
+        """
+        if "push" in message:
+            queue = self.routes.get(message["push"])
+            if queue is None or not queue.put(message["document"]):
+                await telemetry.timed(
+                    server_data.insert_one({**message["document"], "date": dt.now(timezone.utc)}),
+                    "fuselink_mongo_seconds", collection="server_data", operation="insert"
+                )
+        changes = [message["presence"]] if "presence" in message else list()
+        changes.extend({"join": f1} for f1 in message.get("joins", list()))
+        changes.extend({"leave": f1} for f1 in message.get("lost", list()))
+        for f1 in changes:
+            # 其他进程的在线设备同时登记为已验证会话，使跨节点的通信双方无需共享 server_verif
+            if "join" in f1:
+                self.registry.add(f1["join"]["network"]["send"], f1["join"])
             else:
-                # 检查通信双方的验证状态
-                message_swap = {
-                    "status": bool(await server_verif.count_documents({"network.send": message_data["network"]["send"]}) and
-                                   await server_verif.count_documents({"network.send": message_data["network"]["recv"]}))
-                }
-                # 如果验证通过，将消息插入数据集合
-                if message_swap["status"]:
-                    insert_result = await server_data.insert_one(message_data.copy())
-                    message_swap["mongo"] = str(insert_result.inserted_id)
-                # 向客户端发送消息处理结果
-                message_data["code"] = {
-                    **message_swap,
-                    **message_data["network"],
-                    "data": message_data["code"]
+                self.registry.remove(f1["leave"])
+            delta = self.presence.merge(f1)
+            if delta:
+                self.notify(delta, relay=False)
+
+    def greeting(self):
+        """
+        生成与其他服务端进程建立连接时发送的内容，即本进程连接的在线设备。
+
+        Returns:
+            dict: 形如 {"joins": [设备, ...]} 的字典。
+        """
+        return {"joins": [f2 for f1, f2 in self.presence.table.items() if f1 in self.routes.table]}
+
+    async def batch(self, message_data):
+        """
+        处理批量消息，统一校验后一次性写入，并生成逐条状态的批量处理结果。
+
+        批量消息的 code 形如 {"@batch": [{"recv": 接收方地址, "code": 消息内容}, ...], "id": 批次编号}，
+        每一项都按发送方的 utc、verif 和 network.send 展开为一条普通消息，项中的 priority 指定其优先级通道（data 或 bulk）。
+        在线的接收方直接推送，其余消息通过一次 insert_many 写入 server_data。
+
+        Args:
+            message_data: 已解码的批量消息字典。
+
+        Returns:
+            dict: 批量处理结果，code 形如 {"@batch": [{"status": bool, "mongo": str}, ...], "id": 批次编号}，
+                  顺序与请求中的消息一一对应。
+
+        Example:
+            >>> await server.batch({"network": {"send": [...], "recv": [...]}, "code": {"@batch": [...], "id": "..."}})
+            {"utc": 1621548726, "network": {...}, "code": {"@batch": [{"status": True}, ...], "id": "..."}}
+        """
+        sender = message_data["network"]["send"]
+        sender_status = await self.registry.verified(sender)
+        batch_result = list()
+        batch_documents = list()
+        batch_positions = list()
+        for f1 in message_data["code"]["@batch"]:
+            try:
+                document = {
+                    **message_data,
+                    "network": {"send": sender, "recv": f1.get("recv") or sender},
+                    "code": f1["code"],
+                    **({"priority": f1["priority"]} if f1.get("priority") in priority_lanes else dict())
                 }
-                await ws.send(dumps(message_data, indent=4, ensure_ascii=False))
+                batch_result.append({
+                    "status": bool(sender_status and await self.registry.verified(document["network"]["recv"]))
+                })
+                # 如果验证通过，优先推送给在线的接收方，否则留待批量写入
+                if batch_result[-1]["status"]:
+                    await self.routes.wait(document["network"]["recv"])
+                if batch_result[-1]["status"] and not self.routes.push(document["network"]["recv"], document.copy()):
+                    batch_documents.append(document)
+                    batch_positions.append(len(batch_result) - 1)
+            except Exception as e:
+                batch_result.append({"status": False, "error": str(e)})
+        if batch_documents:
+            insert_result = await telemetry.timed(
+                server_data.insert_many([{**f1, "date": dt.now(timezone.utc)} for f1 in batch_documents], ordered=False),
+                "fuselink_mongo_seconds", collection="server_data", operation="insert_many"
+            )
+            for f1, f2 in zip(batch_positions, insert_result.inserted_ids):
+                batch_result[f1]["mongo"] = str(f2)
+        return {
+            "utc": int(time()),
+            "network": message_data["network"],
+            "code": {"@batch": batch_result, "id": message_data["code"].get("id")}
+        }
+
+    async def upload(self, ws, message_data):
+        """
+        开始接收分块传输。通信双方的验证状态与普通消息相同。
+
+        开始传输的消息 code 形如 {"@stream": {"id": 32 位十六进制编号, "name": 名称, "size": 字节数, "meta": ...}}，
+        network.recv 为接收方地址。
+
+        Args:
+            ws: 发送方的 WebSocket 连接。
+            message_data: 已解码的开始传输的消息。
+
+        Returns:
+            dict | None: 无法开始传输时返回失败结果，code 形如 {"@stream": {"id": ..., "status": False, "error": ...}}；
+                否则返回 None，传输完成后再返回结果。
+        """
+        stream_id = message_data["code"]["@stream"].get("id")
+        try:
+            if not (await self.registry.verified(message_data["network"]["send"]) and
+                    await self.registry.verified(message_data["network"]["recv"])):
+                return {**message_data, "code": {"@stream": {"id": stream_id, "status": False}}}
+            await self.spools.open(ws.remote_address, message_data)
+        except Exception as e:
+            return {**message_data, "code": {"@stream": {"id": stream_id, "status": False, "error": str(e)}}}
+        return None
+
+    async def chunk(self, ws, frame):
+        """
+        将一个数据帧写入暂存区。传输完成后将引用暂存内容的消息推送给接收方，接收方不在线时写入 server_data，
+        并向发送方返回传输结果，code 形如 {"@stream": {"id": ..., "status": True, "size": 字节数, "sha256": 摘要}}。
+        未开始或不属于该连接的传输的数据帧被忽略。
+
+        Args:
+            ws: 发送方的 WebSocket 连接。
+            frame: 数据帧。
+        """
+        upload = self.spools.uploads.get(chunk_header.unpack_from(frame)[1])
+        if upload is None or upload["owner"] != tuple(ws.remote_address):
+            return
+        stream_data = upload["document"]
+        stream = {"id": upload["id"].hex()}
+        try:
+            spill = await self.spools.write(upload, frame)
         except Exception as e:
-            # 捕获消息接收和处理过程中的异常
-            if "code" not in message_data:
-                message_data["code"] = {}
-            message_data["code"]["error"] = str(e)
-            await ws.send(dumps(message_data, indent=4, ensure_ascii=False))
+            await self.spools.abort(upload)
+            await ws.send(pack({**stream_data, "code": {"@stream": {**stream, "status": False, "error": str(e)}}}, ws.subprotocol))
+            return
+        if spill is None:
+            return
+        stream.update({"size": upload["size"], "sha256": upload["digest"].hexdigest()})
+        # 送达接收方的消息只携带传输的描述，内容在推送时从暂存区读出
+        stream_document = {
+            "utc": stream_data.get("utc", int(time())),
+            "network": stream_data["network"],
+            "code": {"@stream": {**stream_data["code"]["@stream"], **stream}},
+            "@spill": spill
+        }
+        if not self.routes.push(stream_data["network"]["recv"], stream_document.copy()):
+            await telemetry.timed(
+                server_data.insert_one({**stream_document, "date": dt.now(timezone.utc)}),
+                "fuselink_mongo_seconds", collection="server_data", operation="insert"
+            )
+        await ws.send(pack({**stream_data, "code": {"@stream": {**stream, "status": True}}}, ws.subprotocol))
+
+    async def pending(self, ws):
+        """
+        将 server_data 中积压的、发往该客户端的消息放入其发送队列。
+
+        客户端上线前由其他进程或离线时写入的消息会保留 _id，
+        在 send 方法成功推送后再从 server_data 中删除。
+        一次至多取回发送队列高水位条数的消息，其余在队列降到低水位后分批取回。
 
-    async def send(self, ws):
+        Args:
+            ws: WebSocket 连接对象。
+        """
+        queue = self.routes.get(ws.remote_address)
+        if queue is not None:
+            await queue.reload()
+
+    async def send(self, ws, queue=None):
         """
         向客户端发送消息。
 
-        查找符合条件的文档并发送给客户端，发送后删除已发送的文档。
+        等待该客户端发送队列中的下一条消息并按 deliver 推送。
+        disconnect 策略下发送队列超过高水位时，以 1013（稍后重试）关闭连接。
 
         Args:
             ws: WebSocket 连接对象.
+            queue: 该连接的发送队列。默认为 None（按连接地址查找）。
+
+        Raises:
+            OverflowError: 如果 disconnect 策略下发送队列超过高水位。
 
         Note:
             该方法设计为在 ws 方法中反复调用，以持续向客户端发送消息。
         """
-        # 查找符合条件的文档
-        document = await server_data.find_one({"network.recv": list(ws.remote_address)}, {"_id": 0})
-        if document:
-            # 向客户端发送文档内容
-            await ws.send(dumps(document, indent=4, ensure_ascii=False))
-            # 删除已发送的文档
-            await server_data.delete_one(document)
+        # 等待发往该客户端的下一条消息
+        queue = self.routes.get(ws.remote_address) if queue is None else queue
+        try:
+            document = await queue.get()
+        except OverflowError as e:
+            await ws.close(code=1013, reason="Outbound queue overflow")
+            raise e
+        with tracing.span("servers.send"):
+            await self.deliver(ws, document, queue)
+
+    async def deliver(self, ws, document, queue=None):
+        """
+        推送一条消息，来自 server_data 的消息在推送后删除。
+
+        分块传输的消息推送后紧接着推送暂存的内容，每推送一块按发送队列的权重插入其他通道的消息，
+        全部推送后删除暂存内容；推送中断时，尚未持久化的消息写入 server_data，待接收方重连后重新推送。
+
+        Args:
+            ws: WebSocket 连接对象。
+            document: 发送队列取出的消息。
+            queue: 该连接的发送队列，为 None 时不在分块之间插入其他消息。默认为 None。
+        """
+        async def between():
+            while (interleaved := queue.interleave(document_lane)) is not None:
+                await self.deliver(ws, interleaved)
+
+        document_id = document.pop("_id", None)
+        document.pop("date", None)
+        queued = document.pop("@queued", None)
+        spill = document.pop("@spill", None)
+        document_lane = lane(document)
+        document.pop("@lane", None)
+        # 向客户端发送文档内容，并统计从入队到发出的耗时
+        try:
+            await ws.send(pack(document, ws.subprotocol))
+            if spill is not None:
+                await self.spools.send(ws, document["code"]["@stream"], spill, None if queue is None else between)
+        except Exception as e:
+            # 推送中断时，只在内存中的消息写回 server_data，控制消息只对当前连接有效，不再保留
+            if document_id is None and document_lane != "control":
+                await server_data.insert_one({
+                    **document, **({"@spill": spill} if spill is not None else dict()), "date": dt.now(timezone.utc)
+                })
+            raise e
+        if queued is not None:
+            telemetry.observe("fuselink_delivery_seconds", max(time() - queued, 0.0))
+        # 删除已发送的持久化文档
+        if document_id is not None:
+            await telemetry.timed(
+                server_data.locate(document["network"]["recv"]).delete_one({"_id": document_id}),
+                "fuselink_mongo_seconds", collection="server_data", operation="delete"
+            )
+        if spill is not None:
+            await self.spools.remove(spill)
 
     async def ws(self, ws):
         """
@@ -589,40 +4086,69 @@ class servers:
         """
         # 处理客户端连接
         ws_data = await self.connect(ws)
-        # 处理客户端验证
-        ws_data = await self.verif(ws)
+        ws_dt = [
+            "[",
+            str(dt.now())[:-7],
+            F"""] -> ip:{ws_data["network"]["send"][0]}""",
+            F"""port:{str(ws_data["network"]["send"][1])} Connected"""
+        ]
+        # 先登记发送队列，使其他进程在收到该客户端的上线通知之前已获知其所在进程
+        ws_queue = self.routes.open(ws.remote_address)
         try:
+            # 启用自适应压缩的连接先收到当前的压缩字典，之后的帧才可能使用该字典压缩
+            if compressed(ws.subprotocol) and adaptive.offer():
+                await ws.send(adaptive.offer())
+            # 处理客户端验证
+            with telemetry.time("fuselink_handshake_seconds", stage="verif"):
+                ws_data = await self.verif(ws)
             # 打印连接信息
-            ws_dt = [
-                "[",
-                str(dt.now())[:-7],
-                F"""] -> ip:{ws_data["network"]["send"][0]}""",
-                F"""port:{str(ws_data["network"]["send"][1])} Connected"""
-            ]
             print(" ".join(ws_dt))
             print("-" * 100)
-            # 循环处理消息收发
-            while True:
-                await asyncio.gather(self.recv(ws), self.send(ws))
+            # 取回离线期间积压的消息，再并发处理消息收发
+            await self.pending(ws)
+            await loop(ws, self.recv, lambda ws: self.send(ws, ws_queue))
         except Exception as e:
             # 捕获 WebSocket 连接过程中的异常
             ws_data["code"] = [ws_data["code"], f"WebSocket error:{str(e)}"]
             # 更新或插入日志信息
-            server_log.update_one(
-                {"network.send": ws_data["network"]["send"]},
-                {"$set": ws_data},
-                upsert=True
-            )
+            self.logs.update(server_log, {"network.send": ws_data["network"]["send"]}, ws_data.copy())
         finally:
-            # 删除与客户端相关的数据
-            await server_data.delete_many({"network.send": list(ws.remote_address)})
-            await server_verif.delete_many({"network.send": list(ws.remote_address)})
+            # 注销发送队列；会话未被其他连接恢复时登记下线，并登记延迟清理，
+            # 保留时间取清理宽限期和令牌有效期中较长的一个，使会话在此期间可以恢复
+            await self.routes.close(ws.remote_address, ws_queue)
+            await self.spools.release(ws.remote_address)
+            ws_session = tuple(ws_data["network"]["send"])
+            if self.sessions.get(ws_session) is ws:
+                self.sessions.pop(ws_session)
+                ws_delta = self.presence.leave(ws_session)
+                if ws_delta:
+                    self.notify(ws_delta)
+                self.cleanup.defer(ws_session, max(self.cleanup.grace, self.tokens.ttl or 0))
+            elif ws_session not in self.sessions:
+                self.cleanup.defer(ws_session)
             # 打印连接关闭信息
             ws_dt[1] = F"{ws_dt[1]} ~ {str(dt.now())[:-7]}"
             ws_dt.append("closed.")
             print(" ".join(ws_dt))
             print("-" * 100)
 
+    async def dictionary(self, server):
+        """
+        定期用采样的帧训练压缩字典，发送给所有启用自适应压缩的连接后再用于压缩。
+
+        Args:
+            server: serve 返回的 Server 对象，用于遍历当前的连接。
+        """
+        while True:
+            await asyncio.sleep(adaptive.interval)
+            dictionary_id = await adaptive.train()
+            if not dictionary_id:
+                continue
+            await asyncio.gather(*[
+                f1.send(adaptive.offer()) for f1 in list(server.connections) if compressed(f1.subprotocol)
+            ], return_exceptions=True)
+            adaptive.current = dictionary_id
+
     async def server(
         self,
         host: str | None = None,
@@ -641,6 +4167,15 @@ class servers:
         write_limit: int | tuple[int, int | None] = 2 ** 15,
         logger: object | None = None,
         create_connection: type[object] | None = None,
+        outbound: dict | None = None,
+        handshake: str = "optional",
+        resume: dict | None = None,
+        compress: dict | None = None,
+        storage: dict | None = None,
+        metrics: dict | None = None,
+        trace: dict | None = None,
+        cleanup: dict | None = None,
+        stream: dict | None = None,
         **kwargs: dict[str, object]
     ):
         """
@@ -653,7 +4188,7 @@ class servers:
             port: 服务器端口号。默认为 None（操作系统选择可用端口）。
             origins: 允许的源列表。默认为 None（允许所有源）。
             extensions: 支持的 WebSocket 扩展。默认为 None。
-            subprotocols: 支持的子协议。默认为 None。
+            subprotocols: 支持的子协议，如 ["fuselink.msgpack", "fuselink.json"]，按优先顺序协商帧编码。默认为 None（使用 JSON）。
             compression: 压缩方法。默认为 "deflate"。
             open_timeout: 连接超时时间（秒）。默认为 10.0。
             ping_interval: 发送 ping 间隔时间（秒）。默认为 20.0。
@@ -664,6 +4199,38 @@ class servers:
             write_limit: 发送缓冲区限制。默认为 2**15。
             logger: 日志记录器。默认为 None。
             create_connection: 自定义连接创建类。默认为 None。
+            outbound: 每个连接发送队列的参数，如 {"high": 1024, "low": 256, "policy": "spill", "timeout": 5.0,
+                "weights": {"control": 8, "data": 4, "bulk": 1}}，policy 可选 "spill"、"block"、"drop_old"、"disconnect"，
+                weights 为各优先级通道的调度权重（见 lane）。默认为 None（使用 outbox 的默认值）。
+            handshake: 握手阶段 TOTP 验证模式。"optional" 时携带验证信息的客户端在 HTTP 升级阶段完成验证，
+                其余客户端在连接建立后验证；"required" 时拒绝未携带验证信息的升级请求；"off" 时不在握手阶段验证。
+                默认为 "optional"。
+            resume: 会话恢复令牌的参数，如 {"secret": "...", "ttl": 120}。ttl 为令牌有效期和断开后保留会话的时长（秒），
+                为 0 时不签发令牌并在断开时立即清理会话；secret 为签名密钥，多节点部署时须一致。默认为 None（随机密钥）。
+            compress: 自适应压缩的参数，如 {"threshold": 256, "level": 3, "size": 16384, "samples": 1024, "interval": 300.0}，
+                仅用于协商了 "+zstd" 子协议（如 "fuselink.msgpack+zstd"）的连接。这些连接已在应用层压缩，
+                建议同时将 compression 设为 None。默认为 None（使用 compressor 的默认值）。
+            storage: 存储的参数，如 {"uri": "mongodb://localhost:27017/", "namespace": "default", "expire": 604800, "undelivered": 604800,
+                "heartbeat": 30.0, "sweep": 3600.0, "grace": 604800}。uri 为存储地址，可以是 MongoDB 地址、
+                "memory://"（进程内存储，不持久化，不能与 --workers 或集群同用）或 "sqlite:///文件路径"（WAL 模式），
+                为 None 时沿用当前地址；namespace 为集合命名空间；expire 和 undelivered
+                为日志和未送达消息的保留时间（秒）；heartbeat 为实例心跳间隔（秒）；sweep 为清理孤立集合的间隔（秒），
+                为 0 时不清理；grace 为命名空间没有存活实例多久之后其集合视为孤立（秒）；shards 为 server_data 的分区，
+                如 {"count": 4, "uris": ["mongodb://localhost:27017/", "mongodb://localhost:27018/"]}，见 partition，
+                同一命名空间的所有服务端进程须使用相同的分区。默认为 None（使用上述默认值）。
+            metrics: 导出 Prometheus 格式性能指标的 HTTP 端点，如 {"host": "127.0.0.1", "port": 9464, "path": "/metrics", "interval": 15.0}。
+                端点与 WebSocket 端口分开监听，默认只监听本机回环地址，指标中包含各客户端的网络地址，不应对外开放；
+                多进程模式下第 i 个进程监听 port + i。interval 为 server_data 积压统计（需在各分区上聚合）的缓存时间（秒），
+                在此期间的抓取共用同一次统计。默认为 None（不导出）。
+            trace: 追踪和性能分析的参数，如 {"rate": 1.0, "control": False, "signal": "SIGUSR1", "seconds": 10.0, "engine": "cprofile"}。
+                rate 为已注册钩子（tracing.hook）的采样比例；control 为是否允许客户端以 @profile 控制消息触发性能分析；
+                signal 为触发性能分析的信号，为 None 时不监听；seconds 和 engine 为默认的采集时长和分析器。默认为 None（使用上述默认值）。
+            cleanup: 断开会话延迟清理的参数，如 {"grace": 30.0, "interval": 1.0, "size": 1000}。grace 为断开后保留会话数据的
+                最短时间（秒），签发会话恢复令牌时至少保留到令牌过期；interval 为检查间隔（秒）；size 为单次删除的最大会话数。
+                默认为 None（使用上述默认值）。
+            stream: 分块传输的参数，如 {"chunk": 262144, "limit": None, "store": "auto", "directory": "streams", "timeout": 300.0}，
+                见 spools。chunk 与数据帧头之和不能超过接收方的 max_size；多进程模式下磁盘暂存的目录须为各进程共享，
+                集群模式须使用 GridFS。默认为 None（使用上述默认值，未送达内容的保留时间同 storage 的 undelivered）。
             **kwargs: 额外的关键字参数，传递给 WebSocket 服务器。
 
         Example:
@@ -674,6 +4241,40 @@ class servers:
             该方法会持续运行直到服务器被显式关闭。
             所有连接参数均可通过方法参数进行配置，以适应不同部署环境。
         """
+        # 设置发送队列的水位和策略，以及握手阶段验证模式
+        self.routes.options.update(outbound or dict())
+        self.handshake = handshake
+        self.tokens = tokens(**(resume or dict()))
+        self.cleanup = sweeper(self.expire, **(cleanup or dict()))
+        self.metrics = metrics
+        # 设置追踪采样比例，并在收到信号时开始性能分析
+        self.trace = {**self.trace, **(trace or dict())}
+        tracing.rate = self.trace["rate"]
+        if self.trace["signal"] and hasattr(Signals, self.trace["signal"]):
+            try:
+                asyncio.get_running_loop().add_signal_handler(
+                    getattr(Signals, self.trace["signal"]),
+                    lambda: profiling.start(self.trace["seconds"], self.trace["engine"])
+                )
+            except (NotImplementedError, RuntimeError):
+                pass
+        # 配置自适应压缩，提供 "+zstd" 子协议时采样帧以训练压缩字典
+        adaptive.configure(**(compress or dict()))
+        adaptive.training = any(compressed(f1) for f1 in negotiate(subprotocols) or list())
+        # 绑定命名空间，创建服务端集合索引，并恢复服务端重启前已验证的会话
+        storage = {**storage_defaults, **(storage or dict())}
+        if storage["uri"] and storage["uri"] != storage_uri:
+            reconnect(storage["uri"], storage["namespace"])
+        elif storage["namespace"] and storage["namespace"] != mongo_namespace:
+            bind(storage["namespace"])
+        if storage["shards"]:
+            partition(**storage["shards"])
+        self.spools = spools(**{"retain": storage["undelivered"], **(stream or dict())})
+        await indexes(storage["expire"], storage["undelivered"]).create("server")
+        await self.registry.load()
+        # 多进程模式下先与其他进程建立路由通道
+        if self.routes.relay:
+            await self.routes.relay.start(self.routes, self.relayed, self.greeting)
         # 使用 async with 结构来管理服务器的生命周期
         async with serve(
             handler=self.ws,
@@ -681,7 +4282,7 @@ class servers:
             port=port,
             origins=origins,
             extensions=extensions,
-            subprotocols=subprotocols,
+            subprotocols=negotiate(subprotocols),
             compression=compression,
             open_timeout=open_timeout,
             ping_interval=ping_interval,
@@ -692,6 +4293,8 @@ class servers:
             write_limit=write_limit,
             logger=logger,
             create_connection=create_connection,
+            process_request=self.upgrade,
+            process_response=self.upgraded,
             **kwargs
         ) as server:
             # 获取服务器的套接字信息
@@ -710,8 +4313,37 @@ class servers:
                     )
                 )
             print("-" * 100)
-            # 保持服务器运行
-            await asyncio.Future()
+            # 登记导出时取值的性能指标
+            telemetry.gauge("fuselink_connections", lambda: len(server.connections))
+            telemetry.gauge("fuselink_sessions", lambda: len(self.sessions))
+            telemetry.gauge("fuselink_queue_depth", lambda: {
+                (("peer", ":".join(map(str, f1.address))),): len(f1) for f1 in set(self.routes.table.values())
+            })
+            telemetry.gauge("fuselink_pending_messages", self.backlog, (self.metrics or dict()).get("interval", 15.0))
+            telemetry.gauge("fuselink_pending_cleanups", lambda: len(self.cleanup.pending))
+            # 登记存活实例，启动日志批量写入、会话清理和压缩字典训练，保持服务器运行，退出前写入剩余日志并注销实例
+            self.instances = instances("server", storage["heartbeat"], storage["sweep"], storage["grace"])
+            self.instances.start()
+            self.logs.start()
+            self.cleanup.start()
+            self.spools.start()
+            dictionary_task = asyncio.create_task(self.dictionary(server)) if adaptive.training else None
+            exporter = await telemetry.listen(**{
+                f1: f2 for f1, f2 in self.metrics.items() if f1 in ("host", "port", "path")
+            }) if self.metrics else None
+            try:
+                await asyncio.Future()
+            finally:
+                if exporter:
+                    exporter.close()
+                if dictionary_task:
+                    dictionary_task.cancel()
+                await self.logs.close()
+                await self.cleanup.close()
+                await self.spools.close()
+                await self.instances.close()
+                if self.routes.relay:
+                    await self.routes.relay.close()
 
 
 class clients:
@@ -722,11 +4354,21 @@ class clients:
     设计用于需要实时数据交换和设备管理的场景。
 
     Attributes:
-        无显式定义的属性，所有操作通过方法参数和局部变量完成。
+        logs (logs): 日志批量写入器，用于写入 client_log。
+        batches (dict): 已发送、尚未收到处理结果的批量消息，以批次编号为键。
+        version (int): client_device 已同步到的在线设备表版本号。
+        epoch (str | None): 该版本号所属的服务端启动标识。
+        watching (bool): 当前连接是否已订阅在线设备变更。
+        resume (str | None): 服务器签发的会话恢复令牌，重连时出示以恢复原会话。
+        instances (instances | None): 本实例在存活实例登记表中的登记，连接前创建。
+        stream (dict): 分块传输的参数，chunk 为发送时每块的大小（字节），directory 为接收内容的保存目录。
+        downloads (dict): 以传输编号（16 字节）为键的正在接收的传输。
+        uploads (set): 当前连接上正在发送的分块传输任务。
 
     Methods:
         verif(ws, debug): 执行客户端验证，生成 OTP 并与服务器交换验证信息。
-        forward(ws, client_data): 转发服务器数据，并根据需要更新本地数据库。
+        recv(ws): 接收服务器推送的数据，并更新本地数据库。
+        forward(ws, client_data): 转发本地待发送数据到服务器。
         client(uri, ...): 主连接方法，建立 WebSocket 连接并启动数据处理循环。
 
     Example:
@@ -742,6 +4384,18 @@ class clients:
         pymongo.Collection: 用于数据库操作。
     """
 
+    def __init__(self):
+        self.logs = logs()
+        self.batches = dict()
+        self.version = 0
+        self.epoch = None
+        self.watching = False
+        self.resume = None
+        self.instances = None
+        self.stream = {"chunk": 2**18, "directory": "streams"}
+        self.downloads = dict()
+        self.uploads = set()
+
     async def verif(self, ws, typeio=F"client_{str(uuid1())[-12:]}", otp=str(uuid1())[-12:], debug=False):
         """
         执行客户端验证过程，生成 OTP 并与服务器交换验证信息。
@@ -769,94 +4423,376 @@ class clients:
         See Also:
             forward: 在验证成功后，通常会调用 forward 方法处理后续数据。
         """
+        otp = self.credentials(typeio, otp)
+        debug and otp.update({"totp_debug": debug})
+        # 持有会话恢复令牌时一并发送，令牌失效时服务器仍按 TOTP 验证
+        self.resume and otp.update({"resume": self.resume})
+        await ws.send(pack(otp, ws.subprotocol))
+        response = unpack(await ws.recv(), ws.subprotocol)
+        # 跳过验证结果之前的压缩字典帧，字典已在 unpack 中安装
+        while "@zstd" in response and "code" not in response:
+            response = unpack(await ws.recv(), ws.subprotocol)
+        self.resume = response.pop("resume", None)
+        self.logs.insert(client_log, response.copy())
+        return response
+
+    def credentials(self, typeio=F"client_{str(uuid1())[-12:]}", otp=str(uuid1())[-12:]):
+        """
+        生成客户端验证信息。
+
+        Args:
+            typeio (str, optional): 客户端类型标识符。默认为基于 UUID 的字符串。
+            otp (str, optional): 用于生成 OTP 的基础值。默认为基于 UUID 的字符串。
+
+        Returns:
+            Dict[str, str]: 包含 type、secret 和 code 的验证信息。
+        """
         otp = totp(otp)
-        otp = {
+        return {
             "type": typeio,
             "secret": otp["exec"]["secret"],
             "code": otp["res"]["code"],
         }
-        debug and otp.update({"totp_debug": debug})
-        await ws.send(dumps(otp, indent=4, ensure_ascii=False))
-        response = loads(await ws.recv())
-        client_log.insert_one(response.copy())
+
+    def handshaken(self, ws):
+        """
+        根据握手响应生成客户端数据，用于在握手阶段已完成验证的连接。
+
+        Args:
+            ws (websockets.client.WebSocketClientProtocol): 已建立的 WebSocket 连接。
+
+        Returns:
+            Dict[str, Any] | None: 与 verif 返回格式相同的客户端数据；
+                服务器未在握手阶段验证（响应中没有 X-FuseLink-Address）时返回 None。
+        """
+        address = ws.response.headers.get("X-FuseLink-Address")
+        if not address:
+            return None
+        self.resume = ws.response.headers.get("X-FuseLink-Resume")
+        response = {
+            "utc": int(time()),
+            "verif": None,
+            "network": {"send": decode(address), "recv": list(ws.remote_address)},
+            "code": "Verification successful! You can now proceed with your operation."
+        }
+        self.logs.insert(client_log, response.copy())
         return response
 
-    async def forward(self, ws, client_data):
+    async def recv(self, ws):
+        """
+        接收服务器推送的数据，并更新本地数据库。
+
+        服务器的处理结果和其他客户端发来的消息写入 client_read。
+        设备列表按页接收，每页通过一次 bulk_write 写入 client_device，写入后再请求下一页。
+        在线设备快照替换 client_device 的内容，增量变更逐条应用到 client_device。
+        分块传输的内容逐块写入 stream 参数指定目录中的文件，接收完成后写入 client_read，见 download。
+
+        Args:
+            ws (websockets.client.WebSocketClientProtocol): 已建立的 WebSocket 连接。
+
+        Raises:
+            websockets.exceptions.ConnectionClosed: 如果 WebSocket 连接在数据传输过程中关闭。
+            json.JSONDecodeError: 如果服务器数据无法解析为 JSON。
+
+        Note:
+            该方法是连接上唯一的读取者，设计为在客户端主循环中与 forward 并发地反复调用，
+            因此空闲的客户端也能立即收到服务器推送的消息。
+        """
+        client_swap = await ws.recv()
+        if (chunked(client_swap)):
+            await self.download(client_swap)
+            return
+        client_swap = unpack(client_swap, ws.subprotocol)
+        if (not isinstance(client_swap, dict)):
+            return
+        if ("@zstd" in client_swap and "code" not in client_swap):
+            # 压缩字典帧已在 unpack 中安装，无需写入数据库
+            return
+        if (isinstance(client_swap.get("code"), dict) and "@batch" in client_swap["code"]):
+            # 将批量处理结果展开为与单条消息相同格式的处理结果
+            batch_items = self.batches.pop(client_swap["code"].get("id"), list())
+            batch_operations = list()
+            for f1, f2 in zip(batch_items, client_swap["code"]["@batch"]):
+                f2.pop("mongo", None)
+                f1 = {
+                    "utc": client_swap["utc"],
+                    "network": {"send": client_swap["network"]["send"], "recv": f1["recv"]},
+                    "code": {**f2, "send": client_swap["network"]["send"], "recv": f1["recv"], "data": f1["code"]}
+                }
+                batch_operations.append(
+                    UpdateOne(
+                        {"$and": [{"network": f1["network"]}, {"code": f1["code"]}]},
+                        {"$set": {**f1, "date": dt.now(timezone.utc)}},
+                        upsert=True
+                    )
+                )
+            if (batch_operations):
+                await client_read.bulk_write(batch_operations, ordered=False)
+        elif (isinstance(client_swap.get("code"), dict) and "@decive" in client_swap["code"]):
+            # 写入一页设备列表，写入完成后再请求下一页
+            if (client_swap["code"]["@decive"]):
+                await client_device.bulk_write(
+                    [
+                        UpdateOne({"network.send": f1["network"]["send"]}, {"$set": f1}, upsert=True)
+                        for f1 in client_swap["code"]["@decive"]
+                    ],
+                    ordered=False
+                )
+            if (client_swap["code"].get("next")):
+                client_swap["code"] = {**client_swap["code"]["query"], "after": client_swap["code"]["next"]}
+                await ws.send(pack(client_swap, ws.subprotocol))
+        elif (isinstance(client_swap.get("code"), dict) and "@presence" in client_swap["code"]):
+            # 快照替换整个设备表，增量只应用比本地版本更新的变更
+            presence_data = client_swap["code"]["@presence"]
+            if ("snapshot" in presence_data):
+                await client_device.delete_many(dict())
+                presence_operations = [
+                    UpdateOne({"network.send": f1["network"]["send"]}, {"$set": f1}, upsert=True)
+                    for f1 in presence_data["snapshot"]
+                ]
+            else:
+                presence_operations = [
+                    UpdateOne({"network.send": f1["join"]["network"]["send"]}, {"$set": f1["join"]}, upsert=True)
+                    if ("join" in f1) else DeleteOne({"network.send": f1["leave"]})
+                    for f1 in presence_data["delta"] if (f1["version"] > self.version)
+                ]
+            if (presence_operations):
+                await client_device.bulk_write(presence_operations, ordered=True)
+            self.version = presence_data["version"]
+            self.epoch = presence_data["epoch"]
+        elif (isinstance(client_swap.get("code"), dict) and "@stream" in client_swap["code"] and
+              "sha256" in client_swap["code"]["@stream"] and "status" not in client_swap["code"]["@stream"]):
+            # 其他客户端发来的分块传输，之后的数据帧写入文件
+            self.accept(client_swap)
+        elif (isinstance(client_swap.get("code"), dict)):
+            client_swap["code"].pop("mongo", None)
+            client_swap.pop("verif", None)
+            await client_read.update_one(
+                {
+                    "$and": [
+                        {"network": client_swap["network"]},
+                        {"code": client_swap["code"]}
+                    ]
+                },
+                {"$set": {**client_swap, "date": dt.now(timezone.utc)}},
+                upsert=True
+            )
+
+    def accept(self, client_swap):
+        """
+        开始接收其他客户端发来的分块传输，内容写入保存目录中以传输编号命名的 .part 文件。
+
+        Args:
+            client_swap: 服务器推送的传输描述，code 形如 {"@stream": {"id": ..., "name": ..., "size": ..., "sha256": ..., "meta": ...}}。
+        """
+        stream = client_swap["code"]["@stream"]
+        stream_id = bytes.fromhex(stream["id"])
+        # 重新推送的传输从头接收
+        if (stream_id in self.downloads):
+            self.downloads.pop(stream_id)["file"].close()
+        directory = join(script_dir, self.stream["directory"])
+        makedirs(directory, exist_ok=True)
+        path = join(directory, F"{stream_id.hex()}.part")
+        client_swap.pop("verif", None)
+        self.downloads[stream_id] = {
+            "document": client_swap,
+            "path": path,
+            "file": open(path, "wb"),
+            "seq": 0,
+            "size": 0,
+            "digest": hashlib.sha256()
+        }
+
+    async def download(self, frame):
+        """
+        写入一个数据帧，最后一块写入后校验大小和 SHA-256 摘要。
+
+        校验通过时文件去掉 .part 后缀，client_read 中写入 code 形如
+        {"@stream": {"id": ..., "name": ..., "size": ..., "sha256": ..., "meta": ..., "status": True, "path": 文件路径}} 的消息；
+        校验失败或块序号不连续时删除文件，status 为 False。
+
+        Args:
+            frame: 数据帧。
+        """
+        magic, stream_id, seq, flags = chunk_header.unpack_from(frame)
+        download = self.downloads.get(stream_id)
+        if (download is None):
+            return
+        data = memoryview(frame)[chunk_header.size:]
+        stream_status = seq == download["seq"]
+        if (stream_status):
+            download["file"].write(data)
+            download["digest"].update(data)
+            download["seq"] += 1
+            download["size"] += len(data)
+            if (not flags & 1):
+                return
+        self.downloads.pop(stream_id)
+        download["file"].close()
+        stream = download["document"]["code"]["@stream"]
+        stream_status = stream_status and download["size"] == stream["size"] and download["digest"].hexdigest() == stream["sha256"]
+        path = download["path"].removesuffix(".part")
+        if (stream_status):
+            replace(download["path"], path)
+        else:
+            remove(download["path"])
+        download["document"]["code"]["@stream"] = {**stream, "status": stream_status, "path": path if stream_status else None}
+        await client_read.update_one(
+            {
+                "$and": [
+                    {"network": download["document"]["network"]},
+                    {"code": download["document"]["code"]}
+                ]
+            },
+            {"$set": {**download["document"], "date": dt.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def upload(self, ws, client_data, client_swap):
+        """
+        按块发送 client_write 中 @stream 请求指定的文件。
+
+        请求形如 {"network": {"recv": 接收方地址}, "@stream": {"path": 文件路径, "name": 名称, "meta": 附加信息}}，
+        name 默认为文件名，meta 可省略。先发送开始传输的消息，再以数据帧逐块发送文件内容，
+        文件在线程中按块读入同一个缓冲区，内存占用只与块大小有关，读取时不阻塞事件循环，
+        forward 发送的控制请求和数据消息可以插在块之间。服务器的传输结果由 recv 方法写入 client_read。
+
+        Args:
+            ws (websockets.client.WebSocketClientProtocol): 已建立的 WebSocket 连接。
+            client_data (Dict[str, Any]): 客户端基础数据，通常由 verif 方法生成。
+            client_swap (Dict[str, Any]): client_write 中的 @stream 请求。
+        """
+        stream_query = client_swap["@stream"]
+        stream_id = uuid1().bytes
+        try:
+            stream_size = await asyncio.to_thread(getsize, stream_query["path"])
+            await ws.send(pack({
+                **client_data,
+                "network": {
+                    "send": client_data["network"]["send"],
+                    "recv": client_swap["network"]["recv"] if ("network" in client_swap) else client_data["network"]["send"]
+                },
+                "code": {"@stream": {
+                    "id": stream_id.hex(),
+                    "name": stream_query.get("name") or basename(stream_query["path"]),
+                    "size": stream_size,
+                    "meta": stream_query.get("meta")
+                }}
+            }, ws.subprotocol))
+            buffer = bytearray(chunk_header.size + self.stream["chunk"])
+            view = memoryview(buffer)
+            f = await asyncio.to_thread(open, stream_query["path"], "rb")
+            try:
+                seq = 0
+                sent = 0
+                while True:
+                    count = await asyncio.to_thread(f.readinto, view[chunk_header.size:])
+                    sent += count
+                    last = not count or sent >= stream_size
+                    chunk_header.pack_into(buffer, 0, chunk_magic, stream_id, seq, int(last))
+                    await ws.send(view[:chunk_header.size + count])
+                    seq += 1
+                    if (last):
+                        break
+            finally:
+                await asyncio.to_thread(f.close)
+        except Exception as e:
+            # 文件无法读取或连接中断时，传输失败的结果同样写入 client_read
+            print(F"[{str(dt.now())[:-7]}] Stream upload error: {str(e)}")
+            client_swap["code"] = {"@stream": {"id": stream_id.hex(), "status": False, "error": str(e)}}
+            await client_read.insert_one({**client_swap, "date": dt.now(timezone.utc)})
+
+    async def forward(self, ws, client_data, interval=0.01, batch=64):
         """
-        转发服务器数据，并根据需要更新本地数据库。
+        转发本地待发送数据到服务器。
 
-        从 client_write 数据库集合中获取待处理数据，将其整合到客户端数据中，
-        发送到服务器，并根据服务器响应更新 client_read 和 client_device 数据库集合。
+        从 client_write 数据库集合中一次获取至多 batch 条待处理数据，将其整合到客户端数据中并发送到服务器。
+        每条数据以 find_one_and_delete 按 _id 认领，只发送本次删除成功的数据，
+        因此共用同一 client_write 集合的多个客户端不会重复发送同一条数据。
+        取到多条消息时合并为一个批量消息帧发送，服务器以一个批量处理结果帧应答。
+        服务器的响应由 recv 方法统一接收并写入 client_read 和 client_device 数据库集合。
+        client_write 中的 @device 请求在每个连接上首次出现时订阅在线设备变更，带筛选条件时按页拉取设备列表。
+        client_write 中的 @stream 请求在后台按块发送指定的文件，见 upload。
+        控制请求最先发送，数据消息按优先级通道（见 lane，client_write 中的 priority 字段可以指定）从高到低分组发送。
 
         Args:
             ws (websockets.client.WebSocketClientProtocol): 已建立的 WebSocket 连接。
             client_data (Dict[str, Any]): 客户端基础数据，通常由 verif 方法生成。
+            interval (float, optional): client_write 为空时的等待时间（秒）。默认为 0.01。
+            batch (int, optional): 单个批量消息帧包含的最大消息数。默认为 64，为 1 时逐条发送。
 
         Returns:
             None
 
         Raises:
             websockets.exceptions.ConnectionClosed: 如果 WebSocket 连接在数据传输过程中关闭。
-            json.JSONDecodeError: 如果服务器响应无法解析为 JSON。
             pymongo.errors.PyMongoError: 如果数据库操作失败。
 
         Note:
-            该方法设计为在客户端主循环中反复调用，以持续处理服务器数据。
+            该方法设计为在客户端主循环中反复调用，以持续处理本地数据。
 
         See Also:
             verif: 通常在调用 forward 之前先执行 verif 方法完成初始验证。
+            recv: 接收 forward 发出请求的响应。
         """
-        client_swap = await client_write.find_one_and_delete(dict(), {"_id": 0})
-        if (client_swap):
-            if ("code" in client_swap):
-                client_data["code"] = client_swap["code"]
-                if ("network" in client_swap):
-                    client_data["network"]["recv"] = client_swap["network"]["recv"]
-                else:
+        client_swap = await client_write.find(dict(), {"_id": 1}).limit(batch).to_list(length=batch)
+        if (not client_swap):
+            await asyncio.sleep(interval)
+            return
+        with tracing.span("clients.forward"):
+            # 逐条认领，其他客户端已取走的数据返回 None
+            client_swap = await asyncio.gather(*(
+                client_write.find_one_and_delete({"_id": f1["_id"]}, {"_id": 0}) for f1 in client_swap
+            ))
+            client_swap = [f1 for f1 in client_swap if (f1 is not None)]
+            if (not client_swap):
+                return
+            client_data.pop("priority", None)
+            # 控制请求先于数据消息发送
+            for f1 in client_swap:
+                if ("@device" not in f1):
+                    continue
+                if (isinstance(f1["@device"], dict)):
+                    # 带筛选条件的设备查询仍按页拉取
+                    client_data["code"] = {"@decive": f1["@device"]}
                     client_data["network"]["recv"] = client_data["network"]["send"]
-                client_swap = dumps(
-                    client_data,
-                    indent=4,
-                    ensure_ascii=False
-                )
-                await ws.send(client_swap)
-                for f1 in range(2):
-                    client_swap = loads(await ws.recv())
-                    if ("mongo" in client_swap["code"]):
-                        del client_swap["code"]["mongo"]
-                    del client_swap["verif"]
-                    await client_read.update_one(
-                        {
-                            "$and": [
-                                {"network": client_swap["network"]},
-                                {"code": client_swap["code"]}
-                            ]
-                        },
-                        {"$set": client_swap.copy()},
-                        upsert=True
-                    )
-            if ("@device" in client_swap):
-                client_data["code"] = {"@decive": {}}
-                client_swap = dumps(
-                    client_data,
-                    indent=4,
-                    ensure_ascii=False
-                )
-                await ws.send(client_swap)
-                client_swap = loads(await ws.recv())
-                for f1 in range(client_swap):
-                    f1 = loads(await ws.recv())
-                    await client_device.update_one(
-                        {"network.send": f1["network"]["send"]},
-                        {"$set": f1.copy()},
-                        upsert=True
-                    )
-                client_swap = [
-                    F"[{str(dt.now())[:-7]}] -> ",
-                    F"{client_swap} 个设备在线。"
-                ]
-                client_swap = "".join(client_swap)
-                client_swap = dict()
+                    await ws.send(pack(client_data, ws.subprotocol))
+                elif (not self.watching):
+                    # 订阅在线设备变更，之后由服务器主动推送，无需再次请求
+                    client_data["code"] = {"@presence": {"version": self.version, "epoch": self.epoch}}
+                    client_data["network"]["recv"] = client_data["network"]["send"]
+                    self.watching = True
+                    await ws.send(pack(client_data, ws.subprotocol))
+            client_messages = [
+                {
+                    "recv": f1["network"]["recv"] if ("network" in f1) else client_data["network"]["send"],
+                    "code": f1["code"],
+                    **({"priority": f1["priority"]} if ("priority" in f1) else dict())
+                }
+                for f1 in client_swap if ("code" in f1)
+            ]
+            # 按优先级通道从高到低分组发送，每组为一条消息或一个批量消息帧
+            for f1 in lane_weights:
+                lane_messages = [f2 for f2 in client_messages if (lane(f2) == f1)]
+                if (len(lane_messages) == 1):
+                    client_data["code"] = lane_messages[0]["code"]
+                    client_data["network"]["recv"] = lane_messages[0]["recv"]
+                    if ("priority" in lane_messages[0]):
+                        client_data["priority"] = lane_messages[0]["priority"]
+                    await ws.send(pack(client_data, ws.subprotocol))
+                    client_data.pop("priority", None)
+                elif (lane_messages):
+                    # 记录批次内容，收到批量处理结果后据此还原逐条处理结果
+                    client_data["code"] = {"@batch": lane_messages, "id": str(uuid1())}
+                    client_data["network"]["recv"] = client_data["network"]["send"]
+                    self.batches[client_data["code"]["id"]] = lane_messages
+                    await ws.send(pack(client_data, ws.subprotocol))
+            # 分块传输在后台发送，不阻塞之后的控制请求和数据消息
+            for f1 in client_swap:
+                if ("@stream" in f1):
+                    upload_task = asyncio.create_task(self.upload(ws, client_data.copy(), f1))
+                    self.uploads.add(upload_task)
+                    upload_task.add_done_callback(self.uploads.discard)
 
     async def client(
             self,
@@ -877,19 +4813,24 @@ class clients:
             write_limit: int | tuple[int, int | None] = 2**15,
             logger: object | None = None,
             create_connection: type[object] | None = None,
+            batch: int = 64,
+            handshake: bool = False,
+            compress: dict | None = None,
+            storage: dict | None = None,
+            stream: dict | None = None,
             **kwargs: dict[str, object]
     ):
         """
         建立 WebSocket 连接并启动客户端主循环。
 
         初始化 WebSocket 连接，执行客户端验证，并进入数据处理循环，
-        持续调用 forward 方法处理服务器数据。
+        并发地调用 forward 方法发送本地数据、调用 recv 方法接收服务器推送的数据。
 
         Args:
             uri (str): WebSocket 服务器地址。默认为 "ws://127.0.0.1:10000"。
             origin (Optional[str]): 请求的源。默认为 None。
             extensions (Optional[List[str]]): 支持的 WebSocket 扩展。默认为 None。
-            subprotocols (Optional[List[str]]): 支持的子协议。默认为 None。
+            subprotocols (Optional[List[str]]): 支持的子协议，如 ["fuselink.msgpack", "fuselink.json"]，按优先顺序协商帧编码。默认为 None（使用 JSON）。
             compression (Optional[str]): 压缩方法。默认为 "deflate"。
             additional_headers (Optional[Dict[str, str]]): 额外的 HTTP 请求头。默认为 None。
             user_agent_header (Optional[str]): User-Agent 请求头值。默认为 "USER_AGENT"。
@@ -903,6 +4844,16 @@ class clients:
             write_limit (Optional[Tuple[int, int]]): 发送缓冲区限制。默认为 (2**15, None)。
             logger (Optional[object]): 日志记录器。默认为 None。
             create_connection (Optional[type]): 自定义连接创建类。默认为 None。
+            batch (int): 单个批量消息帧包含的最大消息数。默认为 64。
+            handshake (bool): 是否在 HTTP 升级请求中携带 TOTP 验证信息，在握手阶段完成验证。
+                服务器未在握手阶段验证时自动改为发送验证帧。默认为 False。
+            compress (Optional[Dict[str, Any]]): 自适应压缩的参数，如 {"threshold": 256, "level": 3}，
+                仅用于协商了 "+zstd" 子协议的连接，压缩字典由服务器下发。默认为 None（使用 compressor 的默认值）。
+            storage (Optional[Dict[str, Any]]): 存储的参数，如 {"uri": "mongodb://localhost:27017/", "namespace": "default",
+                "expire": 604800, "undelivered": 604800, "heartbeat": 30.0}，含义同 servers.server。同一台机器上的多个客户端须使用不同的命名空间，
+                Sanic 网关使用与客户端相同的存储地址和命名空间，因此与网关配合时不能使用 "memory://"。默认为 None（使用默认值）。
+            stream (Optional[Dict[str, Any]]): 分块传输的参数，如 {"chunk": 262144, "directory": "streams"}。chunk 为发送时每块的大小（字节），
+                与数据帧头之和不能超过服务器的 max_size；directory 为接收内容的保存目录，相对路径相对于脚本所在目录。默认为 None（使用默认值）。
             **kwargs (Dict[str, Any]): 额外的关键字参数，传递给 WebSocket 连接。
 
         Returns:
@@ -919,14 +4870,34 @@ class clients:
 
         See Also:
             verif: 在连接建立后立即调用，执行初始验证。
-            forward: 在主循环中反复调用，处理服务器数据。
+            forward: 在主循环中反复调用，发送本地数据。
+            recv: 在主循环中反复调用，接收服务器数据。
         """
         try:
+            # 绑定命名空间，创建客户端集合索引，登记存活实例，并启动日志批量写入
+            storage = {**storage_defaults, **(storage or dict())}
+            if storage["uri"] and storage["uri"] != storage_uri:
+                reconnect(storage["uri"], storage["namespace"])
+            elif storage["namespace"] and storage["namespace"] != mongo_namespace:
+                bind(storage["namespace"])
+            await indexes(storage["expire"], storage["undelivered"]).create("client")
+            self.instances = instances("client", storage["heartbeat"])
+            self.instances.start()
+            self.logs.start()
+            adaptive.configure(**(compress or dict()))
+            self.stream = {**self.stream, **(stream or dict())}
+            # 握手阶段验证时，验证信息随升级请求的请求头发送
+            if handshake:
+                additional_headers = {
+                    **(additional_headers or dict()),
+                    **{handshake_headers[f1]: f2 for f1, f2 in self.credentials().items()},
+                    **({handshake_headers["resume"]: self.resume} if self.resume else dict())
+                }
             async with connect(
                 uri=uri,
                 origin=origin,
                 extensions=extensions,
-                subprotocols=subprotocols,
+                subprotocols=negotiate(subprotocols),
                 compression=compression,
                 additional_headers=additional_headers,
                 user_agent_header=user_agent_header,
@@ -942,14 +4913,196 @@ class clients:
                 create_connection=create_connection,
                 **kwargs
             ) as ws:
-                client_data = await self.verif(ws)
+                client_data = (handshake and self.handshaken(ws)) or await self.verif(ws)
+                self.watching = False
                 print("-" * 100)
                 print(F"[{str(dt.now())[:-7]}] 已连接，返回数据：{client_data["code"]}")
                 print("-" * 100)
-                while True:
-                    await self.forward(ws, client_data)
+                try:
+                    await loop(ws, self.recv, lambda ws: self.forward(ws, client_data, batch=batch))
+                finally:
+                    for f1 in list(self.uploads):
+                        f1.cancel()
         except Exception as e:
             print(f"发生错误：{e}")
+        finally:
+            await self.logs.close()
+            if self.instances:
+                await self.instances.close()
+
+
+def loop_factory(name="auto"):
+    """
+    按名称选择事件循环的实现，返回值作为 asyncio.run 的 loop_factory 参数。
+
+    Args:
+        name: "auto"（已安装 uvloop 时使用 uvloop，否则使用 asyncio）、"uvloop" 或 "asyncio"。默认为 "auto"。
+
+    Returns:
+        Callable | None: 创建事件循环的函数，为 None 时使用 asyncio 的默认事件循环。
+
+    Raises:
+        ValueError: 如果名称未知，或指定了 "uvloop" 但未安装。
+
+    Example:
+        >>> run(servers().server(), loop_factory=loop_factory("uvloop"))
+    """
+    match name:
+        case "auto":
+            return uvloop and uvloop.new_event_loop
+        case "asyncio" | None:
+            return None
+        case "uvloop":
+            if uvloop is None:
+                raise ValueError("事件循环 uvloop 需要安装 uvloop")
+            return uvloop.new_event_loop
+    raise ValueError(F"未知的事件循环：{name}")
+
+
+def worker(index, paths, server_config):
+    """
+    多进程模式下单个服务端进程的入口点。
+
+    重新创建存储客户端，与其他进程建立路由通道，并以 SO_REUSEPORT 监听同一端口，
+    由操作系统在各进程之间分配新连接。
+
+    Args:
+        index: 本进程在 paths 中的编号。
+        paths: 各进程的路由通道端点（Unix 套接字路径或 "host:port"）。
+        server_config: 服务端配置，其中的 loop 选择事件循环（见 loop_factory），其余传递给 servers.server。
+    """
+    server_config = dict(server_config)
+    factory = loop_factory(server_config.pop("loop", "auto"))
+    # 各进程在各自的端口上导出性能指标
+    if server_config.get("metrics"):
+        server_config["metrics"] = {**server_config["metrics"], "port": server_config["metrics"].get("port", 9464) + index}
+    reconnect((server_config.get("storage") or dict()).get("uri"))
+    # 各进程分别导出自己的性能指标，以 worker 标签区分
+    telemetry.labels["worker"] = str(index)
+    server = servers(shared=True, relay=relay(index, paths, (server_config.get("resume") or dict())["secret"]))
+    run(server.server(**server_config, reuse_port=True), loop_factory=factory)
+
+
+def workers(count, server_config, cluster=None, node=0):
+    """
+    以多进程模式启动服务端，fork 出 count 个共享监听端口的服务端进程。
+
+    各进程共享同一组 MongoDB 集合，会话验证回退查询 server_verif，
+    消息和在线设备变更经 relay 在进程之间转发。主进程等待所有子进程退出，
+    收到 SIGTERM 或中断时结束所有子进程并清理 Unix 套接字。
+
+    集群模式下 cluster 列出集群中所有服务端进程的 "host:port" 端点，本节点的进程依次使用
+    cluster[node] 至 cluster[node + count - 1]，与其他节点的进程经 TCP 持久连接互相转发。
+    例如两个节点各运行 2 个进程时，cluster 列出 4 个端点，两个节点的 node 分别为 0 和 2。
+    进程间连接以会话恢复令牌的密钥（resume.secret）验证对端（见 relay），只有持有该密钥的进程才能转发消息和登记地址归属。
+    单节点未配置该密钥时为本节点的进程随机生成一个共用的密钥，集群模式下各节点须在配置中指定相同的密钥。
+
+    Args:
+        count: 服务端进程数量。
+        server_config: 服务端配置，传递给 servers.server。
+        cluster: 集群中所有服务端进程的端点。默认为 None（单节点，进程间使用 Unix 套接字）。
+        node: 本节点第一个进程在 cluster 中的编号。默认为 0。
+
+    Raises:
+        ValueError: 如果 cluster 中没有足够的端点分配给本节点的进程，集群模式下未配置 resume.secret，
+            存储地址为只能由单个进程使用的 "memory://"，或事件循环（server_config 中的 loop）不可用。
+
+    Note:
+        依赖 fork 和 SO_REUSEPORT，仅支持 Linux 等类 Unix 系统。
+    """
+    if urlparse((server_config.get("storage") or dict()).get("uri") or storage_uri).scheme == "memory":
+        raise ValueError("memory:// 存储只能由单个进程使用，多进程模式请使用 MongoDB 或 SQLite")
+    loop_factory(server_config.get("loop", "auto"))
+    context = get_context("fork")
+    directory = None
+    # 各进程使用相同的令牌密钥，使会话可以在任一进程上恢复
+    resume = dict(server_config.get("resume") or dict())
+    if cluster and not resume.get("secret"):
+        raise ValueError("集群模式须在配置中为各节点指定相同的 resume.secret，用于验证进程间连接")
+    resume["secret"] = resume.get("secret") or urandom(32).hex()
+    server_config = {**server_config, "resume": resume}
+    if cluster:
+        if not 0 <= node <= len(cluster) - count:
+            raise ValueError(F"集群端点不足：node={node}，进程数={count}，端点数={len(cluster)}")
+        paths, indexes = list(cluster), range(node, node + count)
+    else:
+        directory = mkdtemp(prefix="fuselink_")
+        paths, indexes = [join(directory, F"worker_{f1}.sock") for f1 in range(count)], range(count)
+    processes = [
+        context.Process(target=worker, args=(f1, paths, server_config), daemon=True) for f1 in indexes
+    ]
+    try:
+        for f1 in processes:
+            f1.start()
+        signal(SIGTERM, lambda *_: exit(0))
+        for f1 in processes:
+            f1.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for f1 in processes:
+            f1.terminate()
+        for f1 in processes:
+            f1.join()
+        if directory:
+            rmtree(directory, ignore_errors=True)
+
+
+def merge(defaults, loaded):
+    """
+    将配置文件的内容合并到默认配置之上：保留配置文件中的所有值，两边都是字典的项逐项合并，只补充缺少的键。
+
+    Args:
+        defaults: 默认配置。
+        loaded: 配置文件的内容。
+
+    Returns:
+        dict: 合并后的配置。
+
+    Example:
+        >>> merge({"port": 10000, "storage": {"uri": "memory://", "namespace": "default"}}, {"storage": {"namespace": "lab"}})
+        {"port": 10000, "storage": {"uri": "memory://", "namespace": "lab"}}
+    """
+    merged = dict(defaults)
+    for f1, f2 in loaded.items():
+        merged[f1] = merge(defaults[f1], f2) if isinstance(defaults.get(f1), dict) and isinstance(f2, dict) else f2
+    return merged
+
+
+def configure(path, defaults, renamed=None):
+    """
+    读取配置文件，补充新版本增加的配置项后写回；文件不存在时以默认配置生成。
+    文件无法解析时使用默认配置，不覆盖原文件，以免丢失其中的设置。
+
+    Args:
+        path: 配置文件路径。
+        defaults: 默认配置。
+        renamed: 旧版本配置项名称到新名称的映射，如 {"outbox": "outbound"}。默认为 None。
+
+    Returns:
+        dict: 配置，不含不可序列化的值。
+    """
+    loaded = None
+    if exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                loaded = load(f)
+            except Exception:
+                print(F"配置文件格式错误，本次使用默认配置，请检查 {path}")
+                return {k: v for k, v in defaults.items() if not callable(v)}
+        if not isinstance(loaded, dict):
+            print(F"配置文件格式错误，本次使用默认配置，请检查 {path}")
+            return {k: v for k, v in defaults.items() if not callable(v)}
+        for f1, f2 in (renamed or dict()).items():
+            if f1 in loaded and f2 not in loaded:
+                loaded[f2] = loaded.pop(f1)
+    # 移除不可序列化的值
+    config = {k: v for k, v in merge(defaults, loaded or dict()).items() if not callable(v)}
+    if config != loaded:
+        with open(path, "w", encoding="utf-8") as f:
+            dump(config, f, indent=4, ensure_ascii=False)
+        print(F"配置文件已{'更新' if loaded else '生成'}于 {path}")
+    return config
 
 
 def task():
@@ -973,7 +5126,20 @@ def task():
         "max_queue": 16,
         "write_limit": 2 ** 15,
         "logger": None,
-        "create_connection": None
+        "create_connection": None,
+        "outbound": {"high": 1024, "low": 256, "policy": "spill", "timeout": 5.0, "weights": {"control": 8, "data": 4, "bulk": 1}},
+        "handshake": "optional",
+        "resume": {"secret": None, "ttl": 120},
+        "compress": {"threshold": 256, "level": 3, "size": 16384, "samples": 1024, "interval": 300.0},
+        "storage": {
+            "uri": mongo_uri, "namespace": "default", "expire": 604800, "undelivered": 604800,
+            "heartbeat": 30.0, "sweep": 3600.0, "grace": 604800, "shards": {"count": 1, "uris": None}
+        },
+        "metrics": None,
+        "trace": {"rate": 1.0, "control": False, "signal": "SIGUSR1", "seconds": 10.0, "engine": "cprofile"},
+        "cleanup": {"grace": 30.0, "interval": 1.0, "size": 1000},
+        "stream": {"chunk": 262144, "limit": None, "store": "auto", "directory": "streams", "timeout": 300.0},
+        "loop": "auto"
     }
     config_client = {
         "uri": "ws://127.0.0.1:10000",
@@ -993,7 +5159,12 @@ def task():
         "max_queue": 16,
         "write_limit": 2 ** 15,
         "logger": None,
-        "create_connection": None
+        "create_connection": None,
+        "handshake": False,
+        "compress": {"threshold": 256, "level": 3},
+        "storage": {"uri": mongo_uri, "namespace": "default", "expire": 604800, "undelivered": 604800, "heartbeat": 30.0},
+        "stream": {"chunk": 262144, "directory": "streams"},
+        "loop": "auto"
     }
 
     # 配置文件路径（相对于脚本目录）
@@ -1004,6 +5175,10 @@ def task():
     parser = ArgumentParser(add_help=False)
     parser.add_argument("--server", action="store_true", help="启动服务器")
     parser.add_argument("--client", action="store_true", help="启动客户端")
+    parser.add_argument("--workers", type=int, default=1, help="服务端进程数量")
+    parser.add_argument("--port", type=int, default=None, help="服务端端口，覆盖配置文件")
+    parser.add_argument("--cluster", default=None, help="集群中所有服务端进程的端点，以逗号分隔，如 10.0.0.1:11000,10.0.0.2:11000")
+    parser.add_argument("--node", type=int, default=0, help="本节点第一个进程在 --cluster 中的编号")
     args, _ = parser.parse_known_args()
 
     # 检查是否没有参数
@@ -1013,62 +5188,26 @@ def task():
 
     # 根据参数决定启动服务器还是客户端
     if args.server:
-        # 检查服务器配置文件
-        if exists(config_server_path):
-            with open(config_server_path, "r", encoding="utf-8") as f:
-                try:
-                    server_config = load(f)
-                    # 检查配置是否有效
-                    if not all(key in server_config for key in config_server.keys()):
-                        print("配置文件内容不完整，请检查或删除后重新运行程序")
-                        server_config = config_server.copy()
-                except Exception:
-                    print("配置文件格式错误，请检查或删除后重新运行程序")
-                    server_config = config_server.copy()
-        else:
-            server_config = config_server.copy()
-
-        # 移除不可序列化的值
-        server_config = {
-            k: v for k, v in server_config.items() if not callable(v)
-        }
+        # 读取服务器配置文件，保留其中的设置，只补充缺少的配置项
+        server_config = configure(config_server_path, config_server, {"outbox": "outbound"})
 
-        # 写入配置文件
-        with open(config_server_path, "w", encoding="utf-8") as f:
-            dump(server_config, f, indent=4, ensure_ascii=False)
-            print(f"默认配置文件已生成于 {config_server_path}")
-
-        server = servers()
-        run(server.server(**server_config))
-
-    if args.client:
-        # 检查客户端配置文件
-        if exists(config_client_path):
-            with open(config_client_path, "r", encoding="utf-8") as f:
-                try:
-                    client_config = load(f)
-                    # 检查配置是否有效
-                    if not all(key in client_config for key in config_client.keys()):
-                        print("配置文件内容不完整，请检查或删除后重新运行程序")
-                        client_config = config_client.copy()
-                except Exception:
-                    print("配置文件格式错误，请检查或删除后重新运行程序")
-                    client_config = config_client.copy()
+        if args.port:
+            server_config["port"] = args.port
+        if args.workers > 1 or args.cluster:
+            workers(args.workers, server_config, args.cluster and args.cluster.split(","), args.node)
         else:
-            client_config = config_client.copy()
-
-        # 移除不可序列化的值
-        client_config = {
-            k: v for k, v in client_config.items() if not callable(v)
-        }
+            # loop 选择事件循环，不传递给 servers.server
+            factory = loop_factory(server_config.pop("loop", "auto"))
+            server = servers()
+            run(server.server(**server_config), loop_factory=factory)
 
-        # 写入配置文件
-        with open(config_client_path, "w", encoding="utf-8") as f:
-            dump(client_config, f, indent=4, ensure_ascii=False)
-            print(f"默认配置文件已生成于 {config_client_path}")
+    if args.client:
+        # 读取客户端配置文件，保留其中的设置，只补充缺少的配置项
+        client_config = configure(config_client_path, config_client)
 
+        factory = loop_factory(client_config.pop("loop", "auto"))
         client = clients()
-        run(client.client(**client_config))
+        run(client.client(**client_config), loop_factory=factory)
 
 
 def help():
@@ -1078,9 +5217,17 @@ def help():
     print("FuseLink 程序使用说明:")
     print("   --server     启动 FuseLink 服务器")
     print("   --client     启动 FuseLink 客户端")
+    print("   --workers N  以 N 个进程启动服务器，共享监听端口（仅限 Linux）")
+    print("   --port P     覆盖配置文件中的服务器端口")
+    print("   --cluster E  以集群模式启动服务器，E 为所有服务端进程的 host:port 端点，以逗号分隔；")
+    print("                各节点的配置文件须指定相同的 resume.secret")
+    print("   --node I     本节点第一个进程在 --cluster 中的编号")
     print("示例:")
     print("   python fuselink.py --server")
     print("   python fuselink.py --client")
+    print("   python fuselink.py --server --workers 4")
+    print("   python fuselink.py --server --port 10000 --cluster 127.0.0.1:11000,127.0.0.1:11001 --node 0")
+    print("   python fuselink.py --server --port 10001 --cluster 127.0.0.1:11000,127.0.0.1:11001 --node 1")
 
 
 if __name__ == "__main__":
@@ -1,22 +1,41 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime as dt
-from fuselink import totp
-from json import loads, dumps
-from sanic.response import json
+from datetime import datetime as dt, timezone
+from fuselink import totp, encode, decode, names, instances, telemetry, backend, reconnect, mongo_uri, mongo_database, script_dir
+from sanic.response import json, text
 from sanic import Sanic
-from uuid import uuid1
+from os.path import exists, join
+from ipaddress import ip_address
+from json import load
 from time import time
 import asyncio
 
 
 app = Sanic("FuseLink")
 
-# 初始化 MongoDB 客户端和数据库
-mongo_client = AsyncIOMotorClient("mongodb://localhost:27017/")
-admin_log = mongo_client["FuseLink_Cache"][F"admin_log_{str(uuid1())[-12:]}"]
-admin_read = mongo_client["FuseLink_Cache"][F"clients_read_{str(uuid1())[-12:]}"]
-admin_write = mongo_client["FuseLink_Cache"][F"clients_write_{str(uuid1())[-12:]}"]
-admin_device = mongo_client["FuseLink_Cache"][F"clients_device_{str(uuid1())[-12:]}"]
+# 与本机客户端使用同一存储和命名空间（客户端配置文件中的 storage.uri 和 storage.namespace），通过客户端的集合收发消息；
+# 网关与客户端是不同的进程，客户端使用 "memory://" 时无法与网关交换数据
+storage_config = dict()
+if exists(join(script_dir, "client_config.json")):
+    with open(join(script_dir, "client_config.json"), "r", encoding="utf-8") as f:
+        try:
+            storage_config = load(f).get("storage") or dict()
+        except Exception:
+            storage_config = dict()
+namespace = storage_config.get("namespace")
+storage_uri = storage_config.get("uri") or mongo_uri
+collection_names = names(namespace)
+# 存活实例登记表与网关的集合位于同一存储
+if storage_uri != mongo_uri:
+    reconnect(storage_uri)
+
+# 初始化存储客户端和数据库
+mongo_client = backend(storage_uri)
+admin_log = mongo_client[mongo_database][collection_names["gateway_log"]]
+admin_read = mongo_client[mongo_database][collection_names["client_read"]]
+admin_write = mongo_client[mongo_database][collection_names["client_write"]]
+admin_device = mongo_client[mongo_database][collection_names["client_device"]]
+gateway_instance = instances("gateway", namespace=namespace)
+gateway_connections = set()
+telemetry.gauge("fuselink_connections", lambda: len(gateway_connections))
 
 
 async def ws_connect(request):
@@ -29,39 +48,81 @@ async def ws_connect(request):
         },
         "code": None
     }
-    await admin_log.insert_one(connect_data.copy())
+    await admin_log.insert_one({**connect_data, "date": dt.now(timezone.utc)})
     return connect_data
 
 
+async def device_list(timeout=5.0, interval=0.1):
+    """
+    读取 client_device 中的在线设备。
+
+    client_device 是客户端按服务端推送的在线设备变更维护的镜像，读取后不清空；
+    客户端首次订阅时表尚为空，等待其写入快照，至多 timeout 秒。
+
+    Returns:
+        list: 在线设备，超时时为空列表。
+    """
+    deadline = time() + timeout
+    devices = await admin_device.find(dict(), {"_id": 0}).to_list(length=None)
+    while not devices and time() < deadline:
+        await asyncio.sleep(interval)
+        devices = await admin_device.find(dict(), {"_id": 0}).to_list(length=None)
+    return devices
+
+
 async def ws_task(ws, connect_data):
     connect_swap = await ws.recv()
     try:
-        connect_swap = loads(connect_swap)
+        with telemetry.time("fuselink_decode_seconds", codec="fuselink.json"):
+            connect_swap = decode(connect_swap)
         if (type(connect_swap) == dict and "@device" in connect_swap):
-            await admin_write.insert_one(connect_swap.copy())
-            connect_swap = None
-            while not (connect_swap):
-                connect_swap = await admin_device.find(dict(), {"_id": 0}).to_list(length=None)
-                await asyncio.sleep(0.1)
-            await admin_device.delete_many(dict())
+            await telemetry.timed(
+                admin_write.insert_one(connect_swap.copy()),
+                "fuselink_mongo_seconds", collection=admin_write.name, operation="insert"
+            )
+            await ws.send(encode(await device_list()))
+            return
         if ("code" in connect_swap):
-            await admin_write.insert_one(connect_swap.copy())
-            connect_swap = await admin_read.find_one_and_delete(dict(), {"_id": 0})
+            await telemetry.timed(
+                admin_write.insert_one(connect_swap.copy()),
+                "fuselink_mongo_seconds", collection=admin_write.name, operation="insert"
+            )
+            connect_swap = await telemetry.timed(
+                admin_read.find_one_and_delete(dict(), {"_id": 0, "date": 0}),
+                "fuselink_mongo_seconds", collection=admin_read.name, operation="find_one_and_delete"
+            )
             print(connect_swap["code"]["status"])
             if(connect_swap["code"]["status"]):
-                await ws.send(dumps(connect_swap, indent=4, ensure_ascii=False))
-                connect_swap = await admin_read.find_one_and_delete(dict(), {"_id": 0})
+                await ws.send(encode(connect_swap))
+                connect_swap = await admin_read.find_one_and_delete(dict(), {"_id": 0, "date": 0})
             else:
                 connect_swap = None
         if (connect_swap):
-            await ws.send(dumps(connect_swap, indent=4, ensure_ascii=False))
+            await ws.send(encode(connect_swap))
         connect_swap = None
     except Exception as e:
         connect_data["code"] = {
             "message": connect_swap,
             "error": str(e)
         }
-        await ws.send(dumps(connect_data, indent=4, ensure_ascii=False))
+        await ws.send(encode(connect_data))
+
+
+@app.before_server_start
+async def gateway_start(app):
+    """
+    创建网关日志的 TTL 索引，并在存活实例登记表中登记本网关。
+    """
+    await admin_log.create_index([("date", 1)], name="date_ttl", expireAfterSeconds=7 * 24 * 3600)
+    gateway_instance.start()
+
+
+@app.after_server_stop
+async def gateway_stop(app):
+    """
+    注销本网关。
+    """
+    await gateway_instance.close()
 
 
 @app.websocket("/ws")
@@ -70,6 +131,7 @@ async def ws_handler(request, ws):
     WebSocket 连接处理函数
     """
     connect_data = await ws_connect(request)
+    gateway_connections.add(ws)
     # 直接在 handler 中构建并记录连接信息
     try:
         while True:
@@ -77,6 +139,7 @@ async def ws_handler(request, ws):
     except Exception as e:
         print(F"[{str(dt.now())[:-7]}] WebSocket error: {str(e)}")
     finally:
+        gateway_connections.discard(ws)
         print(F"[{str(dt.now())[:-7]}] Connection closed")
 
 
@@ -86,6 +149,20 @@ async def code(request):
     return json(totp(**code_data))
 
 
+@app.get("/metrics")
+async def metrics(request):
+    """
+    以 Prometheus 文本格式导出网关进程的性能指标，指标中包含各连接的信息，只响应本机的请求
+    """
+    try:
+        local = ip_address(request.ip).is_loopback
+    except ValueError:
+        local = False
+    if not local:
+        return text("Not Found\n", status=404)
+    return text(await telemetry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/")
 async def index(request):
     return json(None)
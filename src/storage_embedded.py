@@ -0,0 +1,1181 @@
+#!/usr/bin/env python
+"""
+Embedded Storage Backends
+
+This module implements the subset of the Motor collection interface used by FuseLink on top of an in-process
+dictionary ("memory://") or a WAL-mode SQLite file ("sqlite:///path"), so the server and client code run
+unchanged without MongoDB.
+
+
+
+嵌入式存储后端
+
+本模块在进程内的字典（"memory://"）或 WAL 模式的 SQLite 文件（"sqlite:///文件路径"）之上实现 FuseLink 用到的
+Motor 集合接口子集，包括查询运算符、更新运算符、投影、排序、聚合管道和 TTL 索引，服务端和客户端无需 MongoDB 即可运行。
+查询和更新的语义与 MongoDB 一致，不支持的运算符抛出 OperationFailure。
+"""
+
+
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+from bson import ObjectId, CodecOptions
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timezone
+from urllib.parse import urlparse
+from os.path import abspath, dirname, join
+from functools import partial
+from json import dumps, loads
+from time import time
+import asyncio
+import sqlite3
+import bson
+
+
+# SQLite 文件的相对路径相对于本模块所在目录，与 fuselink.script_dir 相同
+script_dir = dirname(abspath(__file__))
+# SQLite 存储中保存各集合索引定义（包括 TTL 索引的保留时间）的表，所有进程共用
+index_table = "fuselink_indexes"
+
+
+def lookup(document, path):
+    """
+    按点分路径取出文档中的字段。
+
+    Args:
+        document: 文档。
+        path: 点分路径，如 "network.send"，数组元素以下标表示，如 "network.send.0"。
+
+    Returns:
+        tuple: (字段是否存在, 字段值)。
+    """
+    value = document
+    for f1 in path.split("."):
+        if isinstance(value, dict) and f1 in value:
+            value = value[f1]
+        elif isinstance(value, (list, tuple)) and f1.isdigit() and int(f1) < len(value):
+            value = value[int(f1)]
+        else:
+            return False, None
+    return True, value
+
+
+def assign(document, path, value):
+    """
+    按点分路径写入文档中的字段，缺少的上级字段创建为字典。
+
+    Args:
+        document: 文档。
+        path: 点分路径。
+        value: 字段值。
+    """
+    *parents, name = path.split(".")
+    for f1 in parents:
+        document = document.setdefault(f1, dict())
+    document[name] = value
+
+
+def discard(document, path):
+    """
+    按点分路径删除文档中的字段，字段不存在时忽略。
+
+    Args:
+        document: 文档。
+        path: 点分路径。
+    """
+    *parents, name = path.split(".")
+    for f1 in parents:
+        document = document.get(f1) if isinstance(document, dict) else None
+    if isinstance(document, dict):
+        document.pop(name, None)
+
+
+def clone(value):
+    """
+    复制文档，使存储中的文档与调用者持有的文档互不影响。
+
+    只复制字典和列表（元组转换为列表，与经 MongoDB 往返后相同），字符串、数字、ObjectId 等不可变的值直接共用；
+    不带时区的 datetime 按 UTC 处理，与 MongoDB 的存储方式一致。
+
+    Args:
+        value: 文档或字段值。
+
+    Returns:
+        复制后的文档或字段值。
+    """
+    if isinstance(value, dict):
+        return {f1: clone(f2) for f1, f2 in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [clone(f1) for f1 in value]
+    if isinstance(value, dt) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def fingerprint(value):
+    """
+    生成字段值的等值比较键，用于内存和 SQLite 存储的等值索引。
+
+    Args:
+        value: 字段值。
+
+    Returns:
+        str: 紧凑、键有序的 JSON 文本。
+    """
+    return dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+
+
+def equals(value, operand):
+    """
+    按 MongoDB 的语义判断字段值是否等于查询值：字段为数组、查询值不是数组时，数组包含查询值即视为相等。
+
+    Args:
+        value: 字段值。
+        operand: 查询值。
+
+    Returns:
+        bool: 是否相等。
+    """
+    operand = clone(operand)
+    return value == operand or (isinstance(value, list) and not isinstance(operand, list) and operand in value)
+
+
+def condition(found, value, operator, operand):
+    """
+    判断字段是否满足一个查询运算符。
+
+    Args:
+        found: 字段是否存在。
+        value: 字段值。
+        operator: 查询运算符，支持 $eq、$ne、$in、$nin、$gt、$gte、$lt、$lte 和 $exists。
+        operand: 运算符的参数。
+
+    Returns:
+        bool: 是否满足。
+
+    Raises:
+        OperationFailure: 如果运算符不受支持。
+    """
+    try:
+        match operator:
+            case "$eq":
+                return found and equals(value, operand)
+            case "$ne":
+                return not (found and equals(value, operand))
+            case "$in":
+                return found and any(equals(value, f1) for f1 in operand)
+            case "$nin":
+                return not (found and any(equals(value, f1) for f1 in operand))
+            case "$gt":
+                return found and value is not None and value > clone(operand)
+            case "$gte":
+                return found and value is not None and value >= clone(operand)
+            case "$lt":
+                return found and value is not None and value < clone(operand)
+            case "$lte":
+                return found and value is not None and value <= clone(operand)
+            case "$exists":
+                return found == bool(operand)
+    except TypeError:
+        # 不同类型的值之间没有顺序，与 MongoDB 一样视为不满足
+        return False
+    raise OperationFailure(F"不支持的查询运算符：{operator}")
+
+
+def matches(document, query):
+    """
+    判断文档是否满足查询条件，支持点分路径、$and、$or、$nor 以及 condition 中的运算符。
+
+    Args:
+        document: 文档。
+        query: 查询条件。
+
+    Returns:
+        bool: 是否满足。
+    """
+    for f1, f2 in query.items():
+        match f1:
+            case "$and":
+                satisfied = all(matches(document, f3) for f3 in f2)
+            case "$or":
+                satisfied = any(matches(document, f3) for f3 in f2)
+            case "$nor":
+                satisfied = not any(matches(document, f3) for f3 in f2)
+            case _:
+                found, value = lookup(document, f1)
+                if isinstance(f2, dict) and f2 and all(str(f3).startswith("$") for f3 in f2):
+                    satisfied = all(condition(found, value, f3, f4) for f3, f4 in f2.items())
+                else:
+                    satisfied = (found and equals(value, f2)) or (not found and f2 is None)
+        if not satisfied:
+            return False
+    return True
+
+
+def equalities(query, path):
+    """
+    取出查询条件中指定字段的等值条件，用于按索引缩小查找范围。
+
+    Args:
+        query: 查询条件。
+        path: 字段的点分路径。
+
+    Returns:
+        list | None: 字段可能的取值；查询条件没有限定该字段的取值时返回 None。
+    """
+    if path in query:
+        operand = query[path]
+        if isinstance(operand, dict) and operand and all(str(f1).startswith("$") for f1 in operand):
+            if "$eq" in operand:
+                return [operand["$eq"]]
+            return list(operand["$in"]) if "$in" in operand else None
+        return [operand]
+    for f1 in query.get("$and", list()):
+        values = equalities(f1, path)
+        if values is not None:
+            return values
+    return None
+
+
+def seed(query):
+    """
+    由查询条件中的等值条件生成 upsert 时插入的文档。
+
+    Args:
+        query: 查询条件。
+
+    Returns:
+        dict: 新文档。
+    """
+    document = dict()
+    for f1, f2 in query.items():
+        if f1 == "$and":
+            for f3 in f2:
+                document.update(seed(f3))
+        elif not f1.startswith("$") and not (isinstance(f2, dict) and any(str(f3).startswith("$") for f3 in f2)):
+            assign(document, f1, clone(f2))
+        elif isinstance(f2, dict) and "$eq" in f2:
+            assign(document, f1, clone(f2["$eq"]))
+    return document
+
+
+def modify(document, update, inserting=False):
+    """
+    对文档应用更新运算符，支持 $set、$setOnInsert、$unset 和 $inc。
+
+    Args:
+        document: 文档，原地修改。
+        update: 更新内容。
+        inserting: 是否为 upsert 插入的新文档，仅此时应用 $setOnInsert。默认为 False。
+
+    Returns:
+        dict: 修改后的文档。
+
+    Raises:
+        OperationFailure: 如果更新运算符不受支持。
+    """
+    for f1, f2 in update.items():
+        match f1:
+            case "$set":
+                for f3, f4 in f2.items():
+                    assign(document, f3, clone(f4))
+            case "$setOnInsert":
+                for f3, f4 in (f2.items() if inserting else ()):
+                    assign(document, f3, clone(f4))
+            case "$unset":
+                for f3 in f2:
+                    discard(document, f3)
+            case "$inc":
+                for f3, f4 in f2.items():
+                    assign(document, f3, (lookup(document, f3)[1] or 0) + f4)
+            case _:
+                raise OperationFailure(F"不支持的更新运算符：{f1}")
+    return document
+
+
+def project(document, projection=None):
+    """
+    按投影复制文档中的字段。
+
+    Args:
+        document: 文档。
+        projection: 投影，如 {"_id": 0}、{"network": 1, "code": 1} 或字段名列表。默认为 None（返回全部字段）。
+
+    Returns:
+        dict: 复制后的文档。
+    """
+    if not projection:
+        return clone(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {f1: 1 for f1 in projection}
+    if any(projection.values()):
+        projected = {"_id": clone(document["_id"])} if projection.get("_id", 1) and "_id" in document else dict()
+        for f1, f2 in projection.items():
+            found, value = lookup(document, f1)
+            if f2 and f1 != "_id" and found:
+                assign(projected, f1, clone(value))
+        return projected
+    projected = clone(document)
+    for f1 in projection:
+        discard(projected, f1)
+    return projected
+
+
+def order(document_list, sort):
+    """
+    按排序条件原地排序文档，缺少字段或为 None 的文档排在最前。
+
+    Args:
+        document_list: 文档列表。
+        sort: (字段, 1 或 -1) 元组的列表。
+    """
+    for f1, f2 in reversed(sort):
+        document_list.sort(
+            key=lambda document: (1, value) if (value := lookup(document, f1)[1]) is not None else (0, 0),
+            reverse=f2 < 0
+        )
+
+
+def evaluate(document, expression):
+    """
+    计算聚合表达式，"$字段" 取字段值，字典逐项计算，其余为常量。
+
+    Args:
+        document: 文档。
+        expression: 聚合表达式。
+
+    Returns:
+        表达式的值。
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        return lookup(document, expression[1:])[1]
+    if isinstance(expression, dict):
+        return {f1: evaluate(document, f2) for f1, f2 in expression.items()}
+    return expression
+
+
+def group(document_list, spec):
+    """
+    执行 $group 阶段，支持 $sum、$min、$max、$first、$last 和 $push 累加器。
+
+    Args:
+        document_list: 文档列表。
+        spec: $group 阶段的参数。
+
+    Returns:
+        list: 分组结果。
+
+    Raises:
+        OperationFailure: 如果累加器不受支持。
+    """
+    groups = dict()
+    for f1 in document_list:
+        key = evaluate(f1, spec["_id"])
+        result = groups.setdefault(fingerprint(key), {"_id": key})
+        for f2, f3 in spec.items():
+            if f2 == "_id":
+                continue
+            (accumulator, expression), = f3.items()
+            value = evaluate(f1, expression)
+            match accumulator:
+                case "$sum":
+                    result[f2] = result.get(f2, 0) + (value if isinstance(value, (int, float)) else 0)
+                case "$min":
+                    result[f2] = value if f2 not in result or (value is not None and value < result[f2]) else result[f2]
+                case "$max":
+                    result[f2] = value if f2 not in result or (value is not None and value > result[f2]) else result[f2]
+                case "$first":
+                    result.setdefault(f2, value)
+                case "$last":
+                    result[f2] = value
+                case "$push":
+                    result.setdefault(f2, list()).append(value)
+                case _:
+                    raise OperationFailure(F"不支持的累加器：{accumulator}")
+    return list(groups.values())
+
+
+class cursor:
+    """
+    内存和 SQLite 存储的查询游标，实现 Motor 游标中 FuseLink 用到的 sort、skip、limit、to_list 和 async for。
+
+    Attributes:
+        collection (documents): 所属集合。
+        query (dict): 查询条件。
+        projection (dict | None): 投影。
+        stages (list | None): 聚合管道，为 None 时为普通查询。
+        sorting (list | None): 排序条件。
+        offset (int): 跳过的文档数。
+        count (int): 返回的文档数上限，为 0 时不限。
+    """
+
+    def __init__(self, collection, query=None, projection=None, stages=None):
+        self.collection = collection
+        self.query = query or dict()
+        self.projection = projection
+        self.stages = stages
+        self.sorting = None
+        self.offset = 0
+        self.count = 0
+
+    def sort(self, key, direction=1):
+        """
+        设置排序条件。
+
+        Args:
+            key: 字段名，或 (字段, 方向) 元组的列表。
+            direction: 排序方向，1 为升序，-1 为降序。默认为 1。
+
+        Returns:
+            cursor: 游标本身。
+        """
+        self.sorting = list(key) if isinstance(key, (list, tuple)) else [(key, direction)]
+        return self
+
+    def skip(self, count):
+        """
+        设置跳过的文档数。
+
+        Returns:
+            cursor: 游标本身。
+        """
+        self.offset = count
+        return self
+
+    def limit(self, count):
+        """
+        设置返回的文档数上限。
+
+        Returns:
+            cursor: 游标本身。
+        """
+        self.count = count
+        return self
+
+    async def to_list(self, length=None):
+        """
+        取出查询结果。
+
+        Args:
+            length: 最多取出的文档数。默认为 None（全部取出）。
+
+        Returns:
+            list: 文档列表。
+        """
+        if self.stages is not None:
+            result = await self.collection.call(self.collection.pipeline, self.stages)
+        else:
+            count = min(f1 for f1 in (self.count, length) if f1) if (self.count or length) else 0
+            result = await self.collection.call(
+                self.collection.select, self.query, self.projection, self.sorting, self.offset, count
+            )
+        return result[:length] if length else result
+
+    async def iterate(self):
+        """
+        逐个产出查询结果。
+        """
+        for f1 in await self.to_list():
+            yield f1
+
+    def __aiter__(self):
+        return self.iterate()
+
+
+class documents:
+    """
+    进程内的内存集合，memory:// 存储后端的集合，实现 FuseLink 用到的 Motor 集合接口子集。
+
+    文档以 _id 为键保存在字典中，network.send 和 network.recv 上维护等值索引，
+    按这两个字段或 _id 查询时只检查索引命中的文档。TTL 索引在读写时每隔 interval 秒清理一次过期文档。
+    所有操作在事件循环线程中同步完成，单个操作天然是原子的。
+
+    Attributes:
+        database (database): 所属数据库。
+        name (str): 集合名称。
+        full_name (str): "数据库.集合" 形式的完整名称。
+        exists (bool): 集合是否已创建（写入过文档或创建过索引）。
+        indexes (dict): 以索引名为键、索引键为值的字典。
+        ttl (dict): 以索引名为键、(字段, 保留秒数) 为值的 TTL 索引。
+        purged (float): 上次清理过期文档的时间。
+        data (dict): 以 _id 为键的文档。
+        index (dict): 以字段路径为键、{取值的等值比较键: {_id: None}} 为值的等值索引。
+    """
+
+    # 建立等值索引的字段，及其在 SQLite 表中对应的列
+    indexed = {"network.send": "send", "network.recv": "recv"}
+    interval = 60.0
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = F"{database.name}.{name}"
+        self.exists = False
+        self.indexes = {"_id_": [("_id", 1)]}
+        self.ttl = dict()
+        self.purged = 0.0
+        self.data = dict()
+        self.index = {f1: dict() for f1 in self.indexed}
+
+    def candidates(self, query):
+        """
+        按 _id 或等值索引缩小范围，返回可能满足查询条件的文档（未复制）。
+
+        Args:
+            query: 查询条件。
+
+        Returns:
+            list: 文档列表，按插入顺序排列。
+        """
+        values = equalities(query, "_id")
+        if values is not None:
+            return [self.data[f1] for f1 in values if f1 in self.data]
+        for f1 in self.indexed:
+            values = equalities(query, f1)
+            if values is not None and all(isinstance(f2, (list, tuple)) for f2 in values):
+                hits = set().union(*(self.index[f1].get(fingerprint(clone(f2)), dict()) for f2 in values))
+                return [f2 for f3, f2 in self.data.items() if f3 in hits] if len(values) > 1 else [
+                    self.data[f2] for f2 in self.index[f1].get(fingerprint(clone(values[0])), dict())
+                ]
+        return list(self.data.values())
+
+    def get(self, identifier):
+        """
+        按 _id 取出文档（未复制）。
+
+        Args:
+            identifier: 文档的 _id。
+
+        Returns:
+            dict | None: 文档，不存在时返回 None。
+        """
+        return self.data.get(identifier)
+
+    def put(self, document):
+        """
+        写入文档，_id 已存在时替换原文档并保持其位置。
+
+        Args:
+            document: 已复制的文档。
+        """
+        self.exists = True
+        previous = self.data.get(document["_id"])
+        if previous is not None:
+            self.unindex(previous)
+        self.data[document["_id"]] = document
+        for f1 in self.indexed:
+            found, value = lookup(document, f1)
+            if found:
+                self.index[f1].setdefault(fingerprint(value), dict())[document["_id"]] = None
+
+    def remove(self, document):
+        """
+        删除文档。
+
+        Args:
+            document: 存储中的文档。
+        """
+        self.data.pop(document["_id"], None)
+        self.unindex(document)
+
+    def unindex(self, document):
+        """
+        从等值索引中删除文档。
+
+        Args:
+            document: 存储中的文档。
+        """
+        for f1 in self.indexed:
+            found, value = lookup(document, f1)
+            if found:
+                key = fingerprint(value)
+                self.index[f1].get(key, dict()).pop(document["_id"], None)
+                if not self.index[f1].get(key, True):
+                    self.index[f1].pop(key)
+
+    def deadline(self, document):
+        """
+        计算文档按 TTL 索引过期的时间。
+
+        Args:
+            document: 文档。
+
+        Returns:
+            float | None: 过期时间的时间戳，文档不会过期时返回 None。
+        """
+        deadlines = [
+            clone(value).timestamp() + f2
+            for f1, f2 in self.ttl.values()
+            for found, value in [lookup(document, f1)] if found and isinstance(value, dt)
+        ]
+        return min(deadlines) if deadlines else None
+
+    def expire(self, force=False):
+        """
+        每隔 interval 秒删除一次按 TTL 索引过期的文档。
+
+        Args:
+            force: 是否立即清理。默认为 False。
+
+        Returns:
+            int: 删除的文档数。
+        """
+        if not self.ttl or (not force and time() - self.purged < self.interval):
+            return 0
+        self.purged = time()
+        expired = [f1 for f1 in self.data.values() if (f2 := self.deadline(f1)) is not None and f2 <= self.purged]
+        for f1 in expired:
+            self.remove(f1)
+        return len(expired)
+
+    def drop(self):
+        """
+        删除集合的全部文档和索引。
+        """
+        self.data.clear()
+        self.index = {f1: dict() for f1 in self.indexed}
+        self.indexes = {"_id_": [("_id", 1)]}
+        self.ttl.clear()
+        self.exists = False
+
+    def select(self, query, projection=None, sort=None, skip=0, limit=0):
+        """
+        查询满足条件的文档。
+
+        Returns:
+            list: 按投影复制的文档。
+        """
+        self.expire()
+        found = [f1 for f1 in self.candidates(query) if matches(f1, query)]
+        if sort:
+            order(found, sort)
+        found = found[skip:(skip + limit) if limit else None]
+        return [project(f1, projection) for f1 in found]
+
+    def insert(self, document_list):
+        """
+        插入文档，没有 _id 的文档生成 ObjectId，并像 pymongo 一样写回调用者的文档。
+
+        Returns:
+            list: 插入文档的 _id。
+
+        Raises:
+            DuplicateKeyError: 如果 _id 已存在。
+        """
+        self.expire()
+        inserted = list()
+        for f1 in document_list:
+            f1.setdefault("_id", ObjectId())
+            if self.get(f1["_id"]) is not None:
+                raise DuplicateKeyError(F"E11000 duplicate key error collection: {self.full_name} _id: {f1['_id']}")
+            self.put(clone(f1))
+            inserted.append(f1["_id"])
+        return inserted
+
+    def update(self, query, update, upsert=False, many=False, replace=False):
+        """
+        更新或替换满足条件的文档，没有满足条件的文档且 upsert 为 True 时插入新文档。
+
+        Returns:
+            dict: 与 MongoDB update 命令相同格式的结果。
+        """
+        self.expire()
+        found = [f1 for f1 in self.candidates(query) if matches(f1, query)]
+        found = found if many else found[:1]
+        for f1 in found:
+            document = {**clone(update), "_id": f1["_id"]} if replace else modify(clone(f1), update)
+            self.put(document)
+        if not found and upsert:
+            if replace:
+                identifier = seed(query).get("_id")
+                document = {**({"_id": identifier} if identifier is not None else dict()), **clone(update)}
+            else:
+                document = modify(seed(query), update, inserting=True)
+            document.setdefault("_id", ObjectId())
+            self.put(document)
+            return {"n": 1, "nModified": 0, "upserted": document["_id"], "updatedExisting": False}
+        return {"n": len(found), "nModified": len(found), "updatedExisting": bool(found)}
+
+    def delete(self, query, many=False):
+        """
+        删除满足条件的文档。
+
+        Returns:
+            int: 删除的文档数。
+        """
+        self.expire()
+        found = [f1 for f1 in self.candidates(query) if matches(f1, query)]
+        found = found if many else found[:1]
+        for f1 in found:
+            self.remove(f1)
+        return len(found)
+
+    def take(self, query, projection=None, sort=None):
+        """
+        取出并删除第一个满足条件的文档。
+
+        Returns:
+            dict | None: 按投影复制的文档，没有满足条件的文档时返回 None。
+        """
+        self.expire()
+        found = [f1 for f1 in self.candidates(query) if matches(f1, query)]
+        if sort:
+            order(found, sort)
+        if not found:
+            return None
+        self.remove(found[0])
+        return project(found[0], projection)
+
+    def count(self, query, skip=0, limit=0):
+        """
+        统计满足条件的文档数。
+
+        Returns:
+            int: 文档数。
+        """
+        self.expire()
+        found = sum(1 for f1 in self.candidates(query) if matches(f1, query))
+        found = max(found - skip, 0)
+        return min(found, limit) if limit else found
+
+    def values(self, key, query):
+        """
+        取出满足条件的文档中字段的不同取值，数组字段展开为各个元素。
+
+        Returns:
+            list: 不同的取值。
+        """
+        self.expire()
+        distinct = dict()
+        for f1 in self.candidates(query):
+            found, value = lookup(f1, key)
+            if found and matches(f1, query):
+                for f2 in (value if isinstance(value, list) else [value]):
+                    distinct.setdefault(fingerprint(f2), clone(f2))
+        return list(distinct.values())
+
+    def bulk(self, operations, ordered=True):
+        """
+        依次执行 pymongo 的 InsertOne、UpdateOne、UpdateMany、ReplaceOne、DeleteOne 和 DeleteMany 操作。
+
+        Returns:
+            dict: 与 MongoDB bulk write 相同格式的结果。
+        """
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+        }
+        for f1, f2 in enumerate(operations):
+            if isinstance(f2, InsertOne):
+                result["nInserted"] += len(self.insert([f2._doc]))
+            elif isinstance(f2, (UpdateOne, UpdateMany, ReplaceOne)):
+                update_result = self.update(
+                    f2._filter, f2._doc, f2._upsert, many=isinstance(f2, UpdateMany), replace=isinstance(f2, ReplaceOne)
+                )
+                if "upserted" in update_result:
+                    result["nUpserted"] += 1
+                    result["upserted"].append({"index": f1, "_id": update_result["upserted"]})
+                else:
+                    result["nMatched"] += update_result["n"]
+                    result["nModified"] += update_result["nModified"]
+            elif isinstance(f2, (DeleteOne, DeleteMany)):
+                result["nRemoved"] += self.delete(f2._filter, many=isinstance(f2, DeleteMany))
+            else:
+                raise OperationFailure(F"不支持的批量操作：{type(f2).__name__}")
+        return result
+
+    def pipeline(self, stages):
+        """
+        执行聚合管道，支持 $match、$group、$sort、$skip、$limit、$project、$count 和 $indexStats 阶段。
+
+        Returns:
+            list: 聚合结果。
+
+        Raises:
+            OperationFailure: 如果阶段不受支持。
+        """
+        self.expire()
+        result = list(self.candidates(dict()))
+        for f1 in stages:
+            (stage, spec), = f1.items()
+            match stage:
+                case "$match":
+                    result = [f2 for f2 in result if matches(f2, spec)]
+                case "$group":
+                    result = group(result, spec)
+                case "$sort":
+                    result = list(result)
+                    order(result, list(spec.items()))
+                case "$skip":
+                    result = result[spec:]
+                case "$limit":
+                    result = result[:spec]
+                case "$project":
+                    result = [project(f2, spec) for f2 in result]
+                case "$count":
+                    result = [{spec: len(result)}]
+                case "$indexStats":
+                    # 内存和 SQLite 存储不统计索引的使用次数
+                    result = [{"name": f2, "key": dict(f3), "accesses": {"ops": 0}} for f2, f3 in self.indexes.items()]
+                case _:
+                    raise OperationFailure(F"不支持的聚合阶段：{stage}")
+        return [clone(f1) for f1 in result]
+
+    def declare(self, keys, name=None, expire=None):
+        """
+        登记索引，TTL 索引的保留时间变化时直接更新。
+
+        Returns:
+            str: 索引名。
+        """
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(F"{f1}_{f2}" for f1, f2 in keys)
+        self.exists = True
+        self.indexes[name] = keys
+        if expire is not None:
+            self.ttl[name] = (keys[0][0], expire)
+        return name
+
+    def retain(self, name, expire):
+        """
+        更新 TTL 索引的保留时间，索引不存在时按 date 字段创建。
+
+        Returns:
+            str: 索引名。
+        """
+        return self.declare(self.indexes.get(name, [("date", 1)]), name, expire)
+
+    async def call(self, method, *args):
+        """
+        执行一个同步的集合操作。内存集合直接在事件循环线程中执行。
+
+        Args:
+            method: 同步操作方法。
+            *args: 方法参数。
+
+        Returns:
+            方法的返回值。
+        """
+        return await self.database.client.call(method, *args)
+
+    # 以下方法的参数和返回值与 Motor 集合的同名方法相同
+    def find(self, filter=None, projection=None, **kwargs):
+        return cursor(self, filter, projection)
+
+    def aggregate(self, pipeline, **kwargs):
+        return cursor(self, stages=pipeline)
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        found = await self.call(self.select, filter or dict(), projection, kwargs.get("sort"), 0, 1)
+        return found[0] if found else None
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        return await self.call(self.take, filter, projection, sort)
+
+    async def insert_one(self, document, **kwargs):
+        return InsertOneResult((await self.call(self.insert, [document]))[0], True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        return InsertManyResult(await self.call(self.insert, list(documents)), True)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        return UpdateResult(await self.call(self.update, filter, update, upsert), True)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        return UpdateResult(await self.call(self.update, filter, update, upsert, True), True)
+
+    async def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return UpdateResult(await self.call(self.update, filter, replacement, upsert, False, True), True)
+
+    async def delete_one(self, filter, **kwargs):
+        return DeleteResult({"n": await self.call(self.delete, filter)}, True)
+
+    async def delete_many(self, filter, **kwargs):
+        return DeleteResult({"n": await self.call(self.delete, filter, True)}, True)
+
+    async def count_documents(self, filter, skip=0, limit=0, **kwargs):
+        return await self.call(self.count, filter, skip, limit)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        return await self.call(self.values, key, filter or dict())
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        return BulkWriteResult(await self.call(self.bulk, list(requests), ordered), True)
+
+    async def create_index(self, keys, name=None, expireAfterSeconds=None, **kwargs):
+        return await self.call(self.declare, keys, name, expireAfterSeconds)
+
+
+class tables(documents):
+    """
+    SQLite 表，sqlite:// 存储后端的集合，查询和更新语义与内存集合相同。
+
+    每个集合对应一张表，文档以 BSON 编码保存在 body 列；_id、network.send、network.recv
+    和按 TTL 索引计算的过期时间另存为带索引的列，按这些字段的等值条件查询时由 SQLite 缩小范围，
+    其余条件在读出文档后按内存集合的规则判断。每个操作在一个 BEGIN IMMEDIATE 事务中完成，
+    同一台机器上的多个进程可以安全地共享同一个数据库文件。
+
+    索引定义保存在数据库文件的 index_table 表中，每个操作开始时重新读出，因此一个进程创建或修改的 TTL 索引
+    对共享该文件的其他进程（如服务端的多个进程、客户端与 Sanic 网关）同样生效，它们写入的文档也会过期。
+
+    Attributes:
+        table (str): 转义后的表名。
+        created (bool): 本进程是否已确认表存在。
+    """
+
+    codec = CodecOptions(tz_aware=True)
+
+    def __init__(self, database, name):
+        super().__init__(database, name)
+        self.table = '"' + name.replace('"', '""') + '"'
+        self.created = False
+
+    @property
+    def connection(self):
+        return self.database.client.connection
+
+    @staticmethod
+    def identify(identifier):
+        """
+        生成 _id 在 id 列中的文本，带有类型前缀，使不同类型的 _id 不会相等。
+        """
+        return F"{type(identifier).__name__}:{identifier}"
+
+    def create(self):
+        """
+        创建表及其索引。
+        """
+        if self.created:
+            return
+        name = self.name.replace('"', '""')
+        self.connection.execute(
+            F"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, body BLOB NOT NULL, "
+            "send TEXT, recv TEXT, expires REAL)"
+        )
+        for f1 in ("send", "recv", "expires"):
+            self.connection.execute(F'CREATE INDEX IF NOT EXISTS "{name}_{f1}" ON {self.table} ({f1})')
+        self.created = True
+        self.exists = True
+
+    def rows(self, where="", parameters=()):
+        """
+        按 SQL 条件读出文档，按插入顺序排列。
+        """
+        self.create()
+        return [
+            bson.decode(f1[0], codec_options=self.codec)
+            for f1 in self.connection.execute(F"SELECT body FROM {self.table} {where} ORDER BY seq", parameters)
+        ]
+
+    def candidates(self, query):
+        values = equalities(query, "_id")
+        if values is not None:
+            return self.rows(
+                F"WHERE id IN ({', '.join('?' * len(values))})", [self.identify(f1) for f1 in values]
+            ) if values else list()
+        for f1, f2 in self.indexed.items():
+            values = equalities(query, f1)
+            if values is not None and values and all(isinstance(f3, (list, tuple)) for f3 in values):
+                return self.rows(F"WHERE {f2} IN ({', '.join('?' * len(values))})", [fingerprint(clone(f3)) for f3 in values])
+        return self.rows()
+
+    def get(self, identifier):
+        found = self.rows("WHERE id = ?", [self.identify(identifier)])
+        return found[0] if found else None
+
+    def put(self, document):
+        self.create()
+        self.connection.execute(
+            F"INSERT INTO {self.table} (id, body, send, recv, expires) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET body = excluded.body, send = excluded.send, recv = excluded.recv, expires = excluded.expires",
+            [
+                self.identify(document["_id"]),
+                bson.encode(document),
+                *(fingerprint(f2) if f1 else None for f1, f2 in (lookup(document, f3) for f3 in self.indexed)),
+                self.deadline(document)
+            ]
+        )
+
+    def remove(self, document):
+        self.create()
+        self.connection.execute(F"DELETE FROM {self.table} WHERE id = ?", [self.identify(document["_id"])])
+
+    def load(self):
+        """
+        从 index_table 读出该集合的索引定义，包括其他进程创建的索引。
+        """
+        rows = self.connection.execute(
+            F'SELECT name, keys, expire FROM "{index_table}" WHERE collection = ?', [self.name]
+        ).fetchall()
+        self.indexes = {"_id_": [("_id", 1)], **{f1: [tuple(f4) for f4 in loads(f2)] for f1, f2, f3 in rows}}
+        self.ttl = {f1: (loads(f2)[0][0], f3) for f1, f2, f3 in rows if f3 is not None}
+
+    def expire(self, force=False):
+        self.load()
+        if not self.ttl or (not force and time() - self.purged < self.interval):
+            return 0
+        self.create()
+        self.purged = time()
+        return self.connection.execute(F"DELETE FROM {self.table} WHERE expires <= ?", [self.purged]).rowcount
+
+    def drop(self):
+        self.connection.execute(F"DROP TABLE IF EXISTS {self.table}")
+        self.connection.execute(F'DELETE FROM "{index_table}" WHERE collection = ?', [self.name])
+        self.created = False
+        self.indexes = {"_id_": [("_id", 1)]}
+        self.ttl.clear()
+        self.exists = False
+
+    def declare(self, keys, name=None, expire=None):
+        self.create()
+        self.load()
+        previous = dict(self.ttl)
+        name = super().declare(keys, name, expire)
+        self.connection.execute(
+            F'INSERT INTO "{index_table}" (collection, name, keys, expire) VALUES (?, ?, ?, ?) '
+            "ON CONFLICT(collection, name) DO UPDATE SET keys = excluded.keys, expire = excluded.expire",
+            [self.name, name, dumps(self.indexes[name]), self.ttl[name][1] if name in self.ttl else None]
+        )
+        if self.ttl != previous:
+            # TTL 索引变化时重新计算已有文档的过期时间
+            for f1 in self.rows():
+                self.connection.execute(
+                    F"UPDATE {self.table} SET expires = ? WHERE id = ?", [self.deadline(f1), self.identify(f1["_id"])]
+                )
+        return name
+
+
+class database:
+    """
+    内存和 SQLite 存储的数据库，按名称创建并缓存集合，使同一名称始终对应同一个集合对象。
+
+    Attributes:
+        client (embedded): 所属客户端。
+        name (str): 数据库名称。
+        collections (dict): 以集合名为键的集合。
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collections = dict()
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = (tables if self.client.connection else documents)(self, name)
+        return self.collections[name]
+
+    def listing(self):
+        """
+        列出已创建的集合名称。SQLite 存储查询数据库文件中的表，包括其他进程创建的表。
+
+        Returns:
+            list: 集合名称。
+        """
+        if self.client.connection:
+            return [
+                f1[0] for f1 in self.client.connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name != ?", [index_table]
+                )
+            ]
+        return [f1 for f1, f2 in self.collections.items() if f2.exists]
+
+    async def list_collection_names(self, **kwargs):
+        return await self.client.call(self.listing)
+
+    async def drop_collection(self, name, **kwargs):
+        await self.client.call(self[name].drop)
+
+    async def command(self, command, name=None, index=None, **kwargs):
+        """
+        执行数据库命令，仅支持更新 TTL 索引保留时间的 collMod。
+
+        Raises:
+            OperationFailure: 如果命令不受支持。
+        """
+        if command != "collMod" or not index:
+            raise OperationFailure(F"不支持的命令：{command}")
+        collection = self[name]
+        await self.client.call(collection.retain, index["name"], index["expireAfterSeconds"])
+        return {"ok": 1.0}
+
+
+class embedded:
+    """
+    内存或 SQLite 存储的客户端，与 AsyncIOMotorClient 一样按 client[数据库][集合] 访问集合。
+
+    SQLite 存储的一个文件对应一个数据库，集合名称即表名。所有 SQLite 操作在一个专用线程中串行执行，
+    不阻塞事件循环；连接使用 WAL 日志模式和 synchronous=NORMAL，读不阻塞写。
+
+    Attributes:
+        uri (str): 存储地址。
+        path (str | None): SQLite 文件路径，内存存储为 None。
+        connection (sqlite3.Connection | None): SQLite 连接，内存存储为 None。
+        executor (ThreadPoolExecutor | None): 执行 SQLite 操作的线程。
+        databases (dict): 以数据库名为键的数据库。
+
+    Example:
+        >>> client = embedded("sqlite:///fuselink.db")
+        >>> await client["FuseLink_Cache"]["server_data_default"].insert_one({"code": 1})
+    """
+
+    def __init__(self, uri="memory://"):
+        self.uri = uri
+        self.path = None
+        self.connection = None
+        self.executor = None
+        self.databases = dict()
+        if urlparse(uri).scheme == "sqlite":
+            self.path = join(script_dir, uri[len("sqlite:///"):])
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA busy_timeout=10000")
+            self.connection.execute(
+                F'CREATE TABLE IF NOT EXISTS "{index_table}" ('
+                "collection TEXT NOT NULL, name TEXT NOT NULL, keys TEXT NOT NULL, expire REAL, PRIMARY KEY (collection, name))"
+            )
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fuselink_sqlite")
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = database(self, name)
+        return self.databases[name]
+
+    def transaction(self, method, *args):
+        """
+        在一个 BEGIN IMMEDIATE 事务中执行同步操作，出错时回滚。
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = method(*args)
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return result
+
+    async def call(self, method, *args):
+        """
+        执行一个同步的存储操作：内存存储直接执行，SQLite 存储在专用线程的事务中执行。
+
+        Args:
+            method: 同步操作方法。
+            *args: 方法参数。
+
+        Returns:
+            方法的返回值。
+        """
+        if self.connection is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(self.transaction, method, *args))
+
+    def close(self):
+        """
+        关闭 SQLite 连接和线程。
+        """
+        if self.connection is not None:
+            self.executor.shutdown(wait=True)
+            self.connection.close()
+            self.connection = None
@@ -27,16 +27,19 @@ demo_server_data = {
 }
 
 
+from fuselink import names, mongo_uri, mongo_database
 from pymongo import MongoClient
 from time import time, sleep
 from uuid import uuid1
 
 
-mongo = MongoClient('mongodb://localhost:27017/')
-client_log = mongo['FuseLink_Cache'][F"clientss_log_{str(uuid1())[-12:]}"]
-client_read = mongo['FuseLink_Cache'][F"clients_read_{str(uuid1())[-12:]}"]
-client_write = mongo['FuseLink_Cache'][F"clients_write_{str(uuid1())[-12:]}"]
-client_device = mongo['FuseLink_Cache'][F"clients_device_{str(uuid1())[-12:]}"]
+# 使用与运行中的客户端相同的命名空间（客户端配置中的 storage.namespace）
+collection_names = names("default")
+mongo = MongoClient(mongo_uri)
+client_log = mongo[mongo_database][collection_names["client_log"]]
+client_read = mongo[mongo_database][collection_names["client_read"]]
+client_write = mongo[mongo_database][collection_names["client_write"]]
+client_device = mongo[mongo_database][collection_names["client_device"]]
 
 if False:
     client_write.delete_many(dict())
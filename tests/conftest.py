@@ -0,0 +1,61 @@
+import sys
+from os.path import abspath, dirname, join
+from uuid import uuid1
+
+import pytest
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "src"))
+
+import fuselink  # noqa: E402
+
+
+class socket:
+    """
+    记录发出帧的 WebSocket 连接替身，供服务端和客户端的方法直接调用。
+    """
+
+    def __init__(self, address=("127.0.0.1", 50000), subprotocol=None):
+        self.remote_address = address
+        self.subprotocol = subprotocol
+        self.local_address = ("127.0.0.1", 10000)
+        self.frames = list()
+        self.inbox = list()
+        self.closed = None
+
+    async def recv(self):
+        if not self.inbox:
+            raise ConnectionError("no more frames")
+        return self.inbox.pop(0)
+
+    async def send(self, frame):
+        self.frames.append(bytes(frame) if isinstance(frame, memoryview) else frame)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = (code, reason)
+
+    def messages(self):
+        return [fuselink.unpack(f1, self.subprotocol) for f1 in self.frames if not fuselink.chunked(f1)]
+
+
+@pytest.fixture
+def storage():
+    """
+    每个用例使用一个新的内存存储和命名空间，server_data 不分区。
+    """
+    fuselink.partition(1)
+    fuselink.reconnect("memory://", F"test_{uuid1().hex[:8]}")
+    yield fuselink
+    fuselink.partition(1)
+
+
+@pytest.fixture
+def shared(tmp_path):
+    """
+    每个用例使用一个新的 SQLite 存储，操作在存储线程中执行，可以与其他协程交错。
+    """
+    fuselink.partition(1)
+    fuselink.reconnect(F"sqlite:///{tmp_path / 'fuselink.db'}", F"test_{uuid1().hex[:8]}")
+    yield fuselink
+    fuselink.mongo.close()
+    fuselink.partition(1)
+    fuselink.reconnect("memory://")
@@ -0,0 +1,24 @@
+import asyncio
+
+from conftest import socket
+
+
+def test_forward_claims_each_document_once(shared):
+    async def scenario():
+        await shared.client_write.insert_many([{"code": {"n": f1}} for f1 in range(50)])
+        first, second = shared.clients(), shared.clients()
+        first_ws, second_ws = socket(("127.0.0.1", 50001)), socket(("127.0.0.1", 50002))
+        base = {"utc": 0, "network": {"send": ["127.0.0.1", 50001], "recv": ["127.0.0.1", 50001]}}
+        await asyncio.gather(
+            first.forward(first_ws, {**base}, batch=1), second.forward(second_ws, {**base}, batch=1),
+            first.forward(first_ws, {**base}, batch=64), second.forward(second_ws, {**base}, batch=64)
+        )
+        sent = list()
+        for f1 in first_ws.messages() + second_ws.messages():
+            code = f1["code"]
+            sent.extend(f2["code"]["n"] for f2 in code["@batch"]) if "@batch" in code else sent.append(code["n"])
+        return sent, await shared.client_write.count_documents(dict())
+
+    sent, remaining = asyncio.run(scenario())
+    assert sorted(sent) == list(range(50))
+    assert remaining == 0
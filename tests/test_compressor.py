@@ -0,0 +1,89 @@
+import asyncio
+from os import urandom
+
+import pytest
+
+import fuselink
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def frame(n):
+    return fuselink.encode({
+        "utc": 1621548726 + n, "network": {"send": ["127.0.0.1", 40000 + n % 7], "recv": ["127.0.0.1", 50000]},
+        "code": {"n": n, "text": F"sample {n * 7919} " * 20}
+    })
+
+
+def trained(samples=500):
+    adaptive = fuselink.compressor(size=4096, samples=samples, rate=1.0)
+    adaptive.training = True
+    for f1 in range(samples):
+        adaptive.compress(frame(f1))
+    return adaptive
+
+
+def test_small_and_incompressible_frames_pass_through():
+    adaptive = fuselink.compressor(threshold=64)
+    assert adaptive.compress("{}") == "{}" and adaptive.compress(b"\x81\xa1") == b"\x00\x81\xa1"
+    noise = urandom(1024)
+    assert adaptive.compress(noise) == b"\x00" + noise
+    packed = adaptive.compress(frame(0))
+    assert packed[:1] == b"\x01" and len(packed) < len(frame(0))
+    assert adaptive.decompress(packed) == frame(0).encode("UTF-8")
+
+
+def test_trained_dictionary_is_offered_before_use():
+    server, client = trained(), fuselink.compressor()
+
+    async def scenario():
+        return await server.train()
+
+    dictionary_id = asyncio.run(scenario())
+    assert dictionary_id and server.current == 0 and not server.samples
+    offered = server.offer()
+    assert offered[:1] == b"\x02" and client.install(offered[1:]) == dictionary_id
+    server.current = dictionary_id
+    packed = server.compress(frame(9999))
+    assert zstandard.get_frame_parameters(packed[1:]).dict_id == dictionary_id
+    assert client.decompress(packed) == frame(9999).encode("UTF-8")
+    # 未收到字典的一方无法解压
+    with pytest.raises(ValueError):
+        fuselink.compressor().decompress(packed)
+
+
+def test_train_waits_for_full_samples():
+    adaptive = trained(samples=500)
+    adaptive.samples = type(adaptive.samples)(list(adaptive.samples)[:10], maxlen=500)
+    assert asyncio.run(adaptive.train()) is None and len(adaptive.samples) == 10
+
+
+def test_install_keeps_recent_and_current_dictionaries():
+    samples = [frame(f1).encode("UTF-8") for f1 in range(500)]
+    dictionaries = [zstandard.train_dictionary(1024 + 256 * f1, samples).as_bytes() for f1 in range(3)]
+    adaptive = fuselink.compressor(keep=1)
+    current = adaptive.install(dictionaries[0])
+    pending = adaptive.install(dictionaries[1], activate=False)
+    latest = adaptive.install(dictionaries[2], activate=False)
+    assert adaptive.current == current and list(adaptive.dictionaries) == [current, latest] and pending not in adaptive.dictionaries
+    with pytest.raises(ValueError):
+        adaptive.install(b"not a dictionary")
+
+
+def test_decompress_rejects_oversized_frames():
+    adaptive = fuselink.compressor(limit=1024)
+    packed = fuselink.compressor().compress(b"\x00" * 4096)
+    with pytest.raises(ValueError):
+        adaptive.decompress(packed)
+    with pytest.raises(ValueError):
+        adaptive.decompress(b"\x09" + packed[1:])
+
+
+def test_training_server_ignores_peer_dictionaries(monkeypatch):
+    server = trained()
+    dictionary_id = asyncio.run(server.train())
+    monkeypatch.setattr(fuselink, "adaptive", fuselink.compressor())
+    assert fuselink.unpack(server.offer(), "fuselink.json+zstd") == {"@zstd": dictionary_id}
+    fuselink.adaptive.training = True
+    with pytest.raises(ValueError):
+        fuselink.unpack(server.offer(), "fuselink.json+zstd")
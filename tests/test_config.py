@@ -0,0 +1,41 @@
+import json
+
+import fuselink
+
+defaults = {
+    "host": "0.0.0.0", "port": 10000, "outbound": {"high": 1000, "low": 100},
+    "storage": {"uri": "memory://", "namespace": "default"}, "metrics": None
+}
+
+
+def write(path, content):
+    path.write_text(content if isinstance(content, str) else json.dumps(content), encoding="utf-8")
+
+
+def test_upgrade_keeps_user_settings(tmp_path):
+    path = tmp_path / "server_config.json"
+    write(path, {"host": "10.0.0.2", "port": 20000, "outbox": {"high": 50}, "storage": {"uri": "sqlite:///data.db"}})
+    config = fuselink.configure(str(path), defaults, {"outbox": "outbound"})
+    assert config == {
+        "host": "10.0.0.2", "port": 20000, "outbound": {"high": 50, "low": 100},
+        "storage": {"uri": "sqlite:///data.db", "namespace": "default"}, "metrics": None
+    }
+    assert json.loads(path.read_text(encoding="utf-8")) == config
+
+
+def test_missing_file_is_generated(tmp_path):
+    path = tmp_path / "client_config.json"
+    assert fuselink.configure(str(path), defaults) == defaults
+    assert json.loads(path.read_text(encoding="utf-8")) == defaults
+
+
+def test_malformed_file_is_not_overwritten(tmp_path):
+    path = tmp_path / "server_config.json"
+    write(path, '{"host": "10.0.0.2",')
+    assert fuselink.configure(str(path), defaults) == defaults
+    assert path.read_text(encoding="utf-8") == '{"host": "10.0.0.2",'
+
+
+def test_merge_replaces_non_dict_values():
+    merged = fuselink.merge(defaults, {"metrics": {"port": 9100}, "storage": None})
+    assert merged["metrics"] == {"port": 9100} and merged["storage"] is None
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import fuselink
+from conftest import socket
+
+pytest.importorskip("sanic")
+network_sanic = pytest.importorskip("network_sanic")
+
+
+def test_device_requests_read_the_mirror(storage, monkeypatch):
+    devices = [{"network": {"send": ["127.0.0.1", 50000 + f1]}, "code": None} for f1 in range(2)]
+    monkeypatch.setattr(network_sanic, "admin_write", storage.client_write)
+    monkeypatch.setattr(network_sanic, "admin_device", storage.client_device)
+
+    async def scenario():
+        await storage.client_device.insert_many([dict(f1) for f1 in devices])
+        ws = socket()
+        replies = list()
+        for f1 in range(2):
+            ws.inbox.append(fuselink.encode({"@device": None}))
+            await asyncio.wait_for(network_sanic.ws_task(ws, {"code": None}), 1.0)
+            replies.append(ws.messages()[-1])
+        return replies, await storage.client_device.count_documents({}), await storage.client_write.count_documents({})
+
+    replies, mirrored, requested = asyncio.run(scenario())
+    assert replies == [devices, devices]
+    assert mirrored == 2 and requested == 2
+
+
+def test_first_device_request_waits_for_snapshot(storage, monkeypatch):
+    monkeypatch.setattr(network_sanic, "admin_write", storage.client_write)
+    monkeypatch.setattr(network_sanic, "admin_device", storage.client_device)
+
+    async def scenario():
+        async def snapshot():
+            await asyncio.sleep(0.2)
+            await storage.client_device.insert_one({"network": {"send": ["127.0.0.1", 50000]}})
+
+        task = asyncio.create_task(snapshot())
+        empty = await network_sanic.device_list(timeout=0.05, interval=0.01)
+        found = await network_sanic.device_list(timeout=1.0, interval=0.01)
+        await task
+        return empty, found
+
+    assert asyncio.run(scenario()) == ([], [{"network": {"send": ["127.0.0.1", 50000]}}])
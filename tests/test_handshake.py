@@ -0,0 +1,89 @@
+import asyncio
+from http import HTTPStatus
+from urllib.parse import urlencode
+
+import fuselink
+from conftest import socket
+
+address = ("127.0.0.1", 50000)
+
+
+class connection(socket):
+    """
+    握手阶段的连接替身，respond 返回 (状态码, 响应内容) 以代替 HTTP 响应。
+    """
+
+    def respond(self, status, text):
+        return status, text
+
+
+class request:
+    def __init__(self, headers=None, query=None):
+        self.path = "/" + (F"?{urlencode(query)}" if query else "")
+        self.headers = headers or dict()
+
+
+class response:
+    def __init__(self):
+        self.headers = dict()
+
+
+def headers(credentials):
+    return {fuselink.handshake_headers[f1]: f2 for f1, f2 in credentials.items()}
+
+
+def test_upgrade_rejects_missing_or_invalid_credentials(storage):
+    async def scenario():
+        server = storage.servers()
+        credentials = storage.clients().credentials()
+        results = [await server.upgrade(connection(address), request())]
+        server.handshake = "required"
+        results.append(await server.upgrade(connection(address), request()))
+        results.append(await server.upgrade(connection(address), request(headers({**credentials, "code": "000000"}))))
+        server.handshake = "off"
+        results.append(await server.upgrade(connection(address), request(headers(credentials))))
+        return results, len(server.handshakes)
+
+    results, accepted = asyncio.run(scenario())
+    assert results[0] is None and results[3] is None and accepted == 0
+    assert [f1[0] for f1 in results[1:3]] == [HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN]
+
+
+def test_verified_upgrade_skips_the_verification_frame(storage):
+    async def scenario():
+        server, client = storage.servers(), storage.clients()
+        ws = connection(address)
+        upgraded = await server.upgrade(ws, request(query=client.credentials()))
+        reply = response()
+        server.upgraded(ws, None, reply)
+        verif_data = await server.verif(ws)
+        ws.response = reply
+        client_data = client.handshaken(ws)
+        stored = await storage.server_verif.find_one({"network.send": list(address)})
+        return server, upgraded, reply.headers, verif_data, ws.frames, stored, client, client_data
+
+    server, upgraded, replied, verif_data, frames, stored, client, client_data = asyncio.run(scenario())
+    assert upgraded is None and frames == []
+    assert fuselink.decode(replied["X-FuseLink-Address"]) == list(address)
+    assert verif_data["verif"]["res"]["verif"] and tuple(address) in server.registry.table
+    assert server.tokens.verify(replied["X-FuseLink-Resume"])["nonce"] == stored["nonce"]
+    assert client.resume == replied["X-FuseLink-Resume"] and client_data["network"]["send"] == list(address)
+
+
+def test_resume_token_at_upgrade_is_single_use(storage):
+    async def scenario():
+        server = storage.servers()
+        token, nonce = server.tokens.issue(list(address), "client_0a1b2c3d4e5f")
+        await storage.server_verif.insert_one({"network": {"send": list(address)}, "nonce": nonce})
+        ws = connection(("127.0.0.1", 50001))
+        results = [await server.upgrade(ws, request(headers({"resume": token})))]
+        reply = response()
+        server.upgraded(ws, None, reply)
+        server.handshake = "required"
+        results.append(await server.upgrade(connection(("127.0.0.1", 50002)), request(headers({"resume": token}))))
+        return results, reply.headers
+
+    results, replied = asyncio.run(scenario())
+    # 恢复会话时沿用原会话地址，重放的令牌不能代替 TOTP
+    assert results[0] is None and fuselink.decode(replied["X-FuseLink-Address"]) == list(address)
+    assert results[1][0] == HTTPStatus.UNAUTHORIZED
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime as dt, timedelta, timezone
+
+
+def test_unregistered_namespace_waits_for_grace(storage):
+    async def scenario():
+        database = storage.mongo[storage.mongo_database]
+        instance = storage.instances("server", grace=3600)
+        await instance.register()
+        await database[storage.names()["server_data"]].insert_one({"n": 1})
+        await database["clients_read_1a2b3c4d5e6f"].insert_one({"n": 1})
+        await database["server_data_1a2b3c4d5e6f.3"].insert_one({"n": 1})
+        first = await instance.clean()
+        seen = await storage.instance_registry.find_one({"_id": "namespace:1a2b3c4d5e6f"})
+        second = await instance.clean()
+        await storage.instance_registry.update_one(
+            {"_id": "namespace:1a2b3c4d5e6f"}, {"$set": {"seen": dt.now(timezone.utc) - timedelta(seconds=7200)}}
+        )
+        third = await instance.clean()
+        return first, seen, second, sorted(third), sorted(await database.list_collection_names())
+
+    first, seen, second, third, remaining = asyncio.run(scenario())
+    assert first == [] and second == []
+    assert seen is not None
+    assert third == ["clients_read_1a2b3c4d5e6f", "server_data_1a2b3c4d5e6f.3"]
+    assert not any("1a2b3c4d5e6f" in f1 for f1 in remaining)
+    assert any(f1.startswith("server_data_test_") for f1 in remaining)
+
+
+def test_registered_namespace_without_instances_is_dropped_after_grace(storage):
+    async def scenario():
+        database = storage.mongo[storage.mongo_database]
+        instance = storage.instances("client", grace=3600)
+        await database["clients_write_plant_a"].insert_one({"n": 1})
+        await storage.instance_registry.insert_one(
+            {"_id": "namespace:plant_a", "seen": dt.now(timezone.utc) - timedelta(seconds=600)}
+        )
+        kept = await instance.clean()
+        await storage.instance_registry.update_one(
+            {"_id": "namespace:plant_a"}, {"$set": {"seen": dt.now(timezone.utc) - timedelta(seconds=7200)}}
+        )
+        return kept, await instance.clean()
+
+    kept, dropped = asyncio.run(scenario())
+    assert kept == []
+    assert dropped == ["clients_write_plant_a"]
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+import fuselink
+from conftest import socket
+
+address = ["127.0.0.1", 50000]
+
+
+def message(n, **fields):
+    return {"utc": 0, "network": {"send": ["127.0.0.1", 40000], "recv": address}, "code": {"n": n}, **fields}
+
+
+def control(n):
+    return message(n, **{"@lane": "control"})
+
+
+def test_lane_only_trusts_the_server_marker():
+    assert fuselink.lane(control(0)) == "control"
+    assert fuselink.lane(message(0)) == "data"
+    assert fuselink.lane(message(0, priority="bulk")) == "bulk"
+    assert fuselink.lane(message(0, priority="control")) == "data"
+    assert fuselink.lane({"code": {"@presence": {"version": 1}}}) == "data"
+    assert fuselink.lane({"code": {"@stream": {"id": "00"}}}) == "bulk"
+    assert fuselink.lane({"code": {"@stream": {"id": "00"}}, "priority": "data"}) == "data"
+
+
+def test_weights_share_the_link(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=1000, low=10, policy="spill")
+        for f1 in range(100):
+            queue.put(control(f1))
+            queue.put(message(f1))
+            queue.put(message(f1, priority="bulk"))
+        return [queue.pick() for f1 in range(13 * 5)], queue
+
+    picks, queue = asyncio.run(scenario())
+    assert [picks.count(f1) for f1 in fuselink.lane_weights] == [40, 20, 5]
+    # 平滑加权轮询把低优先级通道分散在整个周期中，而不是集中在末尾
+    assert picks[:13].count("bulk") == 1 and picks[:13].count("data") == 4
+
+
+def test_custom_weights_and_empty_lanes(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=100, low=10, weights={"control": 1, "data": 1, "bulk": 2})
+        for f1 in range(6):
+            queue.put(message(f1))
+            queue.put(message(f1, priority="bulk"))
+        order = [fuselink.lane(await queue.get()) for f1 in range(12)]
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[:6].count("bulk") == 4 and order[:6].count("data") == 2
+    with pytest.raises(ValueError):
+        fuselink.outbox(address, weights={"data": 1, "bulk": 1})
+
+
+def test_interleave_between_chunks(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=100, low=10)
+        for f1 in range(3):
+            queue.put(message(f1))
+        queue.put(control(9))
+        slots = list()
+        for f1 in range(4):
+            interleaved = queue.interleave("bulk")
+            slots.append(None if interleaved is None else fuselink.lane(interleaved))
+        return slots
+
+    # 每推送一块最多插入按权重轮到的消息，轮到分块传输的通道时返回 None 继续推送下一块
+    slots = asyncio.run(scenario())
+    assert slots[0] == "control" and "data" in slots
+
+
+def test_client_control_priority_counts_against_watermark(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=2, low=1, policy="disconnect")
+        accepted = [queue.put(fuselink.inbound(message(f1, priority="control", **{"@lane": "control"}))) for f1 in range(3)]
+        return accepted, queue.lanes["control"], queue.overflow
+
+    accepted, control_lane, overflow = asyncio.run(scenario())
+    assert accepted == [True, True, False] and not control_lane and overflow
+
+
+def test_batch_strips_control_priority(storage):
+    async def scenario():
+        server = storage.servers()
+        sender, recipient = ["127.0.0.1", 40000], ["127.0.0.1", 50000]
+        for f1 in (sender, recipient):
+            server.registry.add(f1, {"network": {"send": f1}})
+        queue = server.routes.open(recipient)
+        await server.batch({
+            "utc": 0, "network": {"send": sender, "recv": sender},
+            "code": {"@batch": [
+                {"recv": recipient, "code": {"n": 0}, "priority": "control"},
+                {"recv": recipient, "code": {"n": 1}, "priority": "bulk"}
+            ]}
+        })
+        return {f1: [f3["code"]["n"] for f3 in f2] for f1, f2 in queue.lanes.items()}
+
+    assert asyncio.run(scenario()) == {"control": [], "data": [0], "bulk": [1]}
+
+
+def test_presence_push_uses_control_lane_without_leaking_marker(storage):
+    async def scenario():
+        server = storage.servers()
+        ws = socket(tuple(address))
+        queue = server.routes.open(ws.remote_address)
+        server.presence.watchers.add(tuple(address))
+        server.notify({"version": 1, "join": {"network": {"send": address}}}, relay=False)
+        lanes = {f1: len(f2) for f1, f2 in queue.lanes.items()}
+        await server.deliver(ws, queue.take(queue.pick()), queue)
+        return lanes, ws.messages()
+
+    lanes, messages = asyncio.run(scenario())
+    assert lanes == {"control": 1, "data": 0, "bulk": 0}
+    assert "@presence" in messages[0]["code"] and "@lane" not in messages[0]
+
+
+def test_dictionary_frame_is_namespaced(monkeypatch):
+    zstandard = pytest.importorskip("zstandard")
+    monkeypatch.setattr(fuselink, "adaptive", fuselink.compressor())
+    samples = [fuselink.encode(message(f1) | {"code": {"n": f1, "text": F"sample {f1 * 7919}"}}).encode() for f1 in range(500)]
+    dictionary = zstandard.train_dictionary(2048, samples)
+    installed = fuselink.unpack(b"\x02" + dictionary.as_bytes(), "fuselink.json+zstd")
+    assert list(installed) == ["@zstd"] and installed["@zstd"] in fuselink.adaptive.dictionaries
+
+
+def test_client_keeps_data_messages_mentioning_zstd(storage):
+    async def scenario():
+        ws = socket(("127.0.0.1", 10000))
+        ws.inbox.append(fuselink.pack({"@zstd": 1}))
+        ws.inbox.append(fuselink.pack(message(0) | {"code": {"@zstd": 1, "n": 0}}))
+        client = storage.clients()
+        await client.recv(ws)
+        skipped = await storage.client_read.count_documents({})
+        await client.recv(ws)
+        return skipped, await storage.client_read.find({}, {"_id": 0, "code": 1}).to_list(length=None)
+
+    skipped, stored = asyncio.run(scenario())
+    assert skipped == 0 and stored == [{"code": {"@zstd": 1, "n": 0}}]
@@ -0,0 +1,50 @@
+import asyncio
+
+import fuselink
+
+
+class collection:
+    """
+    只提供 logs 用到的接口的集合替身，每次 bulk_write 耗时 delay 秒。
+    """
+
+    def __init__(self, delay=0.05):
+        self.full_name = "fuselink.server_log"
+        self.delay = delay
+        self.written = list()
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(self.delay)
+        self.written.extend(f1._doc["n"] for f1 in operations)
+
+
+def test_close_waits_for_in_flight_batch():
+    async def scenario():
+        target = collection()
+        writer = fuselink.logs(size=2, interval=10.0)
+        writer.start()
+        for f1 in range(2):
+            writer.insert(target, {"n": f1})
+        await asyncio.sleep(0.01)
+        in_flight = not writer.queue and not target.written
+        writer.insert(target, {"n": 2})
+        await writer.close()
+        return in_flight, target.written
+
+    assert asyncio.run(scenario()) == (True, [0, 1, 2])
+
+
+def test_cancelled_task_still_writes_its_batch():
+    async def scenario():
+        target = collection()
+        writer = fuselink.logs(size=2, interval=10.0)
+        writer.start()
+        for f1 in range(2):
+            writer.insert(target, {"n": f1})
+        await asyncio.sleep(0.01)
+        writer.task.cancel()
+        await asyncio.sleep(0)
+        await writer.close()
+        return target.written
+
+    assert asyncio.run(scenario()) == [0, 1]
@@ -0,0 +1,50 @@
+import asyncio
+
+import fuselink
+
+
+def test_cached_gauge_shares_one_read():
+    async def scenario():
+        telemetry = fuselink.metrics()
+        calls = list()
+
+        async def backlog():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return {(("peer", "127.0.0.1:1"),): len(calls)}
+
+        telemetry.gauge("fuselink_pending_messages", backlog, 60.0)
+        telemetry.gauge("fuselink_sessions", lambda: len(calls))
+        rendered = await asyncio.gather(*(telemetry.render() for f1 in range(5)))
+        rendered.append(await telemetry.render())
+        return calls, rendered
+
+    calls, rendered = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all('fuselink_pending_messages{peer="127.0.0.1:1"} 1' in f1 for f1 in rendered)
+
+
+def test_listener_serves_only_the_metrics_path():
+    async def fetch(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(F"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def scenario():
+        telemetry = fuselink.metrics()
+        telemetry.gauge("fuselink_sessions", lambda: 3)
+        server = await telemetry.listen(port=0)
+        port = server.sockets[0].getsockname()[1]
+        responses = await fetch(port, "/metrics?x=1"), await fetch(port, "/other")
+        server.close()
+        return responses
+
+    found, missing = asyncio.run(scenario())
+    assert found.startswith(b"HTTP/1.1 200 OK") and b"fuselink_sessions 3" in found
+    assert missing.startswith(b"HTTP/1.1 404")
+
+
+def test_metrics_are_off_by_default():
+    assert fuselink.servers().metrics is None
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import fuselink
+
+address = ["127.0.0.1", 50000]
+
+
+def message(n):
+    return {"utc": 0, "network": {"send": ["127.0.0.1", 40000], "recv": address}, "code": {"n": n}}
+
+
+async def drain(queue, count):
+    return [(await asyncio.wait_for(queue.get(), 1.0))["code"]["n"] for f1 in range(count)]
+
+
+def test_watermarks_toggle_writable(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=3, low=1, policy="spill")
+        states = list()
+        for f1 in range(3):
+            queue.put(message(f1))
+            states.append(queue.writable.is_set())
+        await queue.get()
+        states.append(queue.writable.is_set())
+        await queue.get()
+        states.append(queue.writable.is_set())
+        return states
+
+    assert asyncio.run(scenario()) == [True, True, False, False, True]
+
+
+def test_spill_keeps_order_across_reload(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=4, low=1, policy="spill")
+        accepted = [queue.put(message(f1)) for f1 in range(10)]
+        depth = len(queue)
+        delivered = await drain(queue, 10)
+        return accepted, depth, queue.spills, delivered, queue.spilled
+
+    accepted, depth, spills, delivered, spilled = asyncio.run(scenario())
+    assert all(accepted)
+    assert depth == 4 and spills == 6
+    assert delivered == list(range(10))
+    assert not spilled
+
+
+def test_messages_follow_unreloaded_backlog(storage):
+    """
+    连接时积压超过高水位的消息未全部取回前，drop_old 不丢弃消息，新消息写入 server_data 并排在积压之后。
+    """
+    async def scenario():
+        await storage.server_data.insert_many([{**message(f1), "date": None} for f1 in range(6)])
+        queue = storage.outbox(address, high=4, low=1, policy="drop_old")
+        await queue.reload()
+        spilled = queue.spilled
+        queue.put(message(6))
+        return spilled, len(queue), await drain(queue, 7), queue.dropped
+
+    spilled, depth, delivered, dropped = asyncio.run(scenario())
+    assert spilled
+    assert depth == 4
+    assert delivered == list(range(7))
+    assert dropped == 0
+
+
+def test_drop_old_evicts_oldest_above_high(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=2, low=1, policy="drop_old")
+        accepted = [queue.put(message(f1)) for f1 in range(4)]
+        return accepted, queue.dropped, await drain(queue, 2)
+
+    accepted, dropped, delivered = asyncio.run(scenario())
+    assert all(accepted)
+    assert dropped == 2
+    assert delivered == [2, 3]
+
+
+def test_disconnect_overflows_above_high(storage):
+    async def scenario():
+        queue = storage.outbox(address, high=2, low=1, policy="disconnect")
+        accepted = [queue.put(message(f1)) for f1 in range(3)]
+        with pytest.raises(OverflowError):
+            await queue.get()
+        return accepted
+
+    assert asyncio.run(scenario()) == [True, True, False]
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        fuselink.outbox(address, policy="unbounded")
@@ -0,0 +1,76 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+
+def device(port):
+    return {
+        "utc": 0, "network": {"send": ["127.0.0.1", port]}, "code": {"name": F"device {port}"},
+        "verif": {"exec": {"parameters": {"type": "client_0a1b2c3d4e5f", "secret": "hidden"}}, "res": {"verif": True}}
+    }
+
+
+def test_versions_and_deltas():
+    devices = fuselink.presence()
+    devices.join(["127.0.0.1", 1], device(1))
+    devices.join(["127.0.0.1", 2], device(2))
+    left = devices.leave(["127.0.0.1", 1])
+    assert left == {"version": 3, "leave": ["127.0.0.1", 1]} and devices.leave(["127.0.0.1", 1]) is None
+    delta = devices.since(1, devices.epoch)
+    assert delta["version"] == 3 and [f1["version"] for f1 in delta["delta"]] == [2, 3]
+    assert devices.since(3, devices.epoch)["delta"] == []
+    # 摘要不包含验证参数中的密钥
+    assert devices.table[("127.0.0.1", 2)]["verif"]["exec"]["parameters"] == {"type": "client_0a1b2c3d4e5f"}
+
+
+def test_snapshot_when_delta_is_unavailable():
+    devices = fuselink.presence(history=2)
+    for f1 in range(4):
+        devices.join(["127.0.0.1", f1], device(f1))
+    # 首次订阅、来自重启前的版本号、超出变更历史或超前的版本号都返回快照
+    for f1, f2 in ((0, devices.epoch), (3, "other epoch"), (1, devices.epoch), (9, devices.epoch)):
+        assert "snapshot" in devices.since(f1, f2)
+    assert len(devices.since(0)["snapshot"]) == 4
+    assert [f1["version"] for f1 in devices.since(2, devices.epoch)["delta"]] == [3, 4]
+
+
+def test_merge_renumbers_remote_changes():
+    local, remote = fuselink.presence(), fuselink.presence()
+    local.join(["127.0.0.1", 1], device(1))
+    merged = local.merge(remote.join(["127.0.0.1", 2], device(2)))
+    assert merged["version"] == 2 and ("127.0.0.1", 2) in local.table
+    assert local.merge(remote.leave(["127.0.0.1", 2])) == {"version": 3, "leave": ["127.0.0.1", 2]}
+    assert local.merge({"version": 9, "leave": ["127.0.0.1", 9]}) is None and local.version == 3
+
+
+def test_client_subscribes_once_and_applies_updates(storage):
+    devices = fuselink.presence()
+    devices.join(["127.0.0.1", 1], device(1))
+    devices.join(["127.0.0.1", 2], device(2))
+
+    def pushed(update):
+        return fuselink.pack({"utc": 0, "network": {"send": ["127.0.0.1", 3], "recv": ["127.0.0.1", 3]}, "code": {"@presence": update}})
+
+    async def scenario():
+        client = storage.clients()
+        ws = socket(("127.0.0.1", 10000))
+        base = {"utc": 0, "network": {"send": ["127.0.0.1", 3], "recv": ["127.0.0.1", 3]}}
+        for f1 in range(2):
+            await storage.client_write.insert_one({"@device": None})
+            await client.forward(ws, base)
+        requests = [f1["code"] for f1 in ws.messages()]
+        snapshot = devices.since(0)
+        stale = devices.since(1, devices.epoch)
+        delta = {"version": 3, "epoch": devices.epoch, "delta": [devices.leave(["127.0.0.1", 1])]}
+        # 快照之后到达的旧增量被忽略，新增量只删除下线的设备
+        ws.inbox.extend([pushed(snapshot), pushed(stale), pushed(delta)])
+        for f1 in range(3):
+            await client.recv(ws)
+        mirrored = await storage.client_device.find({}, {"_id": 0}).to_list(length=None)
+        return requests, (client.version, client.epoch), mirrored
+
+    requests, known, mirrored = asyncio.run(scenario())
+    assert requests == [{"@presence": {"version": 0, "epoch": None}}]
+    assert known == (3, devices.epoch)
+    assert [f1["network"]["send"] for f1 in mirrored] == [["127.0.0.1", 2]]
@@ -0,0 +1,48 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+sender = ["127.0.0.1", 40000]
+recipient = ["127.0.0.1", 50000]
+
+
+def test_add_remove_and_verified(storage):
+    async def scenario():
+        sessions = storage.registry()
+        sessions.add(sender, {"network": {"send": sender}})
+        added = await sessions.verified(tuple(sender)), await sessions.verified(recipient)
+        sessions.remove(sender)
+        sessions.remove(sender)
+        return added, await sessions.verified(sender)
+
+    assert asyncio.run(scenario()) == ((True, False), False)
+
+
+def test_shared_and_load_fall_back_to_server_verif(storage):
+    async def scenario():
+        await storage.server_verif.insert_one({"network": {"send": recipient}, "code": None})
+        local, shared = storage.registry(), storage.registry(shared=True)
+        checks = await local.verified(recipient), await shared.verified(recipient), await shared.verified(sender)
+        return checks, await local.load(), local.table
+
+    checks, loaded, table = asyncio.run(scenario())
+    assert checks == (False, True, False)
+    assert loaded == 1 and table[tuple(recipient)] == {"network": {"send": recipient}, "code": None}
+
+
+def test_recv_requires_both_sides_registered(storage):
+    async def scenario():
+        server = storage.servers()
+        server.registry.add(sender, {"network": {"send": sender}})
+        ws = socket(tuple(sender))
+        document = {"utc": 0, "network": {"send": sender, "recv": recipient}, "code": {"n": 0}}
+        ws.inbox.append(fuselink.pack(document))
+        await server.recv(ws)
+        server.registry.add(recipient, {"network": {"send": recipient}})
+        ws.inbox.append(fuselink.pack(document))
+        await server.recv(ws)
+        stored = await storage.server_data.collections[0].count_documents({})
+        return [f1["code"]["status"] for f1 in ws.messages()], stored
+
+    assert asyncio.run(scenario()) == ([False, True], 1)
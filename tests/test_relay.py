@@ -0,0 +1,142 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+
+class table:
+    """
+    只提供 relay 用到的已登记地址的路由表替身。
+    """
+
+    def __init__(self, *addresses):
+        self.table = {tuple(f1): None for f1 in addresses}
+
+
+async def started(paths, index, secret, received, addresses=()):
+    channel = fuselink.relay(index, paths, secret, timeout=1.0)
+    await channel.start(table(*addresses), lambda message: received.append(message) or asyncio.sleep(0), timeout=2.0)
+    return channel
+
+
+def test_relay_links_authenticated_peers(tmp_path):
+    async def scenario():
+        paths = [str(tmp_path / "worker_0.sock"), str(tmp_path / "worker_1.sock")]
+        received = list()
+        first, second = await asyncio.gather(
+            started(paths, 0, "secret", received, [["10.0.0.1", 1]]), started(paths, 1, "secret", received, [["10.0.0.2", 2]])
+        )
+        await asyncio.sleep(0.1)
+        pushed = first.push(["10.0.0.2", 2], {"code": {"n": 1}})
+        await asyncio.sleep(0.1)
+        owners = dict(first.owners), dict(second.owners)
+        await first.close(), await second.close()
+        return pushed, owners, received
+
+    pushed, owners, received = asyncio.run(scenario())
+    assert pushed
+    assert owners == ({("10.0.0.2", 2): 1}, {("10.0.0.1", 1): 0})
+    assert {"push": ["10.0.0.2", 2], "document": {"code": {"n": 1}}} in received
+
+
+def test_relay_rejects_connections_without_proof(tmp_path):
+    async def forge(path, message):
+        reader, writer = await asyncio.open_unix_connection(path)
+        challenge = fuselink.decode(await reader.readline())["challenge"]
+        writer.write(fuselink.encode({**message, "challenge": challenge}).encode("UTF-8") + b"\n")
+        writer.write(fuselink.encode({"worker": 1, "own": [["10.0.0.9", 9]]}).encode("UTF-8") + b"\n")
+        await writer.drain()
+        closed = await asyncio.wait_for(reader.read(), 2.0)
+        writer.close()
+        return closed
+
+    async def scenario():
+        paths = [str(tmp_path / "worker_0.sock"), str(tmp_path / "worker_1.sock")]
+        received = list()
+        channel = await started(paths, 0, "secret", received)
+        impostor = fuselink.relay(1, paths, "other secret")
+        results = [
+            await forge(paths[0], {"worker": 1, "own": [["10.0.0.9", 9]]}),
+            await forge(paths[0], {"worker": 1, "proof": impostor.proof(b"\0" * 16, 1), "own": [["10.0.0.9", 9]]}),
+            await forge(paths[0], {"worker": 0, "proof": "", "presence": {"join": {}}})
+        ]
+        owners = dict(channel.owners)
+        await channel.close()
+        return results, owners, received
+
+    results, owners, received = asyncio.run(scenario())
+    assert results == [b"", b"", b""]
+    assert owners == dict()
+    assert received == list()
+
+
+def test_relay_proof_binds_worker_index():
+    channel = fuselink.relay(0, ["a", "b", "c"], "secret")
+    challenge = b"\1" * 16
+    assert channel.proof(challenge, 1) != channel.proof(challenge, 2)
+    assert channel.proof(challenge, 1) == fuselink.relay(2, ["a", "b", "c"], b"secret").proof(challenge, 1)
+
+
+class writer:
+    """
+    只提供 relay.send 用到的接口的写入端替身，buffered 为写缓冲中尚未发出的字节数。
+    """
+
+    def __init__(self, buffered=0, closing=False, error=None):
+        self.buffered = buffered
+        self.closing = closing
+        self.error = error
+        self.lines = list()
+        self.transport = self
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def is_closing(self):
+        return self.closing
+
+    def write(self, data):
+        if self.error:
+            raise self.error
+        self.lines.append(fuselink.decode(data))
+
+
+def test_relay_push_respects_write_buffer():
+    channel = fuselink.relay(0, ["a", "b"], "secret", buffer=1024)
+    channel.owners = {("10.0.0.2", 2): 1}
+    channel.peers[1] = writer(buffered=1024)
+    assert channel.push(["10.0.0.2", 2], {"code": {"n": 0}})
+    channel.peers[1].buffered = 1025
+    assert not channel.push(["10.0.0.2", 2], {"code": {"n": 1}})
+    # 地址归属不受写缓冲上限约束
+    channel.announce({"own": [["10.0.0.1", 1]]})
+    assert [f1.get("document", f1) for f1 in channel.peers[1].lines] == [{"code": {"n": 0}}, {"own": [["10.0.0.1", 1]]}]
+
+
+def test_relay_push_fails_on_broken_connection():
+    channel = fuselink.relay(0, ["a", "b"], "secret")
+    channel.owners = {("10.0.0.2", 2): 1}
+    channel.peers[1] = writer(closing=True)
+    assert not channel.push(["10.0.0.2", 2], {"code": {}})
+    channel.peers[1] = writer(error=ConnectionResetError("connection reset"))
+    assert not channel.push(["10.0.0.2", 2], {"code": {}})
+
+
+def test_stalled_peer_falls_back_to_server_data(storage):
+    async def scenario():
+        server = storage.servers()
+        channel = fuselink.relay(0, ["a", "b"], "secret", buffer=0)
+        channel.owners = {("10.0.0.2", 2): 1}
+        channel.peers[1] = writer(buffered=1)
+        server.routes.relay = channel
+        for f1 in (["10.0.0.1", 1], ["10.0.0.2", 2]):
+            server.registry.add(f1, {"network": {"send": f1}})
+        ws = socket(("10.0.0.1", 1))
+        ws.inbox.append(fuselink.pack({"utc": 0, "network": {"send": ["10.0.0.1", 1], "recv": ["10.0.0.2", 2]}, "code": {"n": 0}}))
+        await server.recv(ws)
+        stored = await storage.server_data.collections[0].find({}, {"_id": 0, "code": 1}).to_list(length=None)
+        return ws.messages()[0]["code"], stored
+
+    reply, stored = asyncio.run(scenario())
+    assert reply["status"] and "mongo" in reply
+    assert stored == [{"code": {"n": 0}}]
@@ -0,0 +1,96 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+address = ["127.0.0.1", 50000]
+session = ["127.0.0.1", 40000]
+
+
+def message(n, recv=address, **fields):
+    return {"utc": 0, "network": {"send": ["127.0.0.1", 30000], "recv": recv}, "code": {"n": n}, **fields}
+
+
+async def stored(storage):
+    return [
+        f1["code"]["n"] for f1 in await storage.server_data.collections[0].find({}).sort("_id", 1).to_list(length=None)
+    ]
+
+
+def test_push_reaches_registered_queue_only(storage):
+    async def scenario():
+        table = storage.routes()
+        queue = table.open(address)
+        pushed = [table.push(address, message(0)), table.push(["127.0.0.1", 1], message(1))]
+        return pushed, table.get(address) is queue, [f1["code"]["n"] for f1 in queue.lanes["data"]]
+
+    assert asyncio.run(scenario()) == ([True, False], True, [0])
+
+
+def test_alias_shares_queue_and_closes_with_it(storage):
+    async def scenario():
+        table = storage.routes()
+        queue = table.open(address)
+        table.alias(session, queue)
+        table.push(session, message(0, session))
+        depth = len(queue)
+        await table.close(address, queue)
+        return depth, table.get(address), table.get(session)
+
+    assert asyncio.run(scenario()) == (1, None, None)
+
+
+def test_close_persists_queued_messages(storage):
+    async def scenario():
+        table = storage.routes()
+        queue = table.open(address)
+        for f1 in range(3):
+            table.push(address, message(f1))
+        table.push(address, message(3, priority="bulk"))
+        # 已在 server_data 中的消息和控制消息不写回
+        queue.put(message(9, _id=fuselink.ObjectId()))
+        queue.put(message(8, **{"@lane": "control"}))
+        await table.close(address, queue)
+        persisted = await storage.server_data.collections[0].find({}).to_list(length=None)
+        reopened = table.open(address)
+        await reopened.reload()
+        return persisted, {f1: [f3["code"]["n"] for f3 in f2] for f1, f2 in reopened.lanes.items()}
+
+    persisted, delivered = asyncio.run(scenario())
+    assert [f1["code"]["n"] for f1 in persisted] == [0, 1, 2, 3]
+    assert all("date" in f1 for f1 in persisted)
+    assert delivered == {"control": [], "data": [0, 1, 2], "bulk": [3]}
+
+
+def test_close_hands_over_to_resumed_session(storage):
+    async def scenario():
+        table = storage.routes()
+        previous = table.open(session)
+        table.push(session, message(0, session))
+        resumed = table.open(address)
+        table.alias(session, resumed)
+        await table.close(session, previous)
+        return table.get(session) is resumed, [f1["code"]["n"] for f1 in resumed.lanes["data"]], await stored(storage)
+
+    assert asyncio.run(scenario()) == (True, [0], [])
+
+
+def test_failed_delivery_is_written_back(storage):
+    class broken(socket):
+        async def send(self, frame):
+            raise ConnectionError("connection lost")
+
+    async def scenario():
+        server = storage.servers()
+        ws = broken(tuple(address))
+        failures = 0
+        for f1 in (message(0), message(1, _id=fuselink.ObjectId()), message(2, **{"@lane": "control"})):
+            try:
+                await server.deliver(ws, f1)
+            except ConnectionError:
+                failures += 1
+        return failures, await storage.server_data.collections[0].find({}, {"_id": 0}).to_list(length=None)
+
+    failures, persisted = asyncio.run(scenario())
+    assert failures == 3
+    assert [f1["code"] for f1 in persisted] == [{"n": 0}] and "date" in persisted[0]
@@ -0,0 +1,76 @@
+import asyncio
+
+import fuselink
+
+
+def message(recv, n):
+    return {"utc": 0, "network": {"send": ["127.0.0.1", 40000], "recv": recv}, "code": {"n": n}}
+
+
+def spread(server_data, count):
+    """
+    取 count 个分别位于不同分区的地址。
+    """
+    found = dict()
+    for f1 in range(50000, 51000):
+        found.setdefault(server_data.index(["127.0.0.1", f1]), ["127.0.0.1", f1])
+        if len(found) == count:
+            return list(found.values())
+    raise AssertionError("地址没有覆盖所需的分区")
+
+
+def test_single_partition_keeps_name(storage):
+    server_data = fuselink.shards("server_data_x")
+    assert [f1.name for f1 in server_data.collections] == ["server_data_x"]
+    assert server_data.index(["127.0.0.1", 50000]) == 0
+
+
+def test_index_is_stable_and_routes(storage):
+    server_data = fuselink.shards("server_data_x", 4)
+    assert [f1.name for f1 in server_data.collections] == [F"server_data_x.{f1}" for f1 in range(4)]
+    addresses = [["127.0.0.1", 50000 + f1] for f1 in range(64)]
+    indexes = [server_data.index(f1) for f1 in addresses]
+    assert indexes == [fuselink.shards("server_data_x", 4).index(f1) for f1 in addresses]
+    assert set(indexes) == {0, 1, 2, 3}
+    assert all(server_data.locate(f1) is server_data.collections[f2] for f1, f2 in zip(addresses, indexes))
+    routed = server_data.route(addresses)
+    assert sorted(f3 for f1, f2 in routed for f3 in f2) == sorted(addresses)
+    assert all(server_data.locate(f3) is f1 for f1, f2 in routed for f3 in f2)
+
+
+def test_insert_and_delete_across_partitions(storage):
+    async def scenario():
+        server_data = fuselink.shards("server_data_x", 4)
+        recipients = spread(server_data, 4)
+        documents = [message(recipients[f1 % 4], f1) for f1 in range(8)]
+        result = await server_data.insert_many(documents)
+        placed = [
+            [(f2["_id"], f2["code"]["n"]) for f2 in await f1.find({}).to_list(length=None)]
+            for f1 in server_data.collections
+        ]
+        deleted = await server_data.delete_many({"network.send": ["127.0.0.1", 40000]})
+        remaining = [await f1.count_documents({}) for f1 in server_data.collections]
+        return documents, result.inserted_ids, recipients, server_data, placed, deleted.deleted_count, remaining
+
+    documents, inserted_ids, recipients, server_data, placed, deleted, remaining = asyncio.run(scenario())
+    assert inserted_ids == [f1["_id"] for f1 in documents]
+    for f1, f2 in enumerate(recipients):
+        assert placed[server_data.index(f2)] == [(documents[f3]["_id"], f3) for f3 in (f1, f1 + 4)]
+    assert deleted == 8 and remaining == [0, 0, 0, 0]
+
+
+def test_outbox_reload_merges_partitions(storage):
+    async def scenario():
+        storage.partition(4)
+        address, alias = spread(storage.server_data, 2)
+        for f1 in range(6):
+            await storage.server_data.insert_one(message([address, alias][f1 % 2], f1))
+        queue = storage.outbox(address, high=4, low=1, policy="spill")
+        queue.aliases.append(alias)
+        await queue.reload()
+        first = [queue.take(queue.pick())["code"]["n"] for f1 in range(len(queue))]
+        await queue.reload()
+        second = [queue.take(queue.pick())["code"]["n"] for f1 in range(len(queue))]
+        return first, second
+
+    assert asyncio.run(scenario()) == ([0, 1, 2, 3], [4, 5])
@@ -0,0 +1,239 @@
+import asyncio
+from datetime import datetime as dt, timedelta, timezone
+
+import pytest
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import OperationFailure, DuplicateKeyError
+
+from storage_embedded import embedded
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def client(request, tmp_path):
+    """
+    内存存储和 SQLite 存储各执行一遍用例。
+    """
+    uri = "memory://" if request.param == "memory" else F"sqlite:///{tmp_path / 'embedded.db'}"
+    client = embedded(uri)
+    yield client
+    client.close()
+
+
+def run(client, scenario):
+    return asyncio.run(scenario(client["test"]["items"]))
+
+
+async def seeded(collection):
+    await collection.insert_many([
+        {"_id": 1, "name": "a", "size": 3, "tags": ["x", "y"], "network": {"send": ["h", 1]}},
+        {"_id": 2, "name": "b", "size": 5, "tags": ["y"], "network": {"send": ["h", 2]}},
+        {"_id": 3, "name": "c", "size": 7, "tags": [], "extra": None},
+        {"_id": 4, "name": "d"},
+    ])
+    return collection
+
+
+async def ids(collection, query):
+    return [f1["_id"] for f1 in await collection.find(query).sort("_id", 1).to_list(length=None)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"name": "a"}, [1]),
+    ({"name": {"$eq": "b"}}, [2]),
+    ({"name": {"$ne": "b"}}, [1, 3, 4]),
+    ({"name": {"$in": ["a", "c", "z"]}}, [1, 3]),
+    ({"name": {"$nin": ["a", "c"]}}, [2, 4]),
+    ({"size": {"$gt": 3}}, [2, 3]),
+    ({"size": {"$gte": 5}}, [2, 3]),
+    ({"size": {"$lt": 5}}, [1]),
+    ({"size": {"$lte": 5}}, [1, 2]),
+    ({"size": {"$gt": 3, "$lt": 7}}, [2]),
+    ({"size": {"$gt": "3"}}, []),
+    ({"size": {"$exists": False}}, [4]),
+    ({"extra": {"$exists": True}}, [3]),
+    ({"extra": None}, [1, 2, 3, 4]),
+    ({"size": None}, [4]),
+    ({"tags": "y"}, [1, 2]),
+    ({"tags": ["y"]}, [2]),
+    ({"tags.1": "y"}, [1]),
+    ({"network.send": ["h", 2]}, [2]),
+    ({"network.send.1": 1}, [1]),
+    ({"network": {"send": ["h", 1]}}, [1]),
+    ({"$and": [{"size": {"$gt": 3}}, {"tags": "y"}]}, [2]),
+    ({"$or": [{"name": "a"}, {"size": 7}]}, [1, 3]),
+    ({"$nor": [{"name": "a"}, {"size": 7}]}, [2, 4]),
+    ({"_id": {"$in": [2, 4, 9]}}, [2, 4]),
+])
+def test_query_operators(client, query, expected):
+    async def scenario(collection):
+        return await ids(await seeded(collection), query)
+    assert run(client, scenario) == expected
+
+
+def test_unsupported_operators(client):
+    async def scenario(collection):
+        await seeded(collection)
+        with pytest.raises(OperationFailure):
+            await collection.count_documents({"name": {"$regex": "a"}})
+        with pytest.raises(OperationFailure):
+            await collection.update_one({"_id": 1}, {"$push": {"tags": "z"}})
+        with pytest.raises(OperationFailure):
+            await collection.aggregate([{"$unwind": "$tags"}]).to_list(length=None)
+        with pytest.raises(OperationFailure):
+            await collection.aggregate([{"$group": {"_id": None, "n": {"$avg": "$size"}}}]).to_list(length=None)
+        with pytest.raises(OperationFailure):
+            await collection.bulk_write([object()])
+    run(client, scenario)
+
+
+def test_update_operators(client):
+    async def scenario(collection):
+        await seeded(collection)
+        result = await collection.update_one({"_id": 1}, {
+            "$set": {"name": "A", "meta.level": 2}, "$unset": {"tags": ""}, "$inc": {"size": 2, "hits": 1},
+            "$setOnInsert": {"created": True}
+        })
+        assert (result.matched_count, result.modified_count, result.upserted_id) == (1, 1, None)
+        assert await collection.find_one({"_id": 1}) == {
+            "_id": 1, "name": "A", "size": 5, "network": {"send": ["h", 1]}, "meta": {"level": 2}, "hits": 1
+        }
+        result = await collection.update_many({"size": {"$gte": 5}}, {"$inc": {"size": -1}})
+        assert result.matched_count == 3
+        assert [f1.get("size") for f1 in await collection.find({}).sort("_id", 1).to_list(length=None)] == [4, 4, 6, None]
+    run(client, scenario)
+
+
+def test_upsert(client):
+    async def scenario(collection):
+        query = {"$and": [{"network": {"send": ["e", 5]}}, {"code": {"k": 1}}], "kind": {"$eq": "u"}, "size": {"$gt": 1}}
+        result = await collection.update_one(query, {"$set": {"utc": 1}, "$setOnInsert": {"first": 1}}, upsert=True)
+        assert result.matched_count == 0 and result.upserted_id is not None
+        result = await collection.update_one(query | {"size": {"$exists": False}}, {"$set": {"utc": 2}, "$setOnInsert": {"first": 2}}, upsert=True)
+        assert result.matched_count == 1 and result.upserted_id is None
+        assert await collection.find_one({}, {"_id": 0}) == {
+            "network": {"send": ["e", 5]}, "code": {"k": 1}, "kind": "u", "utc": 2, "first": 1
+        }
+        result = await collection.replace_one({"_id": "r"}, {"v": 1}, upsert=True)
+        assert result.upserted_id == "r"
+        await collection.replace_one({"_id": "r"}, {"v": 2})
+        assert await collection.find_one({"_id": "r"}) == {"_id": "r", "v": 2}
+    run(client, scenario)
+
+
+def test_projection_and_cursor(client):
+    async def scenario(collection):
+        await seeded(collection)
+        assert await collection.find_one({"_id": 1}, {"name": 1, "network.send": 1}) == {
+            "_id": 1, "name": "a", "network": {"send": ["h", 1]}
+        }
+        assert await collection.find_one({"_id": 1}, {"_id": 0, "name": 1}) == {"name": "a"}
+        assert await collection.find_one({"_id": 2}, {"_id": 0, "tags": 0, "network": 0}) == {"name": "b", "size": 5}
+        assert await collection.find_one({"_id": 2}, ["name"]) == {"_id": 2, "name": "b"}
+        found = await collection.find({}, {"_id": 1}).sort("size", -1).skip(1).limit(2).to_list(length=None)
+        assert found == [{"_id": 2}, {"_id": 1}]
+        found = await collection.find({}).sort("size", 1).to_list(length=None)
+        assert [f1["_id"] for f1 in found] == [4, 1, 2, 3]
+        assert [f1["_id"] async for f1 in collection.find({"tags": "y"})] == [1, 2]
+        assert len(await collection.find({}).to_list(length=3)) == 3
+    run(client, scenario)
+
+
+def test_aggregate(client):
+    async def scenario(collection):
+        await seeded(collection)
+        await collection.insert_one({"_id": 5, "name": "a", "size": 1})
+        found = await collection.aggregate([
+            {"$match": {"size": {"$exists": True}}},
+            {"$group": {
+                "_id": "$name", "count": {"$sum": 1}, "total": {"$sum": "$size"}, "low": {"$min": "$size"},
+                "high": {"$max": "$size"}, "first": {"$first": "$_id"}, "last": {"$last": "$_id"}, "all": {"$push": "$_id"}
+            }},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$skip": 0},
+            {"$limit": 2},
+            {"$project": {"all": 0}},
+        ]).to_list(length=None)
+        assert found == [
+            {"_id": "a", "count": 2, "total": 4, "low": 1, "high": 3, "first": 1, "last": 5},
+            {"_id": "b", "count": 1, "total": 5, "low": 5, "high": 5, "first": 2, "last": 2},
+        ]
+        assert await collection.aggregate([{"$match": {"tags": "y"}}, {"$count": "n"}]).to_list(length=None) == [{"n": 2}]
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+        assert [f1["name"] for f1 in stats] == ["_id_"]
+    run(client, scenario)
+
+
+def test_collection_methods(client):
+    async def scenario(collection):
+        await seeded(collection)
+        assert await collection.find_one_and_delete({"tags": "y"}, {"_id": 1}, sort=[("size", -1)]) == {"_id": 2}
+        assert await collection.find_one_and_delete({"name": "z"}) is None
+        assert await collection.count_documents({}) == 3
+        assert await collection.count_documents({}, skip=1, limit=1) == 1
+        assert sorted(await collection.distinct("tags")) == ["x", "y"]
+        assert sorted(await collection.distinct("name", {"size": {"$exists": True}})) == ["a", "c"]
+        assert (await collection.delete_one({"size": {"$exists": True}})).deleted_count == 1
+        assert (await collection.delete_many({})).deleted_count == 2
+        await collection.insert_one({"_id": "k"})
+        with pytest.raises(DuplicateKeyError):
+            await collection.insert_one({"_id": "k"})
+        document = {"name": "generated"}
+        result = await collection.insert_one(document)
+        assert document["_id"] == result.inserted_id
+        result = await collection.bulk_write([
+            InsertOne({"_id": "b1", "n": 1}),
+            InsertOne({"_id": "b2", "n": 1}),
+            UpdateOne({"_id": "b1"}, {"$inc": {"n": 1}}),
+            UpdateMany({"n": {"$gte": 1}}, {"$set": {"seen": True}}),
+            UpdateOne({"_id": "b3"}, {"$set": {"n": 3}}, upsert=True),
+            ReplaceOne({"_id": "b2"}, {"n": 9}),
+            DeleteOne({"_id": "b3"}),
+            DeleteMany({"_id": {"$in": ["k", "missing"]}}),
+        ])
+        assert (result.inserted_count, result.upserted_count, result.matched_count, result.deleted_count) == (2, 1, 4, 2)
+        assert await collection.find({"_id": {"$in": ["b1", "b2"]}}, {"_id": 0}).sort("_id", 1).to_list(length=None) == [
+            {"n": 2, "seen": True}, {"n": 9}
+        ]
+    run(client, scenario)
+
+
+def test_ttl_index(client):
+    async def scenario(collection):
+        now = dt.now(timezone.utc)
+        await collection.create_index([("date", 1)], name="date_ttl", expireAfterSeconds=60)
+        await collection.insert_many([{"_id": 1, "date": now - timedelta(seconds=120)}, {"_id": 2, "date": now}, {"_id": 3}])
+        assert await collection.call(collection.expire, True) == 1
+        await client["test"].command("collMod", "items", index={"name": "date_ttl", "expireAfterSeconds": 0})
+        await collection.call(collection.expire, True)
+        assert await ids(collection, {}) == [3]
+        await client["test"].drop_collection("items")
+        assert "items" not in await client["test"].list_collection_names()
+    run(client, scenario)
+
+
+def test_shared_ttl(tmp_path):
+    """
+    一个进程创建的 TTL 索引对共享同一 SQLite 文件的其他客户端同样生效，索引表不作为集合列出。
+    """
+    uri = F"sqlite:///{tmp_path / 'shared.db'}"
+    owner, other = embedded(uri), embedded(uri)
+
+    async def scenario():
+        await owner["test"]["items"].create_index([("date", 1)], name="date_ttl", expireAfterSeconds=60)
+        collection = other["test"]["items"]
+        await collection.insert_one({"_id": 1, "date": dt.now(timezone.utc) - timedelta(seconds=120)})
+        await collection.insert_one({"_id": 2, "date": dt.now(timezone.utc)})
+        assert await other.call(collection.expire, True) == 1
+        await owner["test"].command("collMod", "items", index={"name": "date_ttl", "expireAfterSeconds": 0})
+        assert await other.call(collection.expire, True) == 1
+        assert [f1["name"] for f1 in await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)] == ["_id_", "date_ttl"]
+        assert await other["test"].list_collection_names() == ["items"]
+        await owner["test"].drop_collection("items")
+        assert await other.call(collection.expire, True) == 0
+        assert other["test"]["items"].ttl == dict()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        owner.close()
+        other.close()
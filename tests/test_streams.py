@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+from os import listdir
+from uuid import uuid1
+
+import pytest
+
+import fuselink
+from conftest import socket
+
+owner = ("127.0.0.1", 50000)
+other = ("127.0.0.1", 50001)
+
+
+def start(stream_id, size):
+    return {
+        "utc": 0,
+        "network": {"send": list(owner), "recv": list(other)},
+        "code": {"@stream": {"id": stream_id.hex(), "name": "data.bin", "size": size}}
+    }
+
+
+def frame(stream_id, seq, data, last=False):
+    return fuselink.chunk_header.pack(fuselink.chunk_magic, stream_id, seq, int(last)) + data
+
+
+def test_reassembles_and_sends_back(tmp_path):
+    content = bytes(range(256)) * 5
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        spool = fuselink.spools(chunk=300, store="disk", directory=str(tmp_path))
+        upload = await spool.open(owner, start(stream_id, len(content)))
+        parts = [content[f1:f1 + 300] for f1 in range(0, len(content), 300)]
+        spills = [await spool.write(upload, frame(stream_id, f1, f2, f1 == len(parts) - 1)) for f1, f2 in enumerate(parts)]
+        ws = socket(other)
+        await spool.send(ws, {"id": stream_id.hex(), "size": len(content)}, spills[-1])
+        return spool, upload, spills, ws.frames
+
+    spool, upload, spills, frames = asyncio.run(scenario())
+    assert spills[:-1] == [None] * (len(spills) - 1) and not spool.uploads
+    with open(spills[-1]["disk"], "rb") as f:
+        assert f.read() == content
+    assert upload["digest"].hexdigest() == hashlib.sha256(content).hexdigest()
+    headers = [fuselink.chunk_header.unpack_from(f1) for f1 in frames]
+    assert [f1[2] for f1 in headers] == list(range(len(frames))) and [f1[3] for f1 in headers][-1] == 1
+    assert b"".join(f1[fuselink.chunk_header.size:] for f1 in frames) == content
+
+
+def test_out_of_order_chunk_and_abort(tmp_path):
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        spool = fuselink.spools(store="disk", directory=str(tmp_path))
+        upload = await spool.open(owner, start(stream_id, 8))
+        await spool.write(upload, frame(stream_id, 0, b"abcd"))
+        with pytest.raises(ValueError):
+            await spool.write(upload, frame(stream_id, 2, b"efgh", True))
+        partial = listdir(tmp_path)
+        await spool.abort(upload)
+        return spool, partial
+
+    spool, partial = asyncio.run(scenario())
+    assert len(partial) == 1 and partial[0].endswith(".part")
+    assert listdir(tmp_path) == [] and not spool.uploads
+
+
+def test_limit_rejects_oversized_streams(tmp_path):
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        spool = fuselink.spools(limit=6, store="disk", directory=str(tmp_path))
+        with pytest.raises(ValueError):
+            await spool.open(owner, start(stream_id, 7))
+        upload = await spool.open(owner, start(stream_id, 0))
+        await spool.write(upload, frame(stream_id, 0, b"abcd"))
+        with pytest.raises(ValueError):
+            await spool.write(upload, frame(stream_id, 1, b"efgh", True))
+
+    asyncio.run(scenario())
+
+
+def test_stream_id_belongs_to_its_owner(tmp_path):
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        spool = fuselink.spools(store="disk", directory=str(tmp_path))
+        upload = await spool.open(owner, start(stream_id, 8))
+        await spool.write(upload, frame(stream_id, 0, b"abcd"))
+        with pytest.raises(PermissionError):
+            await spool.open(other, start(stream_id, 8))
+        kept = spool.uploads[stream_id] is upload
+        await spool.release(other)
+        kept = kept and spool.uploads[stream_id] is upload
+        restarted = await spool.open(owner, start(stream_id, 8))
+        spill = await spool.write(restarted, frame(stream_id, 0, b"wxyz", True))
+        await spool.release(owner)
+        return kept, spill
+
+    kept, spill = asyncio.run(scenario())
+    assert kept
+    with open(spill["disk"], "rb") as f:
+        assert f.read() == b"wxyz"
+    assert listdir(tmp_path) == [spill["disk"].rsplit("/", 1)[-1]]
+
+
+def test_completed_streams_with_same_id_do_not_overwrite(tmp_path):
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        spool = fuselink.spools(store="disk", directory=str(tmp_path))
+        spills = list()
+        for f1, f2 in ((owner, b"mine"), (other, b"evil")):
+            upload = await spool.open(f1, start(stream_id, 4))
+            spills.append(await spool.write(upload, frame(stream_id, 0, f2, True)))
+        return spills
+
+    first, second = asyncio.run(scenario())
+    assert first["disk"] != second["disk"]
+    with open(first["disk"], "rb") as f:
+        assert f.read() == b"mine"
+
+
+def test_chunk_ignores_frames_from_other_connections(storage, tmp_path):
+    stream_id = uuid1().bytes
+
+    async def scenario():
+        server = storage.servers()
+        server.spools = fuselink.spools(store="disk", directory=str(tmp_path))
+        upload = await server.spools.open(owner, start(stream_id, 4))
+        intruder = socket(other)
+        await server.chunk(intruder, frame(stream_id, 0, b"evil", True))
+        return upload, intruder.frames
+
+    upload, frames = asyncio.run(scenario())
+    assert upload["seq"] == 0 and frames == []
+
+
+def test_inbound_strips_server_fields():
+    message_data = {
+        "utc": 0, "network": {"send": list(owner), "recv": list(other)}, "code": {"@stream": {"id": "00"}},
+        "_id": "6650f1c2e4b0a1b2c3d4e5f6", "date": 0, "@spill": {"disk": "/etc/passwd"}, "@queued": 0, "priority": "bulk"
+    }
+    assert fuselink.inbound(message_data) == {
+        "utc": 0, "network": {"send": list(owner), "recv": list(other)}, "code": {"@stream": {"id": "00"}}, "priority": "bulk"
+    }
@@ -0,0 +1,94 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+
+def test_sweep_waits_for_grace_and_batches():
+    batches = list()
+
+    async def callback(batch):
+        batches.append(batch)
+
+    async def scenario():
+        cleanup = fuselink.sweeper(callback, grace=30.0, size=2)
+        now = fuselink.time()
+        for f1 in range(5):
+            cleanup.defer(("127.0.0.1", 50000 + f1))
+        assert await cleanup.sweep(now + 29) == 0
+        return cleanup, await cleanup.sweep(now + 31)
+
+    cleanup, count = asyncio.run(scenario())
+    assert count == 5 and cleanup.swept == 5 and not cleanup.pending
+    assert [len(f1) for f1 in batches] == [2, 2, 1]
+    assert sorted(f2 for f1 in batches for f2 in f1) == [("127.0.0.1", 50000 + f1) for f1 in range(5)]
+
+
+def test_defer_again_postpones_and_cancel_keeps_session():
+    batches = list()
+
+    async def callback(batch):
+        batches.append(batch)
+
+    async def scenario():
+        cleanup = fuselink.sweeper(callback, grace=10.0)
+        now = fuselink.time()
+        cleanup.defer(["127.0.0.1", 50000])
+        cleanup.defer(["127.0.0.1", 50001])
+        cleanup.defer(["127.0.0.1", 50002])
+        cleanup.defer(["127.0.0.1", 50001], 60.0)
+        assert cleanup.cancel(["127.0.0.1", 50002])
+        assert not cleanup.cancel(["127.0.0.1", 50003])
+        await cleanup.sweep(now + 11)
+        first = list(batches)
+        await cleanup.sweep(now + 61)
+        return first
+
+    first = asyncio.run(scenario())
+    assert first == [[("127.0.0.1", 50000)]]
+    assert batches == [[("127.0.0.1", 50000)], [("127.0.0.1", 50001)]]
+
+
+def test_failed_cleanup_is_counted():
+    async def callback(batch):
+        raise RuntimeError("storage unavailable")
+
+    async def scenario():
+        cleanup = fuselink.sweeper(callback, grace=0.0)
+        cleanup.defer(("127.0.0.1", 50000))
+        cleanup.defer(("127.0.0.1", 50001))
+        await cleanup.sweep(fuselink.time() + 1)
+        return cleanup
+
+    cleanup = asyncio.run(scenario())
+    assert (cleanup.swept, cleanup.failed) == (0, 2)
+
+
+def test_expire_skips_live_sessions(storage):
+    async def scenario():
+        server = storage.servers()
+        live, gone = ["127.0.0.1", 50000], ["127.0.0.1", 50001]
+        for f1 in (live, gone):
+            await storage.server_data.insert_one({"network": {"send": f1, "recv": ["127.0.0.1", 1]}, "code": 1})
+            await storage.server_verif.insert_one({"network": {"send": f1}})
+        server.sessions[tuple(live)] = socket(tuple(live))
+        await server.expire([gone, live])
+        return [
+            [f2["network"]["send"] for f2 in await f1.find({}).to_list(length=None)]
+            for f1 in (storage.server_data.collections[0], storage.server_verif)
+        ]
+
+    assert asyncio.run(scenario()) == [[["127.0.0.1", 50000]], [["127.0.0.1", 50000]]]
+
+
+def test_reconnect_cancels_cleanup(storage):
+    async def scenario():
+        server = storage.servers()
+        address = ("127.0.0.1", 50000)
+        server.cleanup.defer(address)
+        ws = socket(address)
+        server.routes.open(ws.remote_address)
+        server.session(ws, address)
+        return server.cleanup.pending
+
+    assert asyncio.run(scenario()) == dict()
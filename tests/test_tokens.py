@@ -0,0 +1,71 @@
+import asyncio
+
+import fuselink
+from conftest import socket
+
+
+def test_token_round_trip_and_tampering():
+    signer = fuselink.tokens("secret", ttl=60)
+    token, nonce = signer.issue(["127.0.0.1", 50000], "client_a")
+    payload = signer.verify(token)
+    assert payload["address"] == ["127.0.0.1", 50000] and payload["type"] == "client_a" and payload["nonce"] == nonce
+    assert fuselink.tokens("other", ttl=60).verify(token) is None
+    body, signature = token.split(".")
+    assert signer.verify(F"{body}x.{signature}") is None
+    assert signer.verify("not a token") is None
+    assert fuselink.tokens("secret", ttl=0).issue(["127.0.0.1", 50000]) == (None, None)
+
+
+def test_token_expiry(monkeypatch):
+    signer = fuselink.tokens("secret", ttl=60)
+    token, nonce = signer.issue(["127.0.0.1", 50000])
+    now = fuselink.time()
+    monkeypatch.setattr(fuselink, "time", lambda: now + 59)
+    assert signer.verify(token) is not None
+    monkeypatch.setattr(fuselink, "time", lambda: now + 61)
+    assert signer.verify(token) is None
+
+
+def test_restore_consumes_token_once(storage):
+    async def scenario():
+        server = storage.servers()
+        address = ["127.0.0.1", 50000]
+        first, first_nonce = server.tokens.issue(address, "client_a")
+        await storage.server_verif.replace_one(
+            {"network.send": address}, {"network": {"send": address}, "nonce": first_nonce}, upsert=True
+        )
+        second, second_nonce = server.tokens.issue(address, "client_a")
+        await storage.server_verif.replace_one(
+            {"network.send": address}, {"network": {"send": address}, "nonce": second_nonce}, upsert=True
+        )
+        return [await server.restore(first), await server.restore(second), await server.restore(second)]
+
+    superseded, restored, replayed = asyncio.run(scenario())
+    assert superseded is None
+    assert restored["resume"] == ["127.0.0.1", 50000] and restored["res"]["verif"]
+    assert replayed is None
+
+
+def test_resume_rejects_replayed_token(storage):
+    async def verify(server, address, credentials):
+        ws = socket(address)
+        ws.inbox.append(fuselink.pack(credentials))
+        server.routes.open(ws.remote_address)
+        verif_data = await server.verif(ws)
+        reply = ws.messages()[-1]
+        return verif_data["network"]["send"], reply.get("resume"), ws.closed
+
+    async def scenario():
+        server = storage.servers()
+        server.tokens = fuselink.tokens(ttl=60)
+        origin, token, closed = await verify(server, ("127.0.0.1", 50001), fuselink.clients().credentials())
+        resumed, renewed, resumed_closed = await verify(server, ("127.0.0.1", 50002), {"resume": token})
+        replayed, stale, replayed_closed = await verify(server, ("127.0.0.1", 50003), {"resume": token})
+        again, _, again_closed = await verify(server, ("127.0.0.1", 50004), {"resume": renewed})
+        return origin, token, resumed, renewed, replayed, replayed_closed, again, again_closed
+
+    origin, token, resumed, renewed, replayed, replayed_closed, again, again_closed = asyncio.run(scenario())
+    assert token and renewed and renewed != token
+    assert resumed == origin == ["127.0.0.1", 50001]
+    assert replayed == ["127.0.0.1", 50003] and replayed_closed is not None
+    assert again == origin and again_closed is None